@@ -0,0 +1,65 @@
+"""Gunicorn configuration of the production server.
+
+usage: pipenv run gunicorn
+
+The app is created once in the master process, then forked into the
+workers, which share its memory (e.g. the trigram index) until they
+write to it. Database connections are not shared: each worker drops the
+pools inherited from the master and opens its own connections. Workers
+are replaced after serving a number of requests, to bound the memory
+they accumulate.
+
+With ``NOTES_ASYNC=1``, the workers serve the ASGI app of
+``notes/autoasgi.py`` instead, each on its event loop.
+"""
+import multiprocessing
+import os
+
+from notes.pool import worker_count
+
+budget = int(os.environ.get('NOTES_DB_CONNECTION_BUDGET', 90))
+
+if os.environ.get('NOTES_ASYNC', '0') == '1':
+    wsgi_app = 'notes.autoasgi:app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # Requests are not bound to threads: a connection each is enough to
+    # start a worker.
+    connections_per_worker = 1
+else:
+    wsgi_app = 'notes.autoapp:app'
+    worker_class = 'gthread'
+    # Threads per worker, serving requests while others wait on the
+    # database. Exported for the app, which keeps a connection per thread.
+    threads = int(os.environ.setdefault('NOTES_THREADS', '4'))
+    connections_per_worker = threads
+
+# Worker processes, two per core and one by default, as many as the
+# database connection budget allows. Exported for the app, which splits
+# the budget between them.
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', str(worker_count(
+    budget, connections_per_worker, multiprocessing.cpu_count()))))
+if workers > budget:
+    raise RuntimeError(f'{workers} workers cannot share a budget of '
+                       f'{budget} database connections')
+
+bind = os.environ.get('NOTES_BIND', '0.0.0.0:5000')
+preload_app = True
+
+# A worker is replaced after this many requests, give or take the
+# jitter, so that workers are not all replaced at once.
+max_requests = int(os.environ.get('NOTES_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('NOTES_MAX_REQUESTS_JITTER', 100))
+
+timeout = 30
+graceful_timeout = 30
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    from notes.app import reset_after_fork
+    from notes.asgi import AsyncApp
+
+    app = server.app.wsgi()
+    if isinstance(app, AsyncApp):
+        app = app.app
+    reset_after_fork(app)
@@ -0,0 +1,30 @@
+"""add a version to notes
+
+Revision ID: 2c7a5e8f4d10
+Revises: 9d4e27c1b3f8
+Create Date: 2026-10-18 13:24:51.806372
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import notes.domain.sql
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7a5e8f4d10'
+down_revision = '9d4e27c1b3f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing SQLite databases keep reusing the id of the last deleted
+    # note: rebuilding the table with AUTOINCREMENT would cascade the
+    # drop to note_share. Only new databases, and Postgres, are immune.
+    op.add_column('notes', sa.Column('version', sa.Integer(),
+                                     nullable=False, server_default='1'))
+
+
+def downgrade():
+    # Plain DROP COLUMN (SQLite 3.35+), see the comment above.
+    op.drop_column('notes', 'version')
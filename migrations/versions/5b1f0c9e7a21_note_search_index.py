@@ -0,0 +1,64 @@
+"""add full-text search index on notes
+
+Revision ID: 5b1f0c9e7a21
+Revises: 03a23fe79ff7
+Create Date: 2026-10-18 10:12:44.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import notes.domain.sql
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f0c9e7a21'
+down_revision = '03a23fe79ff7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        # A stored generated column is backfilled when it is added and
+        # kept current by Postgres on every INSERT and UPDATE.
+        op.execute(
+            "ALTER TABLE notes ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', note_description)) "
+            "STORED")
+        op.execute("CREATE INDEX ix_notes_search_vector ON notes "
+                   "USING GIN (search_vector)")
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE notes_fts USING fts5("
+            "note_description, content='notes', content_rowid='note_id')")
+        op.execute(
+            "CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes BEGIN "
+            "INSERT INTO notes_fts(rowid, note_description) "
+            "VALUES (new.note_id, new.note_description); END")
+        op.execute(
+            "CREATE TRIGGER notes_fts_ad AFTER DELETE ON notes BEGIN "
+            "INSERT INTO notes_fts(notes_fts, rowid, note_description) "
+            "VALUES ('delete', old.note_id, old.note_description); END")
+        op.execute(
+            "CREATE TRIGGER notes_fts_au AFTER UPDATE OF note_description "
+            "ON notes BEGIN "
+            "INSERT INTO notes_fts(notes_fts, rowid, note_description) "
+            "VALUES ('delete', old.note_id, old.note_description); "
+            "INSERT INTO notes_fts(rowid, note_description) "
+            "VALUES (new.note_id, new.note_description); END")
+        op.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_notes_search_vector")
+        op.drop_column('notes', 'search_vector')
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS notes_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS notes_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS notes_fts_ai")
+        op.execute("DROP TABLE IF EXISTS notes_fts")
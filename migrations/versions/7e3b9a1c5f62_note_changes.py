@@ -0,0 +1,74 @@
+"""track note changes for delta sync
+
+Revision ID: 7e3b9a1c5f62
+Revises: 2c7a5e8f4d10
+Create Date: 2026-10-18 14:41:09.273118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import notes.domain.sql
+from notes.domain.sql import CurrentTimestampMicros
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3b9a1c5f62'
+down_revision = '2c7a5e8f4d10'
+branch_labels = None
+depends_on = None
+
+# SQLite cannot add a column with a non-constant default: existing rows
+# get a constant one, then the current time.
+EPOCH = '1970-01-01 00:00:00.000000'
+
+
+def _add_timestamps(table_name, column_names):
+    for column_name in column_names:
+        op.add_column(table_name, sa.Column(
+            column_name, notes.domain.sql.DateTimeMicros(), nullable=False,
+            server_default=EPOCH))
+
+    table = sa.table(table_name,
+                     *[sa.column(column_name) for column_name in column_names])
+    op.execute(table.update().values(
+        {column_name: CurrentTimestampMicros()
+         for column_name in column_names}))
+
+    if op.get_bind().dialect.name != 'sqlite':
+        for column_name in column_names:
+            op.alter_column(table_name, column_name, server_default=None)
+
+
+def upgrade():
+    _add_timestamps('notes', ['created_at', 'updated_at'])
+    _add_timestamps('note_share', ['created_at'])
+    op.create_index('ix_notes_owner_id_updated_at', 'notes',
+                    ['owner_id', 'updated_at'], unique=False)
+    op.create_index('ix_note_share_user_id_created_at', 'note_share',
+                    ['user_id', 'created_at'], unique=False)
+
+    op.create_table('note_tombstone',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('note_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.String(length=511), nullable=False),
+    sa.Column('reason', sa.String(length=16), nullable=False),
+    sa.Column('removed_at', notes.domain.sql.DateTimeMicros(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['note_user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_note_tombstone_user_id_removed_at', 'note_tombstone',
+                    ['user_id', 'removed_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_note_tombstone_user_id_removed_at',
+                  table_name='note_tombstone')
+    op.drop_table('note_tombstone')
+    op.drop_index('ix_note_share_user_id_created_at', table_name='note_share')
+    op.drop_index('ix_notes_owner_id_updated_at', table_name='notes')
+
+    # Plain DROP COLUMN (SQLite 3.35+): a batch migration would rebuild
+    # notes, and dropping the old table cascades to note_share.
+    op.drop_column('note_share', 'created_at')
+    op.drop_column('notes', 'updated_at')
+    op.drop_column('notes', 'created_at')
@@ -0,0 +1,34 @@
+"""make note shares unique per note and user
+
+Revision ID: 9d4e27c1b3f8
+Revises: 5b1f0c9e7a21
+Create Date: 2026-10-18 11:02:17.540391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import notes.domain.sql
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4e27c1b3f8'
+down_revision = '5b1f0c9e7a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Shares were not deduplicated before, keep the oldest of each pair.
+    op.execute(
+        "DELETE FROM note_share WHERE id NOT IN ("
+        "SELECT MIN(id) FROM note_share GROUP BY source_id, user_id)")
+
+    with op.batch_alter_table('note_share') as batch_op:
+        batch_op.create_unique_constraint(
+            'uq_note_share_source_id_user_id', ['source_id', 'user_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('note_share') as batch_op:
+        batch_op.drop_constraint('uq_note_share_source_id_user_id',
+                                 type_='unique')
@@ -0,0 +1,68 @@
+"""store the language of notes and index them with its configuration
+
+Revision ID: b4d8f2a6c913
+Revises: 7e3b9a1c5f62
+Create Date: 2026-10-18 15:37:22.914655
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import notes.domain.sql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4d8f2a6c913'
+down_revision = '7e3b9a1c5f62'
+branch_labels = None
+depends_on = None
+
+# notes.domain.search.POSTGRES_DDL at this revision, copied so later
+# changes to the search configurations do not change what it does.
+POSTGRES_DDL = [
+    "ALTER TABLE notes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    "(to_tsvector(CASE language "
+    "WHEN 'da' THEN 'danish'::regconfig "
+    "WHEN 'de' THEN 'german'::regconfig "
+    "WHEN 'en' THEN 'english'::regconfig "
+    "WHEN 'es' THEN 'spanish'::regconfig "
+    "WHEN 'fi' THEN 'finnish'::regconfig "
+    "WHEN 'fr' THEN 'french'::regconfig "
+    "WHEN 'hu' THEN 'hungarian'::regconfig "
+    "WHEN 'it' THEN 'italian'::regconfig "
+    "WHEN 'nl' THEN 'dutch'::regconfig "
+    "WHEN 'no' THEN 'norwegian'::regconfig "
+    "WHEN 'pt' THEN 'portuguese'::regconfig "
+    "WHEN 'ro' THEN 'romanian'::regconfig "
+    "WHEN 'ru' THEN 'russian'::regconfig "
+    "WHEN 'sv' THEN 'swedish'::regconfig "
+    "WHEN 'tr' THEN 'turkish'::regconfig "
+    "ELSE 'simple'::regconfig END, note_description)) STORED",
+    "CREATE INDEX ix_notes_search_vector ON notes USING GIN (search_vector)",
+]
+
+
+def upgrade():
+    # Filled by scripts/backfill_note_language.py for existing notes.
+    op.add_column('notes', sa.Column('language', sa.String(length=8),
+                                     nullable=True))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # The expression of a generated column cannot be altered.
+        op.execute("DROP INDEX IF EXISTS ix_notes_search_vector")
+        op.drop_column('notes', 'search_vector')
+        for statement in POSTGRES_DDL:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_notes_search_vector")
+        op.drop_column('notes', 'search_vector')
+        op.execute(
+            "ALTER TABLE notes ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', note_description)) "
+            "STORED")
+        op.execute("CREATE INDEX ix_notes_search_vector ON notes "
+                   "USING GIN (search_vector)")
+
+    op.drop_column('notes', 'language')
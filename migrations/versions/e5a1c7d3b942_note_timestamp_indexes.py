@@ -0,0 +1,28 @@
+"""index the timestamps of notes and tombstones across users
+
+Revision ID: e5a1c7d3b942
+Revises: b4d8f2a6c913
+Create Date: 2026-10-18 18:12:40.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1c7d3b942'
+down_revision = 'b4d8f2a6c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_notes_updated_at', 'notes', ['updated_at'],
+                    unique=False)
+    op.create_index('ix_note_tombstone_removed_at', 'note_tombstone',
+                    ['removed_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_note_tombstone_removed_at', table_name='note_tombstone')
+    op.drop_index('ix_notes_updated_at', table_name='notes')
@@ -1,20 +1,33 @@
 """The app module, containing the app factory function."""
 import logging
-import sys
-import traceback
 
 from flask import Flask
 from flask import Response
 from flask import make_response
+from flask import request
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 import notes.errors as error
 
 from notes import note
 from notes import auth
+from notes import stats
 from notes.extensions import db
+from notes.extensions import error_log
+from notes.extensions import limiter
 from notes.extensions import ma
 from notes.extensions import migrate
+from notes.extensions import note_cache
+from notes.extensions import note_index
+from notes.extensions import passwords
+from notes.extensions import pool_metrics
+from notes.extensions import replicas
+from notes.extensions import token_cache
+from notes.extensions import user_lookup_cache
 from notes.settings import ProdConfig
+from notes.settings import use_async_drivers
 
 
 def create_app(config_object=None):
@@ -33,9 +46,16 @@ def create_app(config_object=None):
     app = Flask(__name__.split('.')[0])
 
     app.config.from_object(config_object)
+    if app.config.get('NOTES_ASYNC'):
+        use_async_drivers(app.config)
+    register_proxies(app)
     register_extensions(app)
     register_blueprints(app)
     register_shellcontext(app)
+    if not app.config.get('NOTES_ASYNC'):
+        # The asyncio drivers only run in a greenlet: the ASGI app starts
+        # up on its lifespan event instead.
+        start_up(app)
 
     @app.errorhandler(Exception)
     def handle_uncaught_exceptions(e: Exception):
@@ -43,45 +63,104 @@ def create_app(config_object=None):
         Handle uncaught exceptions happening in the views. There
         are some special cases for custom exceptions.
 
-        :param e: The Exception being passed. Since we cannot seem
-            to be able to extract the stacktrace from the Exception object, we
-            rely on sys.exc_info() instead that go fetch the latest error in
-            the current thread.
+        Client errors are logged without their stack, server errors with
+        it, each kind once per window of the error log.
+
+        :param e: The Exception being passed.
 
         :return Response: A Flask response with the appropriate message for
             the type of exception.
         """
 
         if isinstance(e, error.NotFound):
-            logging.exception(e.message)
+            error_log.client_error(e.code, e.key, request.endpoint)
             new_e = error.NotFound(message="Resource not found.")
             return Response(repr(new_e),
                             new_e.code,
                             content_type='application/json')
+        if isinstance(e, error.Error) and e.code < 500:
+            error_log.client_error(e.code, e.key, request.endpoint)
+            response = Response(repr(e), e.code,
+                                content_type='application/json')
+            if getattr(e, 'retry_after', None) is not None:
+                response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        if isinstance(e, HTTPException) and e.code < 500:
+            # E.g. an unknown URL or method, from the routing
+            error_log.client_error(e.code, e.name, request.endpoint)
+            return e
+
+        error_log.server_error(e)
         if isinstance(e, error.Error):
-            logging.exception(e)
             return Response(repr(e), e.code, content_type='application/json')
-        else:
-            traceback_str = "".join(
-                traceback.format_exception(*sys.exc_info()))
-            logging.warning(f'unhandled exception occurred \n{traceback_str}')
 
         return make_response('unhandled exception occurred', 500)
 
     return app
 
 
+def register_proxies(app):
+    """Trust the ``X-Forwarded-*`` headers of the proxies in front of the
+    app, so requests are seen from the address of the client, which the
+    rate limits count anonymous requests by."""
+    proxies = app.config.get('NOTES_TRUSTED_PROXIES', 0)
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies,
+                                x_proto=proxies)
+
+
 def register_extensions(app):
     """Register Flask extensions."""
+    # Registers the replicas as binds, which db reads on init.
+    replicas.init_app(app)
     db.init_app(app)
+    pool_metrics.init_app(app)
     ma.init_app(app)
     migrate.init_app(app, db)
+    note_cache.init_app(app)
+    note_index.init_app(app)
+    token_cache.init_app(app)
+    user_lookup_cache.init_app(app)
+    limiter.init_app(app)
+    error_log.init_app(app)
+    passwords.init_app(app)
+
+
+def reset_after_fork(app):
+    """Drop the database connections inherited from the parent process.
+
+    Called in each worker of a pre-forking server. The pools are replaced
+    by empty ones without closing the connections, which the parent and
+    the other workers still hold, so every worker opens its own.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    pool_metrics.reset()
+
+
+def start_up(app):
+    """Measure the lag of the replicas and build the in-process indexes
+    enabled in the configuration, before serving requests."""
+    with app.app_context():
+        replicas.refresh_lags()
+
+        if not app.config.get('NOTES_TRIGRAM_INDEX_ENABLED'):
+            return
+
+        try:
+            note.controller.build_note_index()
+        except SQLAlchemyError:
+            # E.g. the tables do not exist yet: the index is built in
+            # the background by the first fuzzy search instead.
+            logging.exception('Could not build the trigram index')
 
 
 def register_blueprints(app):
     """Register Flask blueprints."""
     app.register_blueprint(note.views.blueprint)
     app.register_blueprint(auth.views.blueprint)
+    app.register_blueprint(stats.views.blueprint)
 
 
 def register_shellcontext(app):
@@ -0,0 +1,178 @@
+"""Serving of the app over ASGI, on the asyncio database drivers.
+
+The WSGI app serves a request per thread, so the requests a worker
+serves at once are bounded by its threads, each blocked for as long as
+its request waits on the database or on the client.
+
+:class:`AsyncApp` serves the same Flask app from an event loop: each
+request runs in a greenlet, and the database drivers of asyncio
+(asyncpg for Postgres, aiosqlite for SQLite) hand the loop over to the
+other requests while waiting on the database, like ``AsyncSession``
+does with the SQLAlchemy ORM. The views, controllers and sessions are
+the ones of the WSGI app. A request only costs a greenlet, so a worker
+holds thousands of mostly-idle connections; the database connections it
+opens are still bounded by its pool.
+
+Work that does not wait on the database, such as detecting languages,
+runs on the loop and holds back the other requests of the worker while
+it runs. Passwords are hashed on the threads of
+:class:`notes.passwords.PasswordHasher` instead, which the loop awaits.
+"""
+import io
+import sys
+
+from sqlalchemy.util import await_only
+from sqlalchemy.util import greenlet_spawn
+
+from notes.app import start_up
+from notes.extensions import db
+
+
+def wsgi_environ(scope, body) -> dict:
+    """Build the WSGI environ of an ASGI HTTP request.
+
+    :param dict scope: Connection scope of the request.
+    :param bytes body: Body of the request.
+
+    :return: The environ, as described by PEP 3333.
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client_host, client_port = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client_host,
+        'REMOTE_PORT': str(client_port),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = f'{environ[name]}{separator}{value}'
+        environ[name] = value
+
+    # The body is read whole, chunked or not.
+    environ['CONTENT_LENGTH'] = str(len(body))
+
+    return environ
+
+
+class _Responder(object):
+    """Relays the response of the WSGI app to the ASGI server, from the
+    greenlet of the request."""
+
+    def __init__(self, send):
+        self.send = send
+        self.status = None
+        self.headers = None
+        self.started = False
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is not None and self.started:
+            raise exc_info[1].with_traceback(exc_info[2])
+
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = [(name.lower().encode('latin-1'),
+                         value.encode('latin-1')) for name, value in headers]
+
+        return self.write
+
+    def write(self, body, more_body=True):
+        if not self.started:
+            self.started = True
+            await_only(self.send({
+                'type': 'http.response.start',
+                'status': self.status,
+                'headers': self.headers,
+            }))
+
+        await_only(self.send({
+            'type': 'http.response.body',
+            'body': body,
+            'more_body': more_body,
+        }))
+
+
+class AsyncApp(object):
+    """
+    ASGI app serving a Flask app whose database runs on asyncio drivers.
+
+    :param app: Flask app created with ``NOTES_ASYNC`` set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await self._read_body(receive)
+            if body is not None:
+                await greenlet_spawn(self._respond, wsgi_environ(scope, body),
+                                     _Responder(send))
+        else:
+            raise NotImplementedError(f'Unsupported scope {scope["type"]}')
+
+    async def _read_body(self, receive):
+        """Return the body of the request, or ``None`` if the client
+        disconnected before sending it."""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    def _respond(self, environ, responder):
+        # Streamed responses read from the database while being iterated,
+        # so they are iterated in the greenlet as well.
+        chunks = self.app(environ, responder.start_response)
+        try:
+            for chunk in chunks:
+                if chunk:
+                    responder.write(chunk)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+        responder.write(b'', more_body=False)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await greenlet_spawn(start_up, self.app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await greenlet_spawn(self._dispose_engines)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _dispose_engines(self):
+        with self.app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
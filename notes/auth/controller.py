@@ -1,32 +1,42 @@
 import uuid
-import base64
 import logging
+from flask import current_app
 import notes.errors as error
+from notes.auth import queries
 from notes.auth import utils
 from notes.domain.models import User
+from notes.domain.sql import insert_ignoring_conflicts
 from notes.extensions import db
+from notes.extensions import passwords
+from notes.extensions import user_lookup_cache
 
 def register(body: dict) -> dict:
+    """Create a user with a single ``INSERT ... ON CONFLICT DO NOTHING``.
+
+    The unique constraint on ``email`` does the existence check: when no
+    row comes back, the email is already taken.
+    """
     email = body['email']
-    password = base64.b64encode(body['password'].encode('ascii')).decode('ascii')
+    password = passwords.hash(body['password'])
     first_name = body.get('first_name', None)
     last_name = body.get('last_name', None)
     _uuid = uuid.uuid4()
     user_id = str(_uuid)
 
-    user = User.query.filter(
-            User.email == email,
-        ).first()
+    statement = insert_ignoring_conflicts(
+        db.session.get_bind().dialect.name, User, [User.email]).values(
+            id=user_id,
+            email=email,
+            password=password,
+            first_name=first_name,
+            last_name=last_name).returning(
+                User.id, User.email, User.first_name, User.last_name)
+    user = db.session.execute(statement).one_or_none()
 
-    if user:
+    if not user:
+        db.session.rollback()
         raise error.Conflict(message='User already exists.')
 
-    user = User(id=user_id,
-                email=email,
-                password=password,
-                first_name=first_name,
-                last_name=last_name)
-    user.add()
     db.session.commit()
 
     user_dict = utils.user_to_dict(user)
@@ -40,20 +50,28 @@ def register(body: dict) -> dict:
 
 
 def login(body: dict):
+    """Authenticate a user by email and password.
+
+    A password stored base64 encoded, or hashed with other parameters
+    than configured, is hashed again and stored, which costs an
+    ``UPDATE`` on that login only.
+    """
     email = body.get('email')
     password = body.get('password')
 
-    user = User.query.filter(
-        User.email == email,
-    ).first()
+    user = queries.user_credentials(email)
 
     if not user:
         raise error.Unauthorized(message='There is an account with this user')
     
-    if password != base64.b64decode(user.password.encode('ascii')).decode('ascii'):
+    if not passwords.verify(password, user.password):
         raise error.Unauthorized(message='Incorrect user or password')
 
-    user = User.query.filter(User.id == user.id).first()
+    if passwords.needs_rehash(user.password):
+        queries.rehash_password(user.id, user.password,
+                                passwords.hash(password))
+        db.session.commit()
+
     user_dict = utils.user_to_dict(user)
     token = utils.encode_auth_token(user_dict['id'])
     body = {
@@ -62,3 +80,39 @@ def login(body: dict):
     }
     
     return body
+
+
+def lookup_users(body: dict) -> dict:
+    """Resolve emails to users, e.g. the recipients of shares.
+
+    Users found recently are served from the lookup cache, the others
+    are read with a single query.
+
+    :param body: Object with an ``emails`` list.
+
+    :return: The public fields of the users found, in the order of their
+        emails, and the emails of no user.
+    """
+    emails = body.get('emails') if isinstance(body, dict) else None
+    if (not isinstance(emails, list)
+            or not all(isinstance(email, str) for email in emails)):
+        raise error.BadRequest('emails must be a list of strings')
+
+    emails = list(dict.fromkeys(emails))
+    if len(emails) > current_app.config['NOTES_USER_LOOKUP_LIMIT']:
+        raise error.PayloadTooLarge(
+            message='At most {} emails can be looked up at once'.format(
+                current_app.config['NOTES_USER_LOOKUP_LIMIT']))
+
+    users = user_lookup_cache.get_many(emails)
+    uncached = [email for email in emails if email not in users]
+    if uncached:
+        found = [utils.user_to_dict(user)
+                 for user in queries.users_by_email(uncached)]
+        user_lookup_cache.set_many(found)
+        users.update((user['email'], user) for user in found)
+
+    return {
+        'users': [users[email] for email in emails if email in users],
+        'missing': [email for email in emails if email not in users]
+    }
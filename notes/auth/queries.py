@@ -0,0 +1,56 @@
+"""Queries of users, run on every authenticated request.
+
+The statements are built once, at import, with bound parameters, so
+their SQL is compiled once per process.
+"""
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import update
+
+from notes.domain.models import User
+from notes.extensions import db
+
+USER_BY_ID = select(User.id, User.email, User.first_name,
+                    User.last_name).where(User.id == bindparam('user_id'))
+USER_CREDENTIALS = select(
+    User.id, User.email, User.first_name, User.last_name,
+    User.password).where(User.email == bindparam('email'))
+USERS_BY_EMAIL = select(
+    User.id, User.email, User.first_name, User.last_name).where(
+        User.email.in_(bindparam('emails', expanding=True)))
+# Of the table, not the mapper: a password change leaves the cached
+# tokens of the user valid.
+REHASH_PASSWORD = update(User.__table__).where(
+    User.__table__.c.id == bindparam('user_id'),
+    User.__table__.c.password == bindparam('old_password')).values(
+        password=bindparam('new_password'))
+
+
+def user_by_id(user_id):
+    """Read the profile of the user with id ``user_id``, or ``None``.
+
+    The row is not bound to the session, so it can outlive the request.
+    """
+    return db.session.execute(USER_BY_ID,
+                              {'user_id': user_id}).one_or_none()
+
+
+def user_credentials(email):
+    """Read the profile and password of the user with ``email``, or
+    ``None``."""
+    return db.session.execute(USER_CREDENTIALS,
+                              {'email': email}).one_or_none()
+
+
+def users_by_email(emails):
+    """Read the profiles of the users with the given ``emails``, with a
+    single ``IN`` query on the unique index of ``email``."""
+    return db.session.execute(USERS_BY_EMAIL, {'emails': emails}).all()
+
+
+def rehash_password(user_id, old_password, new_password):
+    """Replace the stored password of the user with id ``user_id``, unless
+    it changed since it was read as ``old_password``."""
+    db.session.execute(REHASH_PASSWORD, {'user_id': user_id,
+                                         'old_password': old_password,
+                                         'new_password': new_password})
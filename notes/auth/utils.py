@@ -44,3 +44,15 @@ def decode_auth_token(auth_token):
     except jwt.InvalidTokenError:
         return 'Invalid token. Please log in again.'
 
+
+
+def decode_auth_claims(auth_token):
+    """
+    Decodes and verifies the auth token
+    :param auth_token:
+    :return: dict of the claims, or None if the token is invalid or expired
+    """
+    try:
+        return jwt.decode(auth_token, 'SECRET_KEY', algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
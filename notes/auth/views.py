@@ -1,32 +1,76 @@
 import logging
-from ratelimit import limits
 from functools import wraps
 from flask import Blueprint
+from flask import g
 from flask import jsonify
 from flask import request
 import notes.errors as error
 
 from notes.auth import controller
+from notes.auth import queries
 from notes.auth import utils
-from notes.domain.models import User
+from notes.extensions import limiter
+from notes.extensions import replicas
+from notes.extensions import token_cache
 
 blueprint = Blueprint('auth', __name__, url_prefix='/auth')
 
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
 
-def _get_user_from_token(token) -> User:
-    try:
-        user_id = utils.decode_auth_token(token)
-    except KeyError:
-        raise error.Unauthorized()
-    except Exception as exc:
-        logging.error(exc)
-        raise error.ServiceUnavailable('Unknown error while trying to validate token')
 
-    user = User.query.filter(User.id == user_id).first()
+def _resolve_token(token):
+    """Return the ``(claims, user)`` of ``token``, from the token cache,
+    or decoded with no user yet.
+
+    Resolved once per request: :func:`read_only` needs the user id
+    before :func:`token_required` loads the user, so the result is kept
+    in ``g`` until :func:`_get_user_from_token` takes it.
+    """
+    resolved = g.get('auth_token')
+    if resolved is not None and resolved[0] == token:
+        return resolved[1:]
+
+    cached = token_cache.get(token)
+    if cached is not None:
+        claims, user = cached
+    else:
+        try:
+            claims, user = utils.decode_auth_claims(token), None
+        except KeyError:
+            raise error.Unauthorized()
+        except Exception as exc:
+            logging.error(exc)
+            raise error.ServiceUnavailable('Unknown error while trying to validate token')
+
+    g.auth_token = (token, claims, user)
+
+    return claims, user
+
+
+def _get_user_from_token(token):
+    """Return the row of the user authenticated by ``token``.
+
+    Tokens seen recently are resolved from the token cache, without
+    decoding them or querying the database. A user missing from the
+    replica read from is looked up again on the primary, which the
+    replica may not have caught up with yet.
+    """
+    claims, user = _resolve_token(token)
+    g.pop('auth_token', None)
+    if user is not None:
+        return user
+
+    user = queries.user_by_id(claims['sub']) if claims else None
+
+    if not user and claims and replicas.current() is not None:
+        with replicas.primary():
+            user = queries.user_by_id(claims['sub'])
 
     if not user:
         raise error.Unauthorized('Invalid Token')
 
+    token_cache.set(token, claims, user)
+
     return user
 
 
@@ -36,26 +80,65 @@ def token_required(f):
         if 'Authorization' in request.headers:
             token = request.headers['Authorization']
             user = _get_user_from_token(token)
-            return f(user, *args, **kwargs)
+            user_id = user.id
+            # Tells the rate limiter who the user is; g outlives the
+            # request when the app context was pushed beforehand.
+            g.user_id = user_id
+            try:
+                response = f(user, *args, **kwargs)
+            finally:
+                g.pop('user_id', None)
+            if request.method not in READ_METHODS:
+                replicas.record_write(user_id)
+            return response
         raise error.Unauthorized('Token is missing')
 
     return decorated
 
 
+def read_only(f):
+    """Send the queries of a view to a read replica.
+
+    Apply it above :func:`token_required`, so the user of the token is
+    read from the replica too. Users who wrote recently keep reading
+    from the primary.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = request.headers.get('Authorization')
+        claims, _ = _resolve_token(token) if token else (None, None)
+        with replicas.reading(claims['sub'] if claims else None):
+            return f(*args, **kwargs)
+
+    return decorated
+
+
 @blueprint.route('/sign_up', methods=['POST'])
-@limits(calls=15, period=900)
+@limiter.limit(calls=15, period=900)
 def register():
     body = request.get_json()
     user = controller.register(body=body)
+    replicas.record_write(user['user']['id'])
 
     return jsonify(user)
 
 
 @blueprint.route('/login', methods=['POST'])
-@limits(calls=10, period=900)
+@limiter.limit(calls=10, period=900)
 def login():
     body = request.get_json()
     response = controller.login(body=body)
 
     return jsonify(response)
 
+
+
+@blueprint.route('/users/lookup', methods=['POST'])
+@read_only
+@token_required
+@limiter.limit(calls=15, period=900)
+def lookup_users(current_user):
+    body = request.get_json()
+    response = controller.lookup_users(body=body)
+
+    return jsonify(response)
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""Create an ASGI application instance, on the asyncio database drivers."""
+from flask.helpers import get_debug_flag
+
+from notes.app import create_app
+from notes.asgi import AsyncApp
+from notes.settings import DevConfig
+from notes.settings import ProdConfig
+
+CONFIG = DevConfig if get_debug_flag() else ProdConfig
+
+config = CONFIG()
+config.NOTES_ASYNC = True
+
+app = AsyncApp(create_app(config))
@@ -0,0 +1,422 @@
+"""In-process caches.
+
+Each worker process keeps its own caches: invalidations are only seen
+by the process that performs the write, so entries served by other
+workers can be stale for at most their TTL.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping bounded in size, with a time-to-live per entry.
+
+    :param int maxsize: Maximum number of entries kept. The least
+        recently used entry is evicted to make room for a new one.
+    :param float ttl: Number of seconds an entry stays valid.
+    :param on_evict: Optional callable receiving ``(key, value)`` for
+        every entry dropped because of its size, TTL or an explicit
+        deletion.
+    :param clock: Callable returning the current time in seconds.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, on_evict=None,
+                 clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def _drop(self, key):
+        value, _ = self._data.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        """Return the value cached for ``key``, or ``default``."""
+        with self._lock:
+            value, expires_at = self._data.get(key, (_MISSING, None))
+
+            if value is not _MISSING and expires_at <= self.clock():
+                self._drop(key)
+                self.expirations += 1
+                value = _MISSING
+
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Cache ``value`` under ``key`` for ``ttl`` seconds at most."""
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+            self._data[key] = (value, expires_at)
+
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        """Drop ``key`` from the cache, if present."""
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self):
+        """Drop every entry, without resetting the counters."""
+        with self._lock:
+            for key in list(self._data):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class NoteListingCache(object):
+    """
+    Per-user cache of note responses.
+
+    Entries are grouped by user, and the least recently used users are
+    evicted first. The ids of the shared notes a response depends on
+    are tracked, so a change to a shared note invalidates the listings
+    of everyone it has been shared with without querying the database.
+
+    Initialized in the app factory from the ``NOTES_CACHE_*`` settings.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dependents = {}
+        self.enabled = False
+        self.max_keys_per_user = 32
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0
+        self._users = LRUCache(on_evict=self._forget_user)
+
+    def init_app(self, app):
+        with self._lock:
+            self.enabled = app.config.get('NOTES_CACHE_ENABLED', False)
+            self.max_keys_per_user = app.config.get(
+                'NOTES_CACHE_MAX_KEYS_PER_USER', 32)
+            self._users.clear()
+            self._users.maxsize = app.config.get('NOTES_CACHE_MAX_USERS',
+                                                 10000)
+            self._users.ttl = app.config.get('NOTES_CACHE_TTL', 30)
+
+    def _forget_user(self, user_id, entry):
+        for note_id in entry['depends_on']:
+            dependents = self._dependents.get(note_id)
+            if dependents is not None:
+                dependents.discard(user_id)
+                if not dependents:
+                    del self._dependents[note_id]
+
+    def get(self, user_id, key):
+        """Return the response cached for ``user_id`` under ``key``."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._users.get(user_id)
+            value = entry['values'].get(key) if entry else None
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return value
+
+    def set(self, user_id, key, value, depends_on=(), generation=None):
+        """Cache a response for ``user_id``.
+
+        :param depends_on: Ids of notes owned by someone else that appear
+            in ``value``.
+        :param generation: Value of :attr:`generation` read before the
+            response was loaded. If anything was invalidated since then,
+            the response may be outdated and is not cached.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = {'values': OrderedDict(), 'depends_on': set()}
+                self._users.set(user_id, entry)
+
+            entry['values'][key] = value
+            while len(entry['values']) > self.max_keys_per_user:
+                entry['values'].popitem(last=False)
+
+            for note_id in depends_on:
+                entry['depends_on'].add(note_id)
+                self._dependents.setdefault(note_id, set()).add(user_id)
+
+    def invalidate_users(self, user_ids):
+        """Drop every response cached for the given users."""
+        with self._lock:
+            self.generation += 1
+            for user_id in user_ids:
+                if user_id in self._users:
+                    self._users.delete(user_id)
+                    self.invalidations += 1
+
+    def invalidate_notes(self, note_ids):
+        """Drop the responses of the users a note is shared with."""
+        with self._lock:
+            user_ids = set()
+            for note_id in note_ids:
+                user_ids.update(self._dependents.get(note_id, ()))
+            self.invalidate_users(user_ids)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = self._users.stats()
+            stats.update({
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            })
+
+            return stats
+
+
+class TokenCache(object):
+    """
+    Cache of the users authenticated by tokens.
+
+    Entries are keyed by a digest of the token, so the cache holds no
+    usable credential, and hold the verified claims of the token with a
+    row of its user, detached from any session. An entry expires with
+    its token, or after the TTL if sooner. The tokens of each user are
+    tracked, so a change to a user drops all of them.
+
+    Only the changes made through this process are seen: those made
+    through other workers, or by statements on the table, are served
+    stale until the entries expire. The TTL bounds how long a deleted
+    user stays authenticated, and is kept to seconds for that reason.
+
+    Initialized in the app factory from the ``NOTES_TOKEN_CACHE_*``
+    settings.
+
+    :param clock: Callable returning the current time in seconds since
+        the epoch, the unit of the expiry of tokens.
+    """
+
+    def __init__(self, clock=time.time):
+        self._lock = threading.RLock()
+        self._digests = {}
+        self.enabled = False
+        self.invalidations = 0
+        self._tokens = LRUCache(on_evict=self._forget_token, clock=clock)
+
+    def init_app(self, app):
+        with self._lock:
+            self.enabled = app.config.get('NOTES_TOKEN_CACHE_ENABLED', False)
+            self._tokens.clear()
+            self._tokens.maxsize = app.config.get(
+                'NOTES_TOKEN_CACHE_MAX_TOKENS', 100000)
+            self._tokens.ttl = app.config.get('NOTES_TOKEN_CACHE_TTL', 5)
+
+    @staticmethod
+    def digest(token) -> str:
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+
+        return hashlib.sha256(token).hexdigest()
+
+    def _forget_token(self, digest, entry):
+        _, user = entry
+        digests = self._digests.get(user.id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._digests[user.id]
+
+    def get(self, token):
+        """Return the ``(claims, user)`` cached for ``token``, or
+        ``None``."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            return self._tokens.get(self.digest(token))
+
+    def set(self, token, claims, user):
+        """Cache the user authenticated by ``token`` until the token
+        expires, for the TTL at most.
+
+        :param dict claims: Verified claims of the token.
+        :param user: Row of the user, with an ``id``.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            ttl = self._tokens.ttl
+            if 'exp' in claims:
+                ttl = min(ttl, claims['exp'] - self._tokens.clock())
+            if ttl <= 0:
+                return
+
+            digest = self.digest(token)
+            self._tokens.set(digest, (claims, user), ttl=ttl)
+            self._digests.setdefault(user.id, set()).add(digest)
+
+    def invalidate_users(self, user_ids):
+        """Drop the tokens of the given users."""
+        with self._lock:
+            for user_id in user_ids:
+                for digest in list(self._digests.get(user_id, ())):
+                    self._tokens.delete(digest)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = self._tokens.stats()
+            stats.update({
+                'enabled': self.enabled,
+                'users': len(self._digests),
+                'invalidations': self.invalidations,
+            })
+
+            return stats
+
+
+class UserLookupCache(object):
+    """
+    Cache of the users resolved by email.
+
+    Entries hold the public fields of a user, keyed by email. Emails of
+    no user are not cached, so a user signing up can be found at once.
+    The emails of each user are tracked, so a change to a user drops
+    them.
+
+    Initialized in the app factory from the ``NOTES_USER_LOOKUP_CACHE_*``
+    settings.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._emails = {}
+        self.enabled = False
+        self.invalidations = 0
+        self._users = LRUCache(on_evict=self._forget_email)
+
+    def init_app(self, app):
+        with self._lock:
+            self.enabled = app.config.get('NOTES_USER_LOOKUP_CACHE_ENABLED',
+                                          False)
+            self._users.clear()
+            self._users.maxsize = app.config.get(
+                'NOTES_USER_LOOKUP_CACHE_MAX_USERS', 100000)
+            self._users.ttl = app.config.get('NOTES_USER_LOOKUP_CACHE_TTL',
+                                             300)
+
+    def _forget_email(self, email, user):
+        emails = self._emails.get(user['id'])
+        if emails is not None:
+            emails.discard(email)
+            if not emails:
+                del self._emails[user['id']]
+
+    def get_many(self, emails) -> dict:
+        """Return the users cached for ``emails``, by email."""
+        if not self.enabled:
+            return {}
+
+        with self._lock:
+            users = {}
+            for email in emails:
+                user = self._users.get(email)
+                if user is not None:
+                    users[email] = user
+
+            return users
+
+    def set_many(self, users):
+        """Cache users, as dicts with an ``id`` and an ``email``."""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            for user in users:
+                self._users.set(user['email'], user)
+                self._emails.setdefault(user['id'], set()).add(user['email'])
+
+    def invalidate_users(self, user_ids):
+        """Drop the given users."""
+        with self._lock:
+            for user_id in user_ids:
+                for email in list(self._emails.get(user_id, ())):
+                    self._users.delete(email)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = self._users.stats()
+            stats.update({
+                'enabled': self.enabled,
+                'invalidations': self.invalidations,
+            })
+
+            return stats
@@ -1,27 +1,78 @@
+from contextlib import contextmanager
+
 from notes.extensions import db
 
+# Key of ``Session.info`` counting the units of work open on a session.
+UNIT_OF_WORK = 'unit_of_work'
+
 
 class BaseModel(db.Model):
     __abstract__ = True
 
-    def add(self, autoflush: bool = True):
+    @staticmethod
+    def in_unit_of_work() -> bool:
+        """Whether a :meth:`unit_of_work` block is open on the session."""
+        return db.session.info.get(UNIT_OF_WORK, 0) > 0
+
+    @classmethod
+    @contextmanager
+    def unit_of_work(cls, commit: bool = True):
+        """Group the writes of a block into a single flush.
+
+        Within the block, :meth:`add`, :meth:`update` and :meth:`delete`
+        only register changes in the session and autoflush is disabled,
+        so no statement is sent until the block exits. The session is
+        then flushed once, and rows of the same table are written with
+        executemany statements instead of a round trip per object.
+
+        Blocks can be nested, only the outermost one flushes. If the
+        block raises, the session is rolled back.
+
+        :param commit: Whether to commit the session when the outermost
+            block exits, instead of only flushing it.
+        """
+        session = db.session
+        depth = session.info.get(UNIT_OF_WORK, 0)
+        session.info[UNIT_OF_WORK] = depth + 1
+
+        try:
+            with session.no_autoflush:
+                yield session
+
+            if depth == 0:
+                if commit:
+                    session.commit()
+                else:
+                    session.flush()
+        except Exception:
+            if depth == 0:
+                session.rollback()
+            raise
+        finally:
+            session.info[UNIT_OF_WORK] = depth
+
+    def add(self, autoflush: bool = None):
         """Add the model to the database session.
 
         :param autoflush: Whether to flush the session after the
             update. Will populate auto-generated columns in the Model
-            object.
+            object. Defaults to flushing, unless a :meth:`unit_of_work`
+            is open: pass ``True`` when the generated keys are needed
+            within the block.
         """
         db.session.add(self)
 
+        if autoflush is None:
+            autoflush = not self.in_unit_of_work()
+
         if autoflush:
             db.session.flush()
 
-    def update(self, autoflush: bool = True, **kwargs):
+    def update(self, autoflush: bool = None, **kwargs):
         """Update certain fields the model, and add it to the session.
 
         :param autoflush: Whether to flush the session after the
-            update. Will populate auto-generated columns in the Model
-            object.
+            update. Takes the same values as in :meth:`add`.
         """
         for attr, value in kwargs.items():
             setattr(self, attr, value)
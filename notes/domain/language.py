@@ -0,0 +1,60 @@
+"""Language detection of notes.
+
+The language of a note is detected once, when it is written, and stored
+in ``notes.language`` as an ISO 639-1 code. Notes created in bulk are
+stored without one, detected later by
+``scripts/backfill_note_language.py``. Search then stems words and
+drops stop words with the text search configuration of that language.
+"""
+from langdetect import DetectorFactory
+from langdetect import detect_langs
+from langdetect.lang_detect_exception import LangDetectException
+
+# langdetect is randomized, seed it so a text always gets the same
+# language.
+DetectorFactory.seed = 0
+
+UNDETERMINED = 'und'
+MIN_CONFIDENCE = 0.8
+
+# Languages with a Postgres text search configuration.
+SEARCH_CONFIGS = {
+    'da': 'danish',
+    'de': 'german',
+    'en': 'english',
+    'es': 'spanish',
+    'fi': 'finnish',
+    'fr': 'french',
+    'hu': 'hungarian',
+    'it': 'italian',
+    'nl': 'dutch',
+    'no': 'norwegian',
+    'pt': 'portuguese',
+    'ro': 'romanian',
+    'ru': 'russian',
+    'sv': 'swedish',
+    'tr': 'turkish',
+}
+DEFAULT_SEARCH_CONFIG = 'simple'
+
+
+def detect_language(text) -> str:
+    """Detect the language of ``text``.
+
+    :return: An ISO 639-1 code, or :data:`UNDETERMINED` if the text is
+        too short or ambiguous to tell.
+    """
+    try:
+        languages = detect_langs(text or '')
+    except LangDetectException:
+        return UNDETERMINED
+
+    if not languages or languages[0].prob < MIN_CONFIDENCE:
+        return UNDETERMINED
+
+    return languages[0].lang
+
+
+def search_config(language) -> str:
+    """Return the text search configuration used for ``language``."""
+    return SEARCH_CONFIGS.get(language, DEFAULT_SEARCH_CONFIG)
@@ -1,8 +1,23 @@
 import datetime
 
 import jwt
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import object_session
+
+from notes.domain import search
+from notes.domain import sql  # noqa: F401 enables SQLite foreign keys
 from notes.domain.base import BaseModel
+from notes.domain.sql import CurrentTimestampMicros
+from notes.domain.sql import DateTimeMicros
 from notes.extensions import db
+from notes.extensions import token_cache
+from notes.extensions import user_lookup_cache
+
+# Key of ``Session.info`` holding the ids of the users changed in the
+# transaction, or ``ALL_USERS``.
+CHANGED_USERS = 'changed_users'
+ALL_USERS = 'all'
 
 class User(BaseModel):
     __tablename__ = 'note_user'
@@ -13,6 +28,15 @@ class User(BaseModel):
     last_name = db.Column(db.String(255))
     password = db.Column(db.String(255))
 
+    notes = db.relationship('Notes', back_populates='owner',
+                            cascade='all, delete-orphan',
+                            passive_deletes=True)
+    shares = db.relationship('NoteShare', back_populates='user',
+                             cascade='all, delete-orphan',
+                             passive_deletes=True)
+    shared_notes = db.relationship('Notes', secondary='note_share',
+                                   viewonly=True)
+
     @staticmethod
     def encode_auth_token(user_id):
         """
@@ -51,18 +75,143 @@ class User(BaseModel):
 
 class NoteShare(BaseModel):
     __tablename__ = 'note_share'
+    __table_args__ = (
+        db.UniqueConstraint('source_id', 'user_id',
+                            name='uq_note_share_source_id_user_id'),
+        db.Index('ix_note_share_user_id_created_at', 'user_id',
+                 'created_at'),
+    )
 
     id: int = db.Column(db.Integer, primary_key=True, autoincrement=True)
     note_id = db.Column('source_id', db.Integer(),
                           db.ForeignKey('notes.note_id', ondelete="CASCADE"))
     user_id = db.Column(db.ForeignKey('note_user.id', ondelete="CASCADE"),
                         nullable=False)
+    created_at = db.Column(DateTimeMicros, nullable=False,
+                           default=CurrentTimestampMicros())
+
+    note = db.relationship('Notes', back_populates='shares')
+    user = db.relationship('User', back_populates='shares')
+
 
 class Notes(BaseModel):
     __tablename__ = 'notes'
+    # Never reuse the id of a deleted note, so (note_id, version) always
+    # identifies the same content.
+    __table_args__ = (
+        db.Index('ix_notes_owner_id_updated_at', 'owner_id', 'updated_at'),
+        # Read by the catch-up of the trigram index, across owners.
+        db.Index('ix_notes_updated_at', 'updated_at'),
+        {'sqlite_autoincrement': True},
+    )
 
     note_id: int = db.Column(
             db.Integer, primary_key=True, autoincrement=True)
     owner_id = db.Column(db.ForeignKey('note_user.id', ondelete="CASCADE"),
                         nullable=False)
     note_description: str = db.Column(db.String(512), nullable=False)
+    # ISO 639-1 code detected on write, NULL until backfilled.
+    language: str = db.Column(db.String(8))
+    # Incremented by the ORM on every UPDATE, and by hand in set-based
+    # UPDATE statements.
+    version: int = db.Column(db.Integer, nullable=False, default=1,
+                             server_default='1')
+    # Set by the database, so changes made in one statement share a
+    # timestamp and clocks of the app servers do not matter.
+    created_at = db.Column(DateTimeMicros, nullable=False,
+                           default=CurrentTimestampMicros())
+    updated_at = db.Column(DateTimeMicros, nullable=False,
+                           default=CurrentTimestampMicros(),
+                           onupdate=CurrentTimestampMicros())
+
+    owner = db.relationship('User', back_populates='notes')
+    shares = db.relationship('NoteShare', back_populates='note',
+                             cascade='all, delete-orphan',
+                             passive_deletes=True)
+    shared_with = db.relationship('User', secondary='note_share',
+                                  viewonly=True)
+
+    __mapper_args__ = {'version_id_col': version}
+
+
+class NoteTombstone(BaseModel):
+    """
+    Record of a note a user can no longer see, read by delta sync.
+
+    ``DELETED`` is recorded for the owner of a deleted note, ``UNSHARED``
+    for every user that lost access to a note, be it because the share
+    was revoked or because the note was deleted.
+    """
+    __tablename__ = 'note_tombstone'
+    __table_args__ = (
+        db.Index('ix_note_tombstone_user_id_removed_at', 'user_id',
+                 'removed_at'),
+        db.Index('ix_note_tombstone_removed_at', 'removed_at'),
+    )
+
+    DELETED = 'deleted'
+    UNSHARED = 'unshared'
+
+    id: int = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Not a foreign key, the note is usually gone.
+    note_id: int = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.ForeignKey('note_user.id', ondelete="CASCADE"),
+                        nullable=False)
+    reason: str = db.Column(db.String(16), nullable=False)
+    removed_at = db.Column(DateTimeMicros, nullable=False,
+                           default=CurrentTimestampMicros())
+
+
+search.install(Notes.__table__)
+
+
+def _changed_users(session, user_ids):
+    if session.info.get(CHANGED_USERS) == ALL_USERS:
+        return
+    if user_ids == ALL_USERS:
+        session.info[CHANGED_USERS] = ALL_USERS
+    else:
+        session.info.setdefault(CHANGED_USERS, set()).update(user_ids)
+
+
+def _forget_users(user_ids):
+    if user_ids == ALL_USERS:
+        token_cache.clear()
+        user_lookup_cache.clear()
+    else:
+        token_cache.invalidate_users(user_ids)
+        user_lookup_cache.invalidate_users(user_ids)
+
+
+# A changed user is dropped from the token and lookup caches when the
+# change is flushed, then again once committed, as requests reading the user in
+# between still see and may cache the previous row.
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    _forget_users([target.id])
+    session = object_session(target)
+    if session is not None:
+        _changed_users(session, [target.id])
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _users_changed(orm_execute_state):
+    """Drop every cached user on bulk updates and deletes of users, which
+    do not tell which users they change."""
+    if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+            and orm_execute_state.bind_mapper is User.__mapper__):
+        _forget_users(ALL_USERS)
+        _changed_users(orm_execute_state.session, ALL_USERS)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed_users(session):
+    user_ids = session.info.pop(CHANGED_USERS, None)
+    if user_ids:
+        _forget_users(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_users(session):
+    session.info.pop(CHANGED_USERS, None)
@@ -0,0 +1,255 @@
+"""Full-text search over ``notes.note_description``.
+
+Postgres keeps a generated ``tsvector`` column indexed with GIN, while
+SQLite (used for dev and tests) keeps an FTS5 external-content table in
+sync through triggers. Both are created alongside the ``notes`` table by
+:func:`install`, and by the matching Alembic migration for existing
+databases.
+
+Search queries accept plain words, ``"quoted phrases"`` and ``prefix*``
+terms; every term has to match.
+
+On Postgres, each note is indexed with the text search configuration of
+its language (see :mod:`notes.domain.language`), and queries are parsed
+with every configuration so they match stemmed words in any language.
+FTS5 has no per-language stemmers, SQLite matches words as written.
+"""
+import re
+from collections import namedtuple
+
+from sqlalchemy import DDL
+from sqlalchemy import and_
+from sqlalchemy import case
+from sqlalchemy import cast
+from sqlalchemy import column
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import literal_column
+from sqlalchemy import select
+from sqlalchemy import table
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+from notes.domain.language import DEFAULT_SEARCH_CONFIG
+from notes.domain.language import SEARCH_CONFIGS
+
+SEARCH_CONFIG = DEFAULT_SEARCH_CONFIG
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+SNIPPET_ELLIPSIS = '...'
+SNIPPET_WORDS = 16
+
+Term = namedtuple('Term', ['words', 'prefix'])
+
+_TERM_RE = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+_WORD_RE = re.compile(r'\w+')
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE notes_fts USING fts5("
+    "note_description, content='notes', content_rowid='note_id')",
+    "CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes BEGIN "
+    "INSERT INTO notes_fts(rowid, note_description) "
+    "VALUES (new.note_id, new.note_description); END",
+    "CREATE TRIGGER notes_fts_ad AFTER DELETE ON notes BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, note_description) "
+    "VALUES ('delete', old.note_id, old.note_description); END",
+    "CREATE TRIGGER notes_fts_au AFTER UPDATE OF note_description ON notes "
+    "BEGIN "
+    "INSERT INTO notes_fts(notes_fts, rowid, note_description) "
+    "VALUES ('delete', old.note_id, old.note_description); "
+    "INSERT INTO notes_fts(rowid, note_description) "
+    "VALUES (new.note_id, new.note_description); END",
+]
+
+# Constant regconfig literals keep the expression immutable, as required
+# by generated columns.
+LANGUAGE_CONFIG_SQL = 'CASE language {} ELSE \'{}\'::regconfig END'.format(
+    ' '.join(f"WHEN '{language}' THEN '{config}'::regconfig"
+             for language, config in sorted(SEARCH_CONFIGS.items())),
+    SEARCH_CONFIG)
+
+POSTGRES_DDL = [
+    "ALTER TABLE notes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    f"(to_tsvector({LANGUAGE_CONFIG_SQL}, note_description)) STORED",
+    "CREATE INDEX ix_notes_search_vector ON notes USING GIN (search_vector)",
+]
+
+
+def install(notes_table):
+    """Attach the search index DDL to the creation of ``notes_table``."""
+    for statement in SQLITE_DDL:
+        event.listen(notes_table, 'after_create',
+                     DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(notes_table, 'before_drop',
+                 DDL('DROP TABLE IF EXISTS notes_fts').execute_if(
+                     dialect='sqlite'))
+
+    for statement in POSTGRES_DDL:
+        event.listen(notes_table, 'after_create',
+                     DDL(statement).execute_if(dialect='postgresql'))
+
+
+def parse_query(text) -> list:
+    """Split a search string into :class:`Term` tuples.
+
+    Punctuation is dropped so the result can be rendered safely in
+    both the Postgres and the FTS5 query syntax.
+    """
+    terms = []
+    for phrase, phrase_prefix, word in _TERM_RE.findall(text or ''):
+        words = tuple(_WORD_RE.findall((phrase or word).lower()))
+        if not words:
+            continue
+        prefix = (bool(phrase_prefix) or phrase.rstrip().endswith('*') or
+                  word.endswith('*'))
+        terms.append(Term(words, prefix))
+
+    return terms
+
+
+def to_tsquery_text(terms) -> str:
+    """Render terms for Postgres ``to_tsquery``."""
+    rendered = []
+    for term in terms:
+        words = list(term.words)
+        if term.prefix:
+            words[-1] += ':*'
+        rendered.append('({})'.format(' <-> '.join(words)))
+
+    return ' & '.join(rendered)
+
+
+def to_fts5_query(terms) -> str:
+    """Render terms for an SQLite FTS5 ``MATCH`` expression."""
+    rendered = []
+    for term in terms:
+        phrase = '"{}"'.format(' '.join(term.words))
+        if term.prefix:
+            phrase += '*'
+        rendered.append(phrase)
+
+    return ' AND '.join(rendered)
+
+
+class PostgresSearch(object):
+    """Search backed by the ``search_vector`` column and its GIN index."""
+
+    search_vector = literal_column('notes.search_vector')
+    language = literal_column('notes.language')
+    configs = sorted(set(SEARCH_CONFIGS.values())) + [SEARCH_CONFIG]
+
+    def __init__(self, terms):
+        text = literal(to_tsquery_text(terms))
+        # Notes in English only match the English stems of the query,
+        # notes of undetermined language the words as written, etc.
+        tsquery = None
+        for config in self.configs:
+            config_tsquery = func.to_tsquery(cast(config, REGCONFIG), text)
+            tsquery = (config_tsquery if tsquery is None else
+                       tsquery.op('||')(config_tsquery))
+        self.tsquery = tsquery
+
+    def join(self, statement, notes_table):
+        return statement
+
+    def match(self):
+        return self.search_vector.op('@@')(self.tsquery)
+
+    def rank(self):
+        return func.ts_rank_cd(self.search_vector, self.tsquery)
+
+    def criterion(self, note_id):
+        return self.match()
+
+    def order_by(self, rank):
+        return rank.desc()
+
+    def seek(self, rank, last_rank):
+        return rank < last_rank
+
+    def snippet(self, description):
+        options = (f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, '
+                   f'FragmentDelimiter={SNIPPET_ELLIPSIS}, '
+                   f'MaxWords={SNIPPET_WORDS}, MinWords=1, MaxFragments=2')
+        config = case(
+            {language: cast(config, REGCONFIG)
+             for language, config in SEARCH_CONFIGS.items()},
+            value=self.language, else_=cast(SEARCH_CONFIG, REGCONFIG))
+        return func.ts_headline(config, description, self.tsquery, options)
+
+
+class SqliteSearch(object):
+    """Search backed by the ``notes_fts`` FTS5 shadow table."""
+
+    fts = table('notes_fts', column('rowid'))
+    fts_table = literal_column('notes_fts')
+
+    def __init__(self, terms):
+        self.fts5_query = to_fts5_query(terms)
+
+    def join(self, statement, notes_table):
+        return statement.join(
+            self.fts, self.fts.c.rowid == notes_table.c.note_id)
+
+    def match(self):
+        return self.fts_table.op('MATCH')(self.fts5_query)
+
+    def rank(self):
+        # bm25() is negative, lower values are better matches.
+        return func.bm25(self.fts_table)
+
+    def criterion(self, note_id):
+        return note_id.in_(
+            select(self.fts.c.rowid).where(self.match()))
+
+    def order_by(self, rank):
+        return rank.asc()
+
+    def seek(self, rank, last_rank):
+        return rank > last_rank
+
+    def snippet(self, description):
+        return func.snippet(self.fts_table, 0, HIGHLIGHT_START,
+                            HIGHLIGHT_STOP, SNIPPET_ELLIPSIS, SNIPPET_WORDS)
+
+
+class LikeSearch(object):
+    """Fallback for databases without a full-text index."""
+
+    def __init__(self, terms):
+        self.terms = terms
+
+    def join(self, statement, notes_table):
+        return statement
+
+    def match(self):
+        return and_(*[
+            literal_column('notes.note_description').contains(
+                ' '.join(term.words)) for term in self.terms
+        ])
+
+    def rank(self):
+        return literal(0)
+
+    def criterion(self, note_id):
+        return self.match()
+
+    def order_by(self, rank):
+        return rank
+
+    def seek(self, rank, last_rank):
+        return rank > last_rank
+
+    def snippet(self, description):
+        return description
+
+
+_BACKENDS = {
+    'postgresql': PostgresSearch,
+    'sqlite': SqliteSearch,
+}
+
+
+def backend_for(dialect_name, terms):
+    """Return the search backend to use for the given SQL dialect."""
+    return _BACKENDS.get(dialect_name, LikeSearch)(terms)
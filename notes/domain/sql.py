@@ -2,15 +2,20 @@ import datetime
 
 from sqlalchemy import dialects
 from sqlalchemy import event
+from sqlalchemy import insert
 from sqlalchemy import types
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql.functions import FunctionElement
 
 
 class CurrentTimestampMicros(FunctionElement):
-    """Return the current timestamp with microsecond resolution."""
+    """Return the current UTC timestamp with microsecond resolution."""
     name = 'current_timestamp_micros'
+    type = types.DateTime()
+    inherit_cache = True
 
 
 @compiles(CurrentTimestampMicros, 'sqlite')
@@ -21,6 +26,14 @@ def visit_current_timestamp_micros_sqlite(element, compiler, **kwargs):
     return "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"
 
 
+@compiles(CurrentTimestampMicros, 'postgresql')
+def visit_current_timestamp_micros_postgresql(element, compiler, **kwargs):
+    # Unlike now(), which is frozen at the start of the transaction, the
+    # statement timestamp stays close to the time the change is
+    # committed. Columns are "timestamp without time zone" kept in UTC.
+    return "(statement_timestamp() AT TIME ZONE 'UTC')"
+
+
 @compiles(CurrentTimestampMicros, 'mysql')
 def visit_current_timestamp_micros_mysql(element, compiler, **kwargs):
     return 'CURRENT_TIMESTAMP(6)'
@@ -40,3 +53,47 @@ class DateTimeMicros(types.TypeDecorator):
         if type(value) is str and dialect.name == 'sqlite':
             return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
         return value
+
+
+def insert_ignoring_conflicts(dialect_name, model, index_elements):
+    """Build an ``INSERT ... ON CONFLICT DO NOTHING`` statement.
+
+    :param dialect_name: Name of the SQL dialect the statement runs on.
+    :param model: Model or table to insert into.
+    :param index_elements: Columns of the unique constraint that may
+        conflict.
+
+    :return: An insert statement skipping the rows that would violate
+        the constraint, or a plain insert on dialects without
+        ``ON CONFLICT``.
+    """
+    if dialect_name == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing(
+            index_elements=index_elements)
+    if dialect_name == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing(
+            index_elements=index_elements)
+
+    return insert(model)
+
+
+# Key of the ``info`` of a pooled connection telling whether it is made
+# by the SQLite dialect, whatever its driver.
+SQLITE_CONNECTION = 'sqlite'
+
+
+@event.listens_for(Engine, 'do_connect')
+def tag_sqlite_connections(dialect, connection_record, cargs, cparams):
+    connection_record.info[SQLITE_CONNECTION] = dialect.name == 'sqlite'
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys, and thus ON DELETE CASCADE, unless
+    # asked to enforce them on every new connection. The connection is
+    # the adapter of the driver, e.g. of aiosqlite, not always a
+    # sqlite3.Connection.
+    if connection_record.info.get(SQLITE_CONNECTION):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
@@ -0,0 +1,166 @@
+"""Logging of the errors of the requests.
+
+Errors are logged by fingerprint, once per ``NOTES_ERROR_LOG_WINDOW``
+seconds, with the number of occurrences since the last record, so a
+storm of the same error writes one record per window instead of one per
+request. Errors are counted under their fingerprint whether logged or
+not.
+
+- Client errors, 4xx, are expected: their fingerprint is their status,
+  key and endpoint, and they are logged at info level, without a stack.
+- Server errors, 5xx, are fingerprinted by the type of the exception and
+  the frames of its traceback, which is cheap to walk. The traceback is
+  only formatted when logged, at error level.
+
+The counts are served to unauthenticated clients: they hold the type of
+an exception and where it was raised, never its message, which may
+include SQL and its parameters.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+# Directory of the app, whose frames locate the errors
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def fingerprint(exc) -> str:
+    """Identify where and how ``exc`` was raised, whatever its message."""
+    exc_type = type(exc)
+    parts = [f'{exc_type.__module__}.{exc_type.__qualname__}']
+    for frame, lineno in traceback.walk_tb(exc.__traceback__):
+        code = frame.f_code
+        parts.append(f'{code.co_filename}:{code.co_name}:{lineno}')
+
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def location(exc) -> str:
+    """Tell where the app raised ``exc``, or called the library that did:
+    the innermost frame of the app in its traceback."""
+    found = innermost = None
+    for frame, lineno in traceback.walk_tb(exc.__traceback__):
+        innermost = (frame.f_code, lineno)
+        if frame.f_code.co_filename.startswith(APP_DIR):
+            found = innermost
+    if found is None:
+        found = innermost
+    if found is None:
+        return 'unknown'
+
+    code, lineno = found
+    path = os.path.relpath(code.co_filename, os.path.dirname(APP_DIR))
+
+    return f'{path}:{lineno} in {code.co_name}'
+
+
+class _Occurrences(object):
+    __slots__ = ('level', 'title', 'count', 'unlogged', 'first_seen',
+                 'last_seen', 'logged_at')
+
+    def __init__(self, level, title, now):
+        self.level = level
+        self.title = title
+        self.count = 0
+        self.unlogged = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.logged_at = None
+
+
+class ErrorLog(object):
+    """
+    Counts the errors of the requests by fingerprint, and logs each
+    fingerprint once per window.
+
+    Initialized in the app factory from the ``NOTES_ERROR_LOG_*``
+    settings.
+
+    :param clock: Callable returning the current time in seconds since
+        the epoch.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.window = 60.0
+        self.max_fingerprints = 1000
+        self._lock = threading.Lock()
+        # Fingerprint to occurrences, least recently seen first
+        self._occurrences = OrderedDict()
+
+    def init_app(self, app):
+        self.window = app.config.get('NOTES_ERROR_LOG_WINDOW', 60.0)
+        self.max_fingerprints = app.config.get(
+            'NOTES_ERROR_LOG_MAX_FINGERPRINTS', 1000)
+        with self._lock:
+            self._occurrences.clear()
+
+    def _record(self, key, level, title):
+        """Count an occurrence of ``key``.
+
+        :return: ``None`` if the fingerprint was logged within the window,
+            else the occurrences since it was last logged, this one
+            included.
+        """
+        now = self.clock()
+        with self._lock:
+            occurrences = self._occurrences.pop(key, None)
+            if occurrences is None:
+                occurrences = _Occurrences(level, title, now)
+            self._occurrences[key] = occurrences
+            if len(self._occurrences) > self.max_fingerprints:
+                del self._occurrences[next(iter(self._occurrences))]
+
+            occurrences.count += 1
+            occurrences.unlogged += 1
+            occurrences.last_seen = now
+            if (occurrences.logged_at is not None
+                    and now - occurrences.logged_at < self.window):
+                return None
+
+            unlogged = occurrences.unlogged
+            occurrences.unlogged = 0
+            occurrences.logged_at = now
+
+            return unlogged
+
+    def client_error(self, code, key, endpoint):
+        """Count a 4xx error answered for ``endpoint``."""
+        title = f'{code} {key} on {endpoint}'
+        unlogged = self._record(title, logging.INFO, title)
+        if unlogged is not None:
+            logging.info('%s (%d since last logged)', title, unlogged)
+
+    def server_error(self, exc):
+        """Count an exception answered with a 5xx error."""
+        key = fingerprint(exc)
+        unlogged = self._record(
+            key, logging.ERROR,
+            f'{type(exc).__module__}.{type(exc).__qualname__} at '
+            f'{location(exc)}')
+        if unlogged is not None:
+            logging.error('error %s (%d since last logged)\n%s', key,
+                          unlogged, ''.join(traceback.format_exception(
+                              type(exc), exc, exc.__traceback__)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            fingerprints = [{
+                'fingerprint': key,
+                'level': logging.getLevelName(occurrences.level).lower(),
+                'title': occurrences.title,
+                'count': occurrences.count,
+                'first_seen': occurrences.first_seen,
+                'last_seen': occurrences.last_seen,
+            } for key, occurrences in self._occurrences.items()]
+
+        fingerprints.sort(key=lambda entry: entry['count'], reverse=True)
+
+        return {
+            'window': self.window,
+            'fingerprints': fingerprints,
+        }
@@ -61,7 +61,7 @@ class BaseError(Exception):
         """
 
         self.code = code
-        self.error_id = str(uuid4())
+        self._error_id = None
         self.title = title
         self.message = message
         self.private_message = private_message
@@ -77,6 +77,18 @@ class BaseError(Exception):
         'public': bool
     }
 
+    @property
+    def error_id(self):
+        """Unique id of the error, made when first read: errors handled
+        without being serialized do not pay for it."""
+        if self._error_id is None:
+            self._error_id = str(uuid4())
+        return self._error_id
+
+    @error_id.setter
+    def error_id(self, error_id):
+        self._error_id = error_id
+
     def __str__(self):
         return '[{}] {}'.format(self.code, self.message)
 
@@ -276,6 +288,14 @@ class Conflict(Error):
     public = True
 
 
+class PreconditionFailed(Error):
+    code = 412
+    title = 'Precondition Failed'
+    message = 'The resource does not match the preconditions of the request'
+    key = 'precondition_failed'
+    public = True
+
+
 class PayloadTooLarge(Error):
     code = 413
     title = 'Payload Too Large'
@@ -300,6 +320,17 @@ class TooManyRequests(Error):
     key = 'too_many_requests'
     public = True
 
+    def __init__(self, message=None, retry_after=None, **kwargs):
+        """
+        Initialize error
+
+        :param str message:
+        :param int retry_after: Seconds to wait before sending another
+            request, sent in the ``Retry-After`` header.
+        """
+        super().__init__(message=message, **kwargs)
+        self.retry_after = retry_after
+
 
 class TokenRequired(Error):
     code = 499
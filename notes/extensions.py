@@ -3,6 +3,26 @@ from flask_marshmallow import Marshmallow
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from notes.cache import NoteListingCache
+from notes.cache import TokenCache
+from notes.cache import UserLookupCache
+from notes.error_log import ErrorLog
+from notes.limiter import RateLimiter
+from notes.passwords import PasswordHasher
+from notes.pool import PoolMetrics
+from notes.replicas import ReplicaRouter
+from notes.replicas import RoutingSession
+from notes.trigram import TrigramIndex
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 ma = Marshmallow()
 migrate = Migrate()
+note_cache = NoteListingCache()
+note_index = TrigramIndex()
+replicas = ReplicaRouter()
+pool_metrics = PoolMetrics()
+token_cache = TokenCache()
+user_lookup_cache = UserLookupCache()
+limiter = RateLimiter()
+error_log = ErrorLog()
+passwords = PasswordHasher()
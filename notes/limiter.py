@@ -0,0 +1,247 @@
+"""Rate limiting of the endpoints, per user.
+
+Each limited endpoint lets every user, or every IP address on the
+endpoints without a token, make ``calls`` requests per ``period``
+seconds. The allowance is a token bucket holding up to ``calls``
+tokens, refilled at ``calls / period`` tokens per second, of which each
+request spends one. A bucket is two numbers, whatever the traffic of
+its key.
+
+Buckets are kept in a store, chosen with ``NOTES_RATE_LIMIT_STORE``:
+
+- ``memory``: :class:`MemoryStore` keeps them in the worker process,
+  each worker enforcing the limits on its own.
+- ``sqlite:///path``: :class:`SQLiteStore` keeps them in an SQLite file
+  shared by the workers of the host, each check being a single
+  statement.
+
+Any object with the ``hit`` method of the stores can be set instead.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import g
+from flask import request
+
+import notes.errors as error
+
+
+class MemoryStore(object):
+    """
+    Buckets of the worker process.
+
+    :param int maxsize: Maximum number of buckets kept. The least
+        recently used bucket, most likely full again, is dropped to make
+        room for a new one.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        # Key to (tokens, updated_at), least recently used first
+        self._buckets = {}
+
+    def hit(self, key, capacity, rate, now) -> float:
+        """Spend a token of the bucket of ``key``.
+
+        :param float capacity: Maximum number of tokens of the bucket.
+        :param float rate: Tokens added to the bucket per second.
+        :param float now: Current time in seconds.
+
+        :return: ``0`` if a token was spent, else the seconds until the
+            bucket holds one.
+        """
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                del self._buckets[next(iter(self._buckets))]
+
+        return wait
+
+
+class SQLiteStore(object):
+    """
+    Buckets kept in an SQLite file, shared by the processes of a host.
+
+    A token is spent by a single ``INSERT ... ON CONFLICT DO UPDATE``,
+    which SQLite runs atomically across processes. Each thread uses its
+    own connection, opened again in forked processes.
+
+    :param str path: Path of the database file.
+    :param float expire_after: Buckets untouched for this many seconds
+        are deleted, every ``PRUNE_EVERY`` checks of a connection.
+    """
+
+    PRUNE_EVERY = 1000
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_limit_bucket (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """
+    # Refills the bucket then spends a token, unless less than one is
+    # left, in which case no row is returned.
+    HIT = """
+        INSERT INTO rate_limit_bucket (key, tokens, updated_at)
+        VALUES (:key, :capacity - 1, :now)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:capacity, tokens + (:now - updated_at) * :rate) - 1,
+            updated_at = :now
+        WHERE min(:capacity, tokens + (:now - updated_at) * :rate) >= 1
+        RETURNING tokens
+    """
+    TOKENS = """
+        SELECT min(:capacity, tokens + (:now - updated_at) * :rate)
+        FROM rate_limit_bucket
+        WHERE key = :key
+    """
+    PRUNE = 'DELETE FROM rate_limit_bucket WHERE updated_at < :before'
+
+    def __init__(self, path, expire_after=3600.0):
+        self.path = path
+        self.expire_after = expire_after
+        self._local = threading.local()
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Losing the last checks on a crash is harmless.
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(self.SCHEMA)
+            local.connection = connection
+            local.pid = os.getpid()
+            local.hits = 0
+
+        return local.connection
+
+    def hit(self, key, capacity, rate, now) -> float:
+        """Spend a token of the bucket of ``key``, see
+        :meth:`MemoryStore.hit`."""
+        connection = self._connection()
+        parameters = {'key': key, 'capacity': capacity, 'rate': rate,
+                      'now': now}
+
+        self._local.hits += 1
+        if self._local.hits % self.PRUNE_EVERY == 0:
+            connection.execute(self.PRUNE,
+                               {'before': now - self.expire_after})
+
+        if connection.execute(self.HIT, parameters).fetchone() is not None:
+            return 0.0
+
+        row = connection.execute(self.TOKENS, parameters).fetchone()
+        tokens = row[0] if row is not None else capacity
+
+        return max(0.0, (1 - tokens) / rate)
+
+
+def store_from_uri(uri, expire_after=3600.0):
+    """Create the store described by ``NOTES_RATE_LIMIT_STORE``."""
+    if uri == 'memory':
+        return MemoryStore()
+    if uri.startswith('sqlite:///'):
+        return SQLiteStore(uri[len('sqlite:///'):], expire_after=expire_after)
+
+    raise ValueError(f'Unknown rate limit store {uri}')
+
+
+class RateLimiter(object):
+    """
+    Limits the requests of each user to the endpoints decorated with
+    :meth:`limit`.
+
+    Initialized in the app factory from the ``NOTES_RATE_LIMIT_*``
+    settings.
+
+    :param clock: Callable returning the current time in seconds since
+        the epoch, shared by the processes using a store.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.enabled = False
+        self.store = MemoryStore()
+        # Longest period of the limits declared
+        self.max_period = 0
+        self.checks = 0
+        self.denials = Counter()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('NOTES_RATE_LIMIT_ENABLED', False)
+        store = app.config.get('NOTES_RATE_LIMIT_STORE', 'memory')
+        if isinstance(store, str):
+            store = store_from_uri(store, expire_after=max(self.max_period,
+                                                           3600))
+        self.store = store
+        self.checks = 0
+        self.denials = Counter()
+
+    def hit(self, key, calls, period) -> float:
+        """Count a request of ``key`` against ``calls`` per ``period``.
+
+        :return: ``0`` if the request is allowed, else the seconds to wait
+            before the next one is.
+        """
+        self.checks += 1
+
+        return self.store.hit(key, calls, calls / period, self.clock())
+
+    def limit(self, calls, period):
+        """Allow ``calls`` requests per ``period`` seconds to each user.
+
+        Apply it below :func:`notes.auth.views.token_required`, which
+        tells who the user is. Requests without a user are limited by
+        IP address.
+
+        :raise TooManyRequests: With the seconds to wait in
+            ``retry_after``.
+        """
+        self.max_period = max(self.max_period, period)
+
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if self.enabled:
+                    identity = g.get('user_id') or request.remote_addr
+                    key = f'{request.endpoint}:{identity}'
+                    wait = self.hit(key, calls, period)
+                    if wait:
+                        self.denials[request.endpoint] += 1
+                        raise error.TooManyRequests(
+                            retry_after=math.ceil(wait))
+
+                return f(*args, **kwargs)
+
+            return decorated
+
+        return decorator
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'store': type(self.store).__name__,
+            'checks': self.checks,
+            'denials': dict(self.denials),
+        }
@@ -1,139 +1,908 @@
+import datetime
+import functools
+
+from flask import current_app
+from sqlalchemy import delete
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import true
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
 import notes.errors as error
 
+from notes.domain import search
+from notes.domain.language import detect_language
+from notes.domain.sql import insert_ignoring_conflicts
+from notes.note import queries
+from notes.note.utils import decode_cursor
+from notes.note.utils import decode_sync_cursor
+from notes.note.utils import encode_cursor
+from notes.note.utils import encode_sync_cursor
+from notes.note.utils import note_etag
 from notes.note.utils import note_to_dict
+from notes.note.utils import parse_limit
+from notes.note.utils import search_result_to_dict
+from notes.note.utils import validate_note_body
+from notes.trigram import substring_distance
+from notes.utils import make_etag
+from notes.utils import stream_json_object
 from notes.domain.models import Notes
 from notes.domain.models import NoteShare
+from notes.domain.models import NoteTombstone
 from notes.domain.models import User
 from notes.extensions import db
+from notes.extensions import note_cache
+from notes.extensions import note_index
+from notes.extensions import replicas
+
+SUBSTRING_MODES = ('substring', 'fuzzy')
+
 
 def create_note(current_user, body):
+    user_id = current_user.id
     note_description = body.get('note_description')
 
     note = Notes(
-        owner_id=current_user.id,
-        note_description=note_description)
+        owner_id=user_id,
+        note_description=note_description,
+        language=detect_language(note_description))
     note.add()
-    db.session.commit()
-
+    # Read before the commit expires the note, which would reload it.
     note_dict = note_to_dict(note)
+    db.session.commit()
+    note_cache.invalidate_users([user_id])
 
     return note_dict
 
 
-def get_note(current_user, note_id):
-    note = Notes.query.filter(
-        Notes.owner_id == current_user.id,
-        Notes.note_id == note_id).first()
+def _bulk_items(body, key):
+    items = body.get(key) if isinstance(body, dict) else body
+
+    if not isinstance(items, list):
+        raise error.BadRequest(f'{key} must be a list')
+
+    if len(items) > current_app.config['NOTES_BULK_LIMIT']:
+        raise error.PayloadTooLarge(
+            message='At most {} items can be sent at once'.format(
+                current_app.config['NOTES_BULK_LIMIT']))
+
+    return items
+
+
+def bulk_create_notes(current_user, body):
+    """Create many notes with batched multi-row INSERT statements.
+
+    Their language is not detected, which costs milliseconds per note,
+    in the request: it is left ``NULL`` for
+    ``scripts/backfill_note_language.py`` to detect. Until then, search
+    matches their words as written.
+
+    :param body: Either a list of note payloads or an object with a
+        ``notes`` list.
+
+    :return: The ids of the created notes, in the order they were sent,
+        and the validation error of every rejected item.
+    """
+    user_id = current_user.id
+    items = _bulk_items(body, 'notes')
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        message = validate_note_body(item)
+        if message:
+            errors.append({'index': index, 'message': message})
+        else:
+            rows.append({
+                'owner_id': user_id,
+                'note_description': item['note_description'],
+                'language': None
+            })
+
+    created = []
+    if rows:
+        result = db.session.execute(
+            insert(Notes).returning(Notes.note_id,
+                                    sort_by_parameter_order=True), rows)
+        created = list(result.scalars())
+        db.session.commit()
+        note_cache.invalidate_users([user_id])
+
+    body = {
+        'created': created,
+        'errors': errors
+    }
+
+    return body
+
+
+def _bulk_selection(current_user, body):
+    """Build the criterion selecting the notes of a bulk operation.
+
+    :param body: Object with either a ``note_ids`` list or a ``filter``
+        object holding a full-text search ``query``.
+
+    :return: A ``(criterion, note_ids)`` tuple. ``note_ids`` is ``None``
+        when the notes are selected by a filter.
+    """
+    if not isinstance(body, dict):
+        raise error.BadRequest('The request body must be an object')
+
+    if body.get('note_ids') is not None:
+        try:
+            note_ids = [int(note_id) for note_id in
+                        _bulk_items(body, 'note_ids')]
+        except (TypeError, ValueError):
+            raise error.BadRequest('note_ids must be a list of integers')
+        criterion = Notes.note_id.in_(note_ids)
+    elif isinstance(body.get('filter'), dict):
+        note_ids = None
+        terms = search.parse_query(body['filter'].get('query'))
+        if not terms:
+            raise error.BadRequest('The filter requires a search query')
+        criterion = queries.matching(terms)
+    else:
+        raise error.BadRequest('Either note_ids or a filter is required')
+
+    return (Notes.owner_id == current_user.id) & criterion, note_ids
+
+
+def _invalidate_notes(user_id, note_ids):
+    """Drop the cached responses that may show the given notes."""
+    note_cache.invalidate_users([user_id])
+    note_cache.invalidate_notes(note_ids)
+
+
+def _bulk_result(key, affected, note_ids):
+    body = {key: affected}
+
+    if note_ids is not None:
+        affected = set(affected)
+        body['not_found'] = [
+            note_id for note_id in dict.fromkeys(note_ids)
+            if note_id not in affected
+        ]
+
+    return body
+
+
+def bulk_update_notes(current_user, body):
+    """Update many notes with one set-based UPDATE statement.
+
+    Ownership is enforced in the statement itself, so notes that do not
+    exist or belong to someone else are reported as not found.
+
+    :return: The ids of the updated notes, and the requested ids that
+        were not updated when the notes were selected by id.
+    """
+    user_id = current_user.id
+    criterion, note_ids = _bulk_selection(current_user, body)
+    values = {key: body[key] for key in ('note_description', ) if key in body}
+    message = validate_note_body(values)
+
+    if message:
+        raise error.BadRequest(message)
+
+    values['language'] = detect_language(values['note_description'])
+    result = db.session.execute(
+        update(Notes).where(criterion).values(
+            version=Notes.version + 1, **values).returning(Notes.note_id),
+        execution_options={'synchronize_session': False})
+    updated = sorted(result.scalars())
+    db.session.commit()
+    _invalidate_notes(user_id, updated)
+
+    return _bulk_result('updated', updated, note_ids)
+
+
+def bulk_delete_notes(current_user, body):
+    """Delete many notes with one set-based DELETE statement.
+
+    Takes the same selection as :func:`bulk_update_notes`.
+    """
+    user_id = current_user.id
+    criterion, note_ids = _bulk_selection(current_user, body)
+
+    queries.record_deletions(criterion)
+    result = db.session.execute(
+        delete(Notes).where(criterion).returning(Notes.note_id),
+        execution_options={'synchronize_session': False})
+    deleted = sorted(result.scalars())
+    db.session.commit()
+    _invalidate_notes(user_id, deleted)
+
+    return _bulk_result('deleted', deleted, note_ids)
+
+
+def _cached(user_id, key, etag):
+    """Return the response cached under ``key`` if it was cached with
+    ``etag``, the tag just read from the database.
+
+    Writes of other processes, or behind the controller's back, do not
+    invalidate the cache: the tag tells whether its response is current.
+    """
+    cached = note_cache.get(user_id, key)
+    if cached is not None and cached[0] == etag:
+        return cached[1]
+
+    return None
+
+
+def get_note(current_user, note_id, etag=None):
+    """Load a note, from the cache if it is still at ``etag``.
+
+    :param etag: Tag of the note, from :func:`get_note_etag`.
+    """
+    key = ('note', str(note_id))
+    cached = _cached(current_user.id, key, etag)
+    if cached is not None:
+        return cached
+
+    generation = note_cache.generation
+    note = queries.owned_note(current_user.id, note_id)
 
     if not note:
         raise error.NotFound('Note does not exist')
 
-    return note_to_dict(note)
+    note = note_to_dict(note)
+    note_cache.set(current_user.id, key, (etag, note), generation=generation)
+
+    return note
+
+
+def get_note_etag(current_user, note_id) -> str:
+    """Return the entity tag of a note without loading it.
+
+    :raises NotFound: If the user does not own the note.
+    """
+    version = queries.note_version(current_user.id, note_id)
+
+    if version is None:
+        raise error.NotFound('Note does not exist')
+
+    return note_etag(int(note_id), version)
+
+
+def get_all_notes_etag(current_user, limit=None, cursor=None) -> str:
+    """Return the entity tag of a ``get_all_notes`` page.
+
+    It is derived from :func:`queries.listing_version`, so it changes
+    with any note of the user but is computed without loading them.
+    """
+    return make_etag('notes', _page_limit(limit), cursor,
+                     queries.listing_version(current_user.id))
+
+
+def _page_limit(limit):
+    return parse_limit(limit,
+                       current_app.config['NOTES_PAGE_LIMIT'],
+                       current_app.config['NOTES_MAX_PAGE_LIMIT'])
+
+
+def _paginate(positions, key, fetch, limit, position_of, next_positions):
+    """Fetch the next page of one list.
+
+    One extra row is requested to know whether the list continues, in
+    which case its last key is stored in ``next_positions``.
+    """
+    if key not in positions:
+        return []
+
+    rows = fetch(positions[key], limit + 1)
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_positions[key] = position_of(rows[-1])
+
+    return rows
+
 
+def _note_position(position):
+    if position is not None and (isinstance(position, bool) or
+                                 not isinstance(position, int)):
+        raise error.BadRequest('Invalid cursor')
 
-def get_all_notes(current_user):
-    notes_list = Notes.query.filter(
-        Notes.owner_id == current_user.id).all()
-    
-    reference_list = NoteShare.query.filter(
-        NoteShare.user_id == current_user.id
-    ).all()
-    shared_list = []
-    for item in reference_list:
-        shared_note = Notes.query.filter(
-            Notes.note_id == item.note_id
-        ).first()
-        shared_list.append(shared_note)
+    return position
+
+
+def _search_position(position):
+    if position is None:
+        return position
+
+    if (not isinstance(position, list) or len(position) != 2 or
+            not isinstance(position[0], (int, float)) or
+            isinstance(position[1], bool) or
+            not isinstance(position[1], int)):
+        raise error.BadRequest('Invalid cursor')
+
+    return position
+
+
+def get_all_notes(current_user, limit=None, cursor=None, etag=None):
+    """Load a page of the notes of the user, from the cache if the
+    listing is still at ``etag``.
+
+    :param etag: Tag of the page, from :func:`get_all_notes_etag`.
+    """
+    limit = _page_limit(limit)
+    key = ('notes', limit, cursor)
+    cached = _cached(current_user.id, key, etag)
+    if cached is not None:
+        return cached
+
+    generation = note_cache.generation
+    positions = decode_cursor(cursor, ('my_notes', 'shared_with_me'))
+    next_positions = {}
+
+    notes_list = _paginate(
+        positions, 'my_notes',
+        lambda after, size: queries.owned_notes(
+            current_user.id, _note_position(after), size),
+        limit, lambda note: note.note_id, next_positions)
+    shared_list = _paginate(
+        positions, 'shared_with_me',
+        lambda after, size: queries.shared_notes(
+            current_user.id, _note_position(after), size),
+        limit, lambda note: note.note_id, next_positions)
 
     body = {
         'my_notes': [note_to_dict(note) for note in notes_list],
-        'shared_with_me': [note_to_dict(note) for note in shared_list]
+        'shared_with_me': [note_to_dict(note) for note in shared_list],
+        'next_cursor': encode_cursor(next_positions)
     }
+    note_cache.set(current_user.id, key, (etag, body),
+                   depends_on=[note.note_id for note in shared_list],
+                   generation=generation)
 
     return body
 
 
-def update_note(current_user, note_id, body):
-    note = Notes.query.filter(
-        Notes.note_id == note_id,
-        Notes.owner_id == current_user.id).first()
+def _dict_batches(batches, to_dict):
+    for batch in batches:
+        yield [to_dict(row) for row in batch]
 
-    if not note:
-        raise error.NotFound(message='The note does not exist')
+
+def stream_all_notes(current_user):
+    """Stream every note visible to the user as a JSON document.
+
+    The rows are read through server-side cursors and serialized batch
+    by batch, so memory stays bounded whatever the number of notes.
+
+    :return: A generator of JSON text chunks, with the same
+        ``my_notes``/``shared_with_me`` layout as :func:`get_all_notes`.
+    """
+    user_id = current_user.id
+    batch_size = current_app.config['NOTES_STREAM_BATCH_SIZE']
+
+    return stream_json_object([
+        ('my_notes', _dict_batches(
+            queries.stream_notes(queries.owned_by(user_id), batch_size),
+            note_to_dict)),
+        ('shared_with_me', _dict_batches(
+            queries.stream_notes(queries.shared_with(user_id), batch_size),
+            note_to_dict)),
+    ])
+
+
+def update_note(current_user, note_id, body, expected_version=None):
+    """Update a note with a single ``UPDATE ... RETURNING`` statement.
+
+    :param expected_version: Version of the note the client read, from
+        its ``If-Match`` header. The update only applies if the note is
+        still at that version, so concurrent editors cannot overwrite
+        each other.
+
+    :raises NotFound: If the user does not own the note.
+    :raises PreconditionFailed: If the note changed since
+        ``expected_version``.
+
+    :return: The note, with its new ``version``.
+    """
+    # Read before the commit expires the user.
+    user_id = current_user.id
+    criteria = [Notes.note_id == note_id, Notes.owner_id == user_id]
+    if expected_version is not None:
+        criteria.append(Notes.version == expected_version)
 
     note_description = body.get('note_description')
-    if note_description:
-        note.note_description = note_description
+    if not note_description:
+        # Nothing to write, only check the note and its version.
+        note = db.session.execute(
+            select(Notes.note_id, Notes.note_description,
+                   Notes.version).where(*criteria)).one_or_none()
+    else:
+        message = validate_note_body(body)
+        if message:
+            raise error.BadRequest(message)
+
+        note = db.session.execute(
+            update(Notes).where(*criteria).values(
+                note_description=note_description,
+                language=detect_language(note_description),
+                version=Notes.version + 1).returning(
+                    Notes.note_id, Notes.note_description, Notes.version),
+            execution_options={'synchronize_session': False}).one_or_none()
+
+    if note is None:
+        db.session.rollback()
+        # Only failed updates pay for a second query.
+        if (expected_version is not None and
+                queries.note_version(user_id, note_id) is not None):
+            raise error.PreconditionFailed(
+                message='The note was modified since it was read')
+        raise error.NotFound(message='The note does not exist')
 
-    db.session.commit()
+    if note_description:
+        db.session.commit()
+        _invalidate_notes(user_id, [note.note_id])
 
-    note = note_to_dict(note)
+    result = note_to_dict(note)
+    result['version'] = note.version
 
-    return note
+    return result
 
 
 def delete_note(current_user, note_id):
-    note = Notes.query.filter(
-        Notes.owner_id == current_user.id,
-        Notes.note_id == note_id).first()
+    """Delete a note owned by the user.
 
-    if not note:
+    Runs two statements: the tombstones are written, then the note is
+    deleted with ``RETURNING``, which tells whether it existed.
+
+    :raises NotFound: If the user owns no such note.
+    """
+    user_id = current_user.id
+    criterion = (Notes.note_id == note_id) & queries.owned_by(user_id)
+
+    queries.record_deletions(criterion)
+    result = db.session.execute(
+        delete(Notes).where(criterion).returning(Notes.note_id),
+        execution_options={'synchronize_session': False})
+    note_id = result.scalar()
+
+    if note_id is None:
+        db.session.rollback()
         raise error.NotFound(message='The note does not exist')
 
-    note.delete()
     db.session.commit()
-
+    _invalidate_notes(user_id, [note_id])
 
 
 def share_note(current_user, note_id, share_id):
-    if share_id == current_user.id:
-        raise error.BadRequest('You can not share a note to yourself')
+    """Share a note with a user.
 
-    user = User.query.filter(User.id == share_id).first()
+    The note is read with one query, then the share is inserted with
+    ``ON CONFLICT DO NOTHING``: sharing a note twice is not an error, and
+    the foreign key of ``note_share.user_id`` rejects unknown users.
 
-    if not user:
-        raise error.BadRequest('Invalid user to share note')
+    :raises BadRequest: If ``share_id`` is the user or does not exist.
+    :raises NotFound: If the user owns no such note.
+    """
+    user_id = current_user.id
+    if share_id == user_id:
+        raise error.BadRequest('You can not share a note to yourself')
 
-    note = Notes.query.filter(
-        Notes.note_id == note_id,
-        Notes.owner_id == current_user.id).first()
+    note = queries.owned_note(user_id, note_id)
 
     if not note:
         raise error.NotFound(message='The note does not exist')
-    
-    share_note = NoteShare(
-        note_id=note_id,
-        user_id=share_id
-    )
 
-    share_note.add()
+    try:
+        _insert_shares([{'note_id': note.note_id, 'user_id': share_id}])
+    except IntegrityError:
+        db.session.rollback()
+        raise error.BadRequest('Invalid user to share note')
     db.session.commit()
+    note_cache.invalidate_users([share_id])
 
     note = note_to_dict(note)
-    note['share_id'] = share_note.user_id
+    note['share_id'] = share_id
 
     return note
 
 
+def unshare_note(current_user, note_id, share_id):
+    """Revoke the share of a note with a user.
+
+    :raises NotFound: If the note is not owned by the user or was not
+        shared with ``share_id``.
+    """
+    owned = select(Notes.note_id).where(Notes.note_id == note_id,
+                                        Notes.owner_id == current_user.id)
+    result = db.session.execute(
+        delete(NoteShare).where(NoteShare.note_id.in_(owned),
+                                NoteShare.user_id == share_id).returning(
+            NoteShare.note_id),
+        execution_options={'synchronize_session': False})
+    revoked = result.scalar()
+
+    if revoked is None:
+        raise error.NotFound(message='The note is not shared with this user')
+
+    with NoteTombstone.unit_of_work():
+        NoteTombstone(note_id=revoked, user_id=share_id,
+                      reason=NoteTombstone.UNSHARED).add()
+    note_cache.invalidate_users([share_id])
+
+
+def get_changes(current_user, cursor=None):
+    """Return what changed in the notes of a user since a sync cursor.
+
+    Changes are found through the ``updated_at`` timestamps of notes,
+    the ``created_at`` timestamps of shares and the tombstones of
+    removed notes, so the cost depends on the number of changes rather
+    than on the number of notes.
+
+    Tombstones are kept for ``NOTES_SYNC_RETENTION`` seconds: a cursor
+    older than that gets a full sync, flagged ``full_sync``, and the
+    client replaces its notes with the ones returned instead of merging
+    them.
+
+    :param cursor: The ``next_cursor`` of the previous sync. Without it
+        every visible note is returned.
+
+    :return: The created, updated and deleted notes of the user, the
+        notes newly shared with them or updated, the ids of the notes
+        they lost access to, and the cursor of the next sync.
+    """
+    since = decode_sync_cursor(cursor)
+    # Changes committed while this sync runs, or by a transaction that
+    # started earlier, may be stamped before ``now``: the next sync
+    # starts a little earlier to include them, provided they committed
+    # within the overlap. Clients apply changes idempotently, so seeing
+    # one twice is harmless.
+    now = queries.current_timestamp()
+    overlap = datetime.timedelta(
+        seconds=current_app.config['NOTES_SYNC_OVERLAP'])
+    retention = datetime.timedelta(
+        seconds=current_app.config['NOTES_SYNC_RETENTION'])
+    if since is not None and since < now - retention:
+        since = None
+
+    created, updated = [], []
+    for note in queries.changed_notes(current_user.id, since):
+        if since is None or note.created_at > since:
+            created.append(note_to_dict(note))
+        else:
+            updated.append(note_to_dict(note))
+
+    shared, shared_updated = [], []
+    for note, shared_at in queries.changed_shared_notes(
+            current_user.id, since):
+        if since is None or shared_at > since:
+            shared.append(note_to_dict(note))
+        else:
+            shared_updated.append(note_to_dict(note))
+
+    visible = {note['note_id'] for note in shared}
+    deleted, unshared = [], []
+    # A full sync lists every note left: there is nothing to remove.
+    tombstones = (queries.removed_notes(current_user.id, since)
+                  if since is not None else [])
+    for tombstone in tombstones:
+        if tombstone.reason == NoteTombstone.DELETED:
+            deleted.append(tombstone.note_id)
+        elif tombstone.note_id not in visible:
+            # Shared again after being unshared.
+            unshared.append(tombstone.note_id)
+
+    body = {
+        'my_notes': {
+            'created': created,
+            'updated': updated,
+            'deleted': list(dict.fromkeys(deleted)),
+        },
+        'shared_with_me': {
+            'shared': shared,
+            'updated': shared_updated,
+            'unshared': list(dict.fromkeys(unshared)),
+        },
+        'next_cursor': encode_sync_cursor(
+            max(now - overlap, since) if since else now - overlap),
+        'full_sync': since is None,
+    }
+
+    return body
+
+
+def _insert_shares(shares) -> list:
+    """Insert ``NoteShare`` rows, skipping the ones that already exist.
+
+    :return: The ``(note_id, user_id)`` pairs that were actually added.
+    """
+    statement = insert_ignoring_conflicts(
+        db.session.get_bind().dialect.name, NoteShare,
+        [NoteShare.note_id, NoteShare.user_id])
+    result = db.session.execute(
+        statement.returning(NoteShare.note_id, NoteShare.user_id), shares)
+
+    return [tuple(row) for row in result]
+
+
+def share_notes(current_user, body):
+    """Share many notes with many users in one request.
+
+    The recipients and the notes are each resolved with one query, then
+    every note/recipient pair is inserted with a single
+    ``INSERT ... ON CONFLICT DO NOTHING`` statement.
+
+    :param body: Object with ``note_ids`` and ``user_ids`` lists.
+
+    :return: The newly created shares, the pairs that were already
+        shared, and the requested notes and users that could not be
+        used.
+    """
+    note_ids = _bulk_items(body, 'note_ids')
+    user_ids = _bulk_items(body, 'user_ids')
+
+    try:
+        note_ids = list(dict.fromkeys(int(note_id) for note_id in note_ids))
+    except (TypeError, ValueError):
+        raise error.BadRequest('note_ids must be a list of integers')
+    user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+
+    if len(note_ids) * len(user_ids) > current_app.config['NOTES_BULK_LIMIT']:
+        raise error.PayloadTooLarge(
+            message='At most {} shares can be created at once'.format(
+                current_app.config['NOTES_BULK_LIMIT']))
+
+    found_users = set(db.session.execute(
+        select(User.id).where(User.id.in_(user_ids),
+                              User.id != current_user.id)).scalars())
+    owned_notes = set(db.session.execute(
+        select(Notes.note_id).where(Notes.note_id.in_(note_ids),
+                                    Notes.owner_id ==
+                                    current_user.id)).scalars())
+
+    pairs = [(note_id, user_id) for note_id in note_ids
+             if note_id in owned_notes
+             for user_id in user_ids if user_id in found_users]
+    created = []
+    if pairs:
+        created = _insert_shares([{'note_id': note_id, 'user_id': user_id}
+                                  for note_id, user_id in pairs])
+        db.session.commit()
+        note_cache.invalidate_users({user_id for _, user_id in created})
+
+    new_pairs = set(created)
+    body = {
+        'shared': [{'note_id': note_id, 'user_id': user_id}
+                   for note_id, user_id in pairs
+                   if (note_id, user_id) in new_pairs],
+        'already_shared': [{'note_id': note_id, 'user_id': user_id}
+                           for note_id, user_id in pairs
+                           if (note_id, user_id) not in new_pairs],
+        'invalid_users': [user_id for user_id in user_ids
+                          if user_id not in found_users],
+        'missing_notes': [note_id for note_id in note_ids
+                          if note_id not in owned_notes]
+    }
+
+    return body
+
+
+def build_note_index():
+    """Load every note in the trigram index.
+
+    Reads from the primary: the watermark of the index must not lag
+    behind the notes committed.
+    """
+    with replicas.primary():
+        watermark = queries.current_timestamp()
+        batches = queries.stream_notes(
+            true(), current_app.config['NOTES_STREAM_BATCH_SIZE'])
+        note_index.build((row for batch in batches for row in batch),
+                         watermark)
+
+
+def catch_up_note_index():
+    """Apply to the trigram index the notes written and deleted since it
+    was last caught up, by this process or any other.
+
+    Like delta sync, the rows are read from ``NOTES_SYNC_OVERLAP`` seconds
+    before the watermark of the index, to include the writes of the
+    transactions that committed after it was read. They are read from the
+    primary, even in a read-only request: a replica's clock and rows lag
+    behind it by more than the overlap.
+    """
+    with replicas.primary():
+        watermark = queries.current_timestamp()
+        since = note_index.watermark - datetime.timedelta(
+            seconds=current_app.config['NOTES_SYNC_OVERLAP'])
+        note_index.catch_up(queries.written_notes(since),
+                            queries.deleted_note_ids(since), watermark,
+                            since)
+
+
+def _build_note_index_in_background():
+    app = current_app._get_current_object()
+
+    def build():
+        with app.app_context():
+            build_note_index()
+
+    note_index.start_build(build)
+
+
+def _ensure_note_index():
+    """Make the trigram index current for a search.
+
+    Builds run in the background: the search is refused until the first
+    one completes, and uses the stale index until a rebuild does.
+
+    :raises BadRequest: If the index is disabled.
+    :raises ServiceUnavailable: If the index is not built yet.
+    """
+    if not note_index.enabled:
+        raise error.BadRequest('Fuzzy search is not enabled')
+
+    if not note_index.built or note_index.needs_rebuild():
+        _build_note_index_in_background()
+    if not note_index.ready:
+        raise error.ServiceUnavailable(
+            message='The search index is being built, please retry.')
+
+    catch_up_note_index()
+
+
+def _search_distance(body):
+    if body.get('mode') != 'fuzzy':
+        return 0
+
+    maximum = current_app.config['NOTES_FUZZY_MAX_DISTANCE']
+    try:
+        distance = int(body.get('distance') or 1)
+    except (TypeError, ValueError):
+        distance = -1
+
+    if not 0 <= distance <= maximum:
+        raise error.BadRequest(
+            f'distance must be an integer between 0 and {maximum}')
+
+    return distance
+
+
+def _fuzzy_page(positions, key, note_id_page, pattern, max_distance,
+                limit, next_positions):
+    """Find the next page of notes within ``max_distance`` of ``pattern``.
+
+    The notes are scanned in id order, ``NOTES_FUZZY_SCAN_LIMIT`` ids per
+    request, and only the candidates of the trigram index are loaded. A
+    page may hold fewer than ``limit`` results, or none, with a cursor to
+    resume the scan from.
+    """
+    if key not in positions:
+        return []
+
+    scan = current_app.config['NOTES_FUZZY_SCAN_LIMIT']
+    note_ids = note_id_page(_note_position(positions[key]), scan)
+    candidates = note_index.candidates(pattern, set(note_ids), max_distance)
+
+    results = []
+    for note in queries.notes_by_ids(candidates, batch_size=scan):
+        distance = substring_distance(pattern, note.note_description,
+                                      max_distance)
+        if distance is not None:
+            result = note_to_dict(note)
+            result['distance'] = distance
+            results.append(result)
+
+    if len(results) > limit:
+        results = results[:limit]
+        next_positions[key] = results[-1]['note_id']
+    elif len(note_ids) == scan:
+        next_positions[key] = note_ids[-1]
+
+    return results
+
+
+def _substring_search(current_user, body):
+    """Search notes by substring, tolerating typos in ``fuzzy`` mode.
+
+    Both modes page through the notes in id order, like the listings.
+    Substring searches filter them in the database with ``LIKE``; fuzzy
+    searches need the trigram index, and verify its candidates against
+    the notes loaded.
+    """
+    pattern = (body.get('query') or '').strip()
+
+    if not pattern:
+        raise error.BadRequest('A search query is required')
+
+    max_distance = _search_distance(body)
+    limit = _page_limit(body.get('limit'))
+    positions = decode_cursor(body.get('cursor'),
+                              ('my_notes', 'shared_with_me'))
+    next_positions = {}
+    user_id = current_user.id
+
+    if body.get('mode') == 'fuzzy':
+        _ensure_note_index()
+        body = {
+            key: _fuzzy_page(positions, key, note_id_page, pattern,
+                             max_distance, limit, next_positions)
+            for key, note_id_page in (
+                ('my_notes', functools.partial(
+                    queries.owned_note_id_page, user_id)),
+                ('shared_with_me', functools.partial(
+                    queries.shared_note_id_page, user_id)))
+        }
+    else:
+        criteria = [queries.containing(pattern)]
+        body = {
+            key: [dict(note_to_dict(note), distance=0) for note in _paginate(
+                positions, key,
+                lambda after, size, notes_page=notes_page: notes_page(
+                    user_id, _note_position(after), size, criteria),
+                limit, lambda note: note.note_id, next_positions)]
+            for key, notes_page in (('my_notes', queries.owned_notes),
+                                    ('shared_with_me', queries.shared_notes))
+        }
+
+    body['next_cursor'] = encode_cursor(next_positions)
+
+    return body
+
+
 def search_note(current_user, body):
-    query = body.get('query')
-    notes_list = Notes.query.filter(
-        Notes.owner_id == current_user.id,
-        Notes.note_description.contains(query)).all()
-
-    reference_list = NoteShare.query.filter(
-        NoteShare.user_id == current_user.id).all()
-    
-    shared_list = []
-    for item in reference_list:
-        shared_note = Notes.query.filter(
-            Notes.note_id == item.note_id,
-            Notes.note_description.contains(query)).first()
-        shared_list.append(shared_note)
+    if body.get('mode') in SUBSTRING_MODES:
+        return _substring_search(current_user, body)
+
+    terms = search.parse_query(body.get('query'))
+
+    if not terms:
+        raise error.BadRequest('A search query is required')
+
+    limit = _page_limit(body.get('limit'))
+    positions = decode_cursor(body.get('cursor'),
+                              ('my_notes', 'shared_with_me'))
+    next_positions = {}
+
+    notes_list = _paginate(
+        positions, 'my_notes',
+        lambda after, size: queries.search_notes(
+            current_user.id, terms, after=_search_position(after),
+            limit=size),
+        limit, lambda row: [row.rank, row.note_id], next_positions)
+    shared_list = _paginate(
+        positions, 'shared_with_me',
+        lambda after, size: queries.search_notes(
+            current_user.id, terms, shared=True,
+            after=_search_position(after), limit=size),
+        limit, lambda row: [row.rank, row.note_id], next_positions)
 
     body = {
-        'my_notes': [note_to_dict(note) for note in notes_list],
-        'shared_with_me': [note_to_dict(note) for note in shared_list]
+        'my_notes': [search_result_to_dict(note) for note in notes_list],
+        'shared_with_me': [
+            search_result_to_dict(note) for note in shared_list
+        ],
+        'next_cursor': encode_cursor(next_positions)
     }
 
     return body
+
+
+def stream_search_note(current_user, body):
+    """Stream every result of a search as a JSON document.
+
+    Same as :func:`stream_all_notes`, for the results of
+    :func:`search_note`.
+    """
+    if body.get('mode') in SUBSTRING_MODES:
+        raise error.BadRequest('Only full-text searches can be streamed')
+
+    terms = search.parse_query(body.get('query'))
+
+    if not terms:
+        raise error.BadRequest('A search query is required')
+
+    user_id = current_user.id
+    batch_size = current_app.config['NOTES_STREAM_BATCH_SIZE']
+
+    return stream_json_object([
+        ('my_notes', _dict_batches(
+            queries.stream_search(user_id, terms, batch_size),
+            search_result_to_dict)),
+        ('shared_with_me', _dict_batches(
+            queries.stream_search(user_id, terms, batch_size, shared=True),
+            search_result_to_dict)),
+    ])
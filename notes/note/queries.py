@@ -0,0 +1,402 @@
+"""Visibility queries for notes.
+
+A note is visible to a user when the user owns it, or when the owner
+shared it with them through a ``NoteShare`` row. Listings are split in
+owned and shared notes, each read as a keyset page: the query seeks
+past the last key of the previous page instead of using ``OFFSET``, so
+neither the number of queries nor their cost depends on how many notes
+have been shared with the user or how deep the client paginates.
+
+The queries run on every request are built once, at import, with bound
+parameters: neither the statements nor their cache keys are rebuilt per
+request, and their SQL is compiled once per process.
+"""
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import literal
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import true
+
+from notes.domain import search
+from notes.domain.models import Notes
+from notes.domain.models import NoteShare
+from notes.domain.models import NoteTombstone
+from notes.domain.sql import CurrentTimestampMicros
+from notes.extensions import db
+
+
+def shared_note_ids(user_id):
+    """Subquery selecting the ids of the notes shared with ``user_id``."""
+    return select(NoteShare.note_id).where(NoteShare.user_id == user_id)
+
+
+def owned_by(user_id):
+    """Criterion matching the notes owned by ``user_id``."""
+    return Notes.owner_id == user_id
+
+
+def shared_with(user_id):
+    """Criterion matching the notes shared with ``user_id``."""
+    return Notes.note_id.in_(shared_note_ids(user_id))
+
+
+def visible_to(user_id):
+    """Criterion matching the notes owned by or shared with ``user_id``."""
+    return or_(owned_by(user_id), shared_with(user_id))
+
+
+def matching(terms):
+    """Criterion matching the notes found by a full-text search."""
+    backend = search.backend_for(db.session.get_bind().dialect.name, terms)
+
+    return backend.criterion(Notes.note_id)
+
+
+def containing(pattern):
+    """Criterion matching the notes whose description contains
+    ``pattern``, case-insensitively."""
+    return Notes.note_description.icontains(pattern, autoescape=True)
+
+
+def _page_statements(criterion, entity=Notes):
+    first = select(entity).where(criterion).order_by(Notes.note_id).limit(
+        bindparam('limit'))
+
+    return first, first.where(Notes.note_id > bindparam('after'))
+
+
+OWNED_BY_USER = Notes.owner_id == bindparam('user_id')
+SHARED_WITH_USER = Notes.note_id.in_(
+    select(NoteShare.note_id).where(
+        NoteShare.user_id == bindparam('user_id')))
+OWNED_PAGES = _page_statements(OWNED_BY_USER)
+SHARED_PAGES = _page_statements(SHARED_WITH_USER)
+OWNED_ID_PAGES = _page_statements(OWNED_BY_USER, Notes.note_id)
+SHARED_ID_PAGES = _page_statements(SHARED_WITH_USER, Notes.note_id)
+
+
+def _notes_page(statements, user_id, after, limit, criteria):
+    first, following = statements
+    statement = first if after is None else following
+
+    if criteria:
+        statement = statement.where(*criteria)
+    if limit is None:
+        statement = statement.limit(None)
+
+    return db.session.scalars(statement, {
+        'user_id': user_id,
+        'after': after,
+        'limit': limit,
+    }).all()
+
+
+def owned_notes(user_id, after=None, limit=None, criteria=()) -> list:
+    """Load a page of the notes owned by ``user_id``.
+
+    :param user_id: Id of the owner.
+    :param after: Only return notes with an id greater than this one.
+    :param limit: Maximum number of notes to return.
+    :param criteria: Extra filters applied to the notes.
+
+    :return: A list of ``Notes`` ordered by ``note_id``.
+    """
+    return _notes_page(OWNED_PAGES, user_id, after, limit, criteria)
+
+
+def shared_notes(user_id, after=None, limit=None, criteria=()) -> list:
+    """Load a page of the notes shared with ``user_id``.
+
+    Takes the same arguments as :func:`owned_notes`.
+    """
+    return _notes_page(SHARED_PAGES, user_id, after, limit, criteria)
+
+
+def owned_note_id_page(user_id, after=None, limit=None) -> list:
+    """Load a page of the ids of the notes owned by ``user_id``, without
+    their description.
+
+    Takes the same arguments as :func:`owned_notes`.
+    """
+    return _notes_page(OWNED_ID_PAGES, user_id, after, limit, ())
+
+
+def shared_note_id_page(user_id, after=None, limit=None) -> list:
+    """Load a page of the ids of the notes shared with ``user_id``.
+
+    Takes the same arguments as :func:`owned_notes`.
+    """
+    return _notes_page(SHARED_ID_PAGES, user_id, after, limit, ())
+
+
+def stream_notes(criterion, batch_size, criteria=()):
+    """Read notes through a server-side cursor.
+
+    Rows are fetched ``batch_size`` at a time and only expose
+    ``note_id`` and ``note_description``, so no ORM object is hydrated.
+
+    :param criterion: Visibility criterion, such as :func:`owned_by`.
+    :param batch_size: Number of rows fetched per round trip.
+    :param criteria: Extra filters applied to the notes.
+
+    :return: An iterator over lists of at most ``batch_size`` rows.
+    """
+    statement = select(Notes.note_id, Notes.note_description).where(
+        criterion, *criteria).order_by(Notes.note_id).execution_options(
+            yield_per=batch_size)
+
+    return db.session.execute(statement).partitions()
+
+
+OWNED_NOTE = select(Notes.note_id, Notes.note_description).where(
+    Notes.owner_id == bindparam('user_id'),
+    Notes.note_id == bindparam('note_id'))
+NOTE_VERSION = select(Notes.version).where(
+    Notes.owner_id == bindparam('user_id'),
+    Notes.note_id == bindparam('note_id'))
+
+
+def owned_note(user_id, note_id):
+    """Read the ``note_id`` and ``note_description`` of a note owned by
+    ``user_id``, or ``None``."""
+    return db.session.execute(OWNED_NOTE, {
+        'user_id': user_id,
+        'note_id': note_id,
+    }).one_or_none()
+
+
+def note_version(user_id, note_id):
+    """Return the version of a note owned by ``user_id``, or ``None``."""
+    return db.session.execute(NOTE_VERSION, {
+        'user_id': user_id,
+        'note_id': note_id,
+    }).scalar()
+
+
+def _listing_version_statement():
+    user_id = bindparam('user_id')
+    owned = select(
+        func.count(Notes.note_id),
+        func.coalesce(func.sum(Notes.version), 0),
+        func.max(Notes.updated_at),
+    ).where(Notes.owner_id == user_id).subquery()
+    shared = select(
+        func.count(Notes.note_id),
+        func.coalesce(func.sum(Notes.version), 0),
+        func.max(Notes.updated_at),
+        func.max(NoteShare.created_at),
+    ).join(NoteShare, NoteShare.note_id == Notes.note_id).where(
+        NoteShare.user_id == user_id).subquery()
+    removed = select(
+        func.count(NoteTombstone.id),
+        func.max(NoteTombstone.removed_at),
+    ).where(NoteTombstone.user_id == user_id).subquery()
+
+    # Every side is a single row.
+    return select(owned, shared, removed).select_from(
+        owned.join(shared, true()).join(removed, true()))
+
+
+LISTING_VERSION = _listing_version_statement()
+
+
+def listing_version(user_id) -> tuple:
+    """Summarize the notes listed for ``user_id`` with one aggregate query.
+
+    The summary moves forward whenever a note is created, updated or
+    deleted, and whenever a note is shared with or unshared from the
+    user: creations, updates and shares stamp a later ``updated_at`` or
+    ``created_at``, and removals a later tombstone. Ids are not part of
+    it, as a database may reuse the id of a deleted note.
+
+    :return: A tuple of the count, sum of versions and latest
+        ``updated_at`` of the owned notes, the same figures for the
+        shared notes followed by the latest share, then the count and
+        latest of the tombstones of the user. Timestamps are in ISO
+        format.
+    """
+    row = db.session.execute(LISTING_VERSION, {'user_id': user_id}).one()
+
+    return tuple(value.isoformat() if hasattr(value, 'isoformat') else value
+                 for value in row)
+
+
+def notes_by_ids(note_ids, batch_size=500):
+    """Load notes by id, ``batch_size`` ids per query.
+
+    :return: An iterator over ``Notes``.
+    """
+    note_ids = sorted(note_ids)
+    for start in range(0, len(note_ids), batch_size):
+        yield from Notes.query.filter(
+            Notes.note_id.in_(note_ids[start:start + batch_size])).order_by(
+                Notes.note_id)
+
+
+def current_timestamp():
+    """Return the clock used to timestamp changes, read from the database."""
+    return db.session.execute(select(CurrentTimestampMicros())).scalar()
+
+
+def changed_notes(user_id, since) -> list:
+    """Load the notes owned by ``user_id`` created or updated after
+    ``since``, or all of them when ``since`` is ``None``."""
+    query = Notes.query.filter(owned_by(user_id))
+
+    if since is not None:
+        query = query.filter(Notes.updated_at > since)
+
+    return query.order_by(Notes.note_id).all()
+
+
+def changed_shared_notes(user_id, since) -> list:
+    """Load the notes shared with ``user_id`` that were updated, or shared,
+    after ``since``.
+
+    :return: A list of ``(Notes, shared_at)`` rows.
+    """
+    query = db.session.query(Notes, NoteShare.created_at).join(
+        NoteShare, NoteShare.note_id == Notes.note_id).filter(
+            NoteShare.user_id == user_id)
+
+    if since is not None:
+        query = query.filter(
+            or_(Notes.updated_at > since, NoteShare.created_at > since))
+
+    return query.order_by(Notes.note_id).all()
+
+
+def removed_notes(user_id, since) -> list:
+    """Load the tombstones recorded for ``user_id`` after ``since``."""
+    query = NoteTombstone.query.filter(NoteTombstone.user_id == user_id)
+
+    if since is not None:
+        query = query.filter(NoteTombstone.removed_at > since)
+
+    return query.order_by(NoteTombstone.id).all()
+
+
+WRITTEN_NOTES = select(
+    Notes.note_id, Notes.note_description, Notes.created_at,
+    Notes.updated_at).where(Notes.updated_at > bindparam('since'))
+DELETED_NOTE_IDS = select(NoteTombstone.note_id).where(
+    NoteTombstone.removed_at > bindparam('since'),
+    NoteTombstone.reason == NoteTombstone.DELETED)
+
+
+def written_notes(since) -> list:
+    """Load the notes of every user created or updated after ``since``.
+
+    :return: A list of ``(note_id, note_description, created_at,
+        updated_at)`` rows.
+    """
+    return db.session.execute(WRITTEN_NOTES, {'since': since}).all()
+
+
+def deleted_note_ids(since) -> list:
+    """Load the ids of the notes of every user deleted after ``since``."""
+    return db.session.scalars(DELETED_NOTE_IDS, {'since': since}).all()
+
+
+def prune_tombstones(before, batch_size) -> int:
+    """Delete the tombstones recorded before ``before``, ``batch_size``
+    per transaction, so none holds locks for long.
+
+    :return: The number of tombstones deleted.
+    """
+    total = 0
+    while True:
+        # Selected first: MySQL has no LIMIT in IN subqueries.
+        ids = db.session.scalars(
+            select(NoteTombstone.id).where(
+                NoteTombstone.removed_at < before).order_by(
+                    NoteTombstone.id).limit(batch_size)).all()
+        if ids:
+            db.session.execute(
+                delete(NoteTombstone).where(NoteTombstone.id.in_(ids)),
+                execution_options={'synchronize_session': False})
+            db.session.commit()
+            total += len(ids)
+        if len(ids) < batch_size:
+            return total
+
+
+def record_deletions(criterion):
+    """Write the tombstones of the notes matching ``criterion``.
+
+    Must run before the notes are deleted: the shares listing the users
+    that lose access are deleted along with them.
+    """
+    note_ids = select(Notes.note_id).where(criterion)
+    removals = select(
+        Notes.note_id, Notes.owner_id, literal(NoteTombstone.DELETED),
+        CurrentTimestampMicros()).where(criterion).union_all(
+        select(NoteShare.note_id, NoteShare.user_id,
+               literal(NoteTombstone.UNSHARED),
+               CurrentTimestampMicros()).where(
+                   NoteShare.note_id.in_(note_ids)))
+
+    db.session.execute(insert(NoteTombstone).from_select(
+        ['note_id', 'user_id', 'reason', 'removed_at'], removals))
+
+
+def _search_statement(user_id, terms, shared, after):
+    backend = search.backend_for(db.session.get_bind().dialect.name, terms)
+    rank = backend.rank()
+    statement = select(
+        Notes.note_id,
+        Notes.owner_id,
+        Notes.note_description,
+        rank.label('rank'),
+        backend.snippet(Notes.note_description).label('snippet'),
+    ).select_from(Notes)
+    statement = backend.join(statement, Notes.__table__).where(
+        backend.match(),
+        shared_with(user_id) if shared else owned_by(user_id))
+
+    if after is not None:
+        last_rank, last_note_id = after
+        statement = statement.where(
+            or_(backend.seek(rank, last_rank),
+                and_(rank == last_rank, Notes.note_id > last_note_id)))
+
+    return statement.order_by(backend.order_by(rank), Notes.note_id)
+
+
+def search_notes(user_id, terms, shared=False, after=None,
+                 limit=None) -> list:
+    """Run a ranked full-text search over the notes of ``user_id``.
+
+    :param user_id: Id of the user searching.
+    :param terms: Search terms, as returned by
+        :func:`notes.domain.search.parse_query`.
+    :param shared: Search the notes shared with the user instead of the
+        notes they own.
+    :param after: ``(rank, note_id)`` of the last result of the
+        previous page.
+    :param limit: Maximum number of results to return.
+
+    :return: A list of rows exposing ``note_id``, ``owner_id``,
+        ``note_description``, ``rank`` and ``snippet``, best matches
+        first.
+    """
+    statement = _search_statement(user_id, terms, shared, after)
+
+    return db.session.execute(statement.limit(limit)).all()
+
+
+def stream_search(user_id, terms, batch_size, shared=False):
+    """Stream every result of a search in batches.
+
+    Takes the same arguments as :func:`search_notes` and returns an
+    iterator over lists of at most ``batch_size`` rows, read through a
+    server-side cursor.
+    """
+    statement = _search_statement(user_id, terms, shared, None)
+
+    return db.session.execute(
+        statement.execution_options(yield_per=batch_size)).partitions()
@@ -1,6 +1,145 @@
+import base64
+import binascii
+import datetime
+
+import ujson
+
+import notes.errors as error
+
+NOTE_DESCRIPTION_MAX_LENGTH = 512
+
+
 def note_to_dict(note) -> dict:
     if note:
         return {
             'note_id': note.note_id,
             'note_description': note.note_description
         }
+
+
+def note_etag(note_id, version) -> str:
+    """Entity tag of a note at ``version``.
+
+    Unlike listing tags, it is not hashed: conditional updates read the
+    version back with :func:`parse_note_etag`.
+    """
+    return f'{note_id}.{version}'
+
+
+def parse_note_etag(note_id, etag):
+    """Return the version of note ``note_id`` that ``etag`` refers to.
+
+    :return: The version, or ``None`` if ``etag`` is not a tag of this
+        note.
+    """
+    tag_note_id, _, version = etag.partition('.')
+
+    if tag_note_id != str(note_id) or not version.isdigit():
+        return None
+
+    return int(version)
+
+
+def validate_note_body(body):
+    """Check a note payload before it is written.
+
+    :return: A description of the problem, or ``None`` if it is valid.
+    """
+    if not isinstance(body, dict):
+        return 'A note must be an object'
+
+    note_description = body.get('note_description')
+
+    if not isinstance(note_description, str) or not note_description:
+        return 'note_description is required'
+
+    if len(note_description) > NOTE_DESCRIPTION_MAX_LENGTH:
+        return ('note_description must be at most '
+                f'{NOTE_DESCRIPTION_MAX_LENGTH} characters')
+
+    return None
+
+
+def search_result_to_dict(result) -> dict:
+    note = note_to_dict(result)
+    note['rank'] = result.rank
+    note['snippet'] = result.snippet
+
+    return note
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    """Read a page size from a request parameter, capped at ``maximum``."""
+    if value is None or value == '':
+        return default
+
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise error.BadRequest('limit must be a positive integer')
+
+    if limit < 1:
+        raise error.BadRequest('limit must be a positive integer')
+
+    return min(limit, maximum)
+
+
+def encode_cursor(positions: dict):
+    """Encode the position reached in each list into an opaque cursor.
+
+    :param positions: Last key returned for each list that has more
+        results. Exhausted lists are left out.
+
+    :return: The cursor, or ``None`` when every list is exhausted.
+    """
+    if not positions:
+        return None
+
+    data = ujson.dumps(positions).encode('utf-8')
+
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor, keys) -> dict:
+    """Decode a cursor produced by :func:`encode_cursor`.
+
+    :param cursor: The cursor sent by the client, if any.
+    :param keys: Names of the lists being paginated.
+
+    :return: The position to resume each list from. Without a cursor
+        every list starts from the beginning (``None``); lists missing
+        from the cursor are exhausted and left out.
+    """
+    if not cursor:
+        return {key: None for key in keys}
+
+    try:
+        positions = ujson.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, TypeError, ValueError):
+        raise error.BadRequest('Invalid cursor')
+
+    if not isinstance(positions, dict):
+        raise error.BadRequest('Invalid cursor')
+
+    return {key: positions[key] for key in keys if key in positions}
+
+
+def encode_sync_cursor(timestamp: datetime.datetime) -> str:
+    """Encode the point a delta sync resumes from into a cursor."""
+    return encode_cursor({'since': timestamp.isoformat()})
+
+
+def decode_sync_cursor(cursor):
+    """Decode a cursor produced by :func:`encode_sync_cursor`.
+
+    :return: The timestamp to sync from, or ``None`` for a full sync.
+    """
+    if not cursor:
+        return None
+
+    since = decode_cursor(cursor, ('since', )).get('since')
+
+    try:
+        return datetime.datetime.fromisoformat(since)
+    except (TypeError, ValueError):
+        raise error.BadRequest('Invalid cursor')
@@ -1,39 +1,123 @@
-from ratelimit import limits
 from flask import Blueprint
 from flask import Response
 from flask import jsonify
 from flask import request
+from flask import stream_with_context
 
+import notes.errors as error
 from notes.note import controller
+from notes.note.utils import note_etag
+from notes.note.utils import parse_note_etag
+from notes.auth.views import read_only
 from notes.auth.views import token_required
+from notes.extensions import limiter
 
 blueprint = Blueprint('note', __name__, url_prefix='/note')
 
 
+def _stream_requested() -> bool:
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def _stream_response(chunks) -> Response:
+    return Response(stream_with_context(chunks),
+                    content_type='application/json')
+
+
+def _expected_version(note_id):
+    """Read the version a conditional update expects from ``If-Match``.
+
+    :raises PreconditionFailed: If no strong tag of ``If-Match`` is a tag
+        of the note.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+
+    for etag in if_match.as_set():
+        version = parse_note_etag(note_id, etag)
+        if version is not None:
+            return version
+
+    raise error.PreconditionFailed(message='Invalid If-Match header')
+
+
+def _conditional_response(etag, load) -> Response:
+    """Answer a conditional GET.
+
+    ``load`` is only called, and the body only serialized, when the
+    client's ``If-None-Match`` does not match ``etag``.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(None, status=304)
+        response.headers.remove('Content-Type')
+    else:
+        response = jsonify(load())
+
+    response.set_etag(etag)
+
+    return response
+
+
 @blueprint.route('/create_note',
                  methods=['POST'])
-@limits(calls=15, period=900)
 @token_required
+@limiter.limit(calls=15, period=900)
 def create_note(current_user):
     body = request.get_json()
     note = controller.create_note(current_user, body)
     return jsonify(note)
 
 
+@blueprint.route('/bulk_create',
+                 methods=['POST'])
+@token_required
+@limiter.limit(calls=15, period=900)
+def bulk_create_notes(current_user):
+    body = request.get_json()
+    result = controller.bulk_create_notes(current_user, body)
+    return jsonify(result)
+
+
+@blueprint.route('/bulk_update',
+                 methods=['PATCH'])
+@token_required
+@limiter.limit(calls=15, period=900)
+def bulk_update_notes(current_user):
+    body = request.get_json()
+    result = controller.bulk_update_notes(current_user, body)
+    return jsonify(result)
+
+
+@blueprint.route('/bulk_delete',
+                 methods=['DELETE'])
+@token_required
+@limiter.limit(calls=15, period=900)
+def bulk_delete_notes(current_user):
+    body = request.get_json()
+    result = controller.bulk_delete_notes(current_user, body)
+    return jsonify(result)
+
+
 @blueprint.route('/update_note/<note_id>',
                  methods=['PATCH'])
-@limits(calls=15, period=900)
 @token_required
+@limiter.limit(calls=15, period=900)
 def update_note(current_user, note_id):
     body = request.get_json()
-    note = controller.update_note(current_user, note_id, body)
-    return jsonify(note)
+    note = controller.update_note(current_user, note_id, body,
+                                  expected_version=_expected_version(note_id))
+
+    response = jsonify(note)
+    response.set_etag(note_etag(note['note_id'], note['version']))
+
+    return response
 
 
 @blueprint.route('/delete_note/<note_id>',
                  methods=['DELETE'])
-@limits(calls=15, period=900)
 @token_required
+@limiter.limit(calls=15, period=900)
 def delete_note(current_user, note_id):
     controller.delete_note(current_user, note_id)
 
@@ -45,34 +129,82 @@ def delete_note(current_user, note_id):
 
 @blueprint.route('/get_note/<note_id>',
                  methods=['GET'])
-@limits(calls=15, period=900)
+@read_only
 @token_required
+@limiter.limit(calls=120, period=60)
 def get_note(current_user, note_id):
-    note = controller.get_note(current_user, note_id)
-    return jsonify(note)
+    # The tag is read first, so it is never newer than the body, and
+    # tells whether the cached body is current.
+    etag = controller.get_note_etag(current_user, note_id)
+    return _conditional_response(
+        etag, lambda: controller.get_note(current_user, note_id, etag=etag))
 
 
 @blueprint.route('/get_notes', methods=['GET'])
-@limits(calls=15, period=900)
+@read_only
 @token_required
+@limiter.limit(calls=120, period=60)
 def get_all_notes(current_user):
-    note_list = controller.get_all_notes(current_user)
-    return jsonify(note_list)
+    if _stream_requested():
+        return _stream_response(controller.stream_all_notes(current_user))
+
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    etag = controller.get_all_notes_etag(current_user, limit, cursor)
+    return _conditional_response(
+        etag, lambda: controller.get_all_notes(current_user, limit=limit,
+                                               cursor=cursor, etag=etag))
 
 
 @blueprint.route('/share_note/<note_id>/share/<share_id>',
                  methods=['POST'])
-@limits(calls=15, period=900)
 @token_required
+@limiter.limit(calls=15, period=900)
 def share_note(current_user, note_id, share_id):
     note = controller.share_note(current_user, note_id, share_id)
     return jsonify(note)
 
 
+@blueprint.route('/share_note/<note_id>/share/<share_id>',
+                 methods=['DELETE'])
+@token_required
+@limiter.limit(calls=15, period=900)
+def unshare_note(current_user, note_id, share_id):
+    controller.unshare_note(current_user, note_id, share_id)
+
+    response = Response(None, status=204)
+    response.headers.remove('Content-Type')
+
+    return response
+
+
+@blueprint.route('/changes', methods=['GET'])
+@token_required
+@limiter.limit(calls=120, period=60)
+def get_changes(current_user):
+    changes = controller.get_changes(current_user,
+                                     cursor=request.args.get('since'))
+    return jsonify(changes)
+
+
+@blueprint.route('/share_notes', methods=['POST'])
+@token_required
+@limiter.limit(calls=15, period=900)
+def share_notes(current_user):
+    body = request.get_json()
+    result = controller.share_notes(current_user, body)
+    return jsonify(result)
+
+
 @blueprint.route('/search_notes', methods=['GET'])
-@limits(calls=15, period=900)
+@read_only
 @token_required
+@limiter.limit(calls=120, period=60)
 def search_notes(current_user):
     body = request.args.to_dict()
+    if _stream_requested():
+        return _stream_response(
+            controller.stream_search_note(current_user, body))
+
     note_list = controller.search_note(current_user, body)
-    return jsonify(note_list)
\ No newline at end of file
+    return jsonify(note_list)
@@ -0,0 +1,226 @@
+"""Hashing and verification of the passwords of the users.
+
+Passwords are stored hashed with PBKDF2, in the format of passlib, e.g.
+``$pbkdf2-sha512$210000$<salt>$<checksum>`` for the default
+``SECURITY_PASSWORD_HASH`` of ``pbkdf2_sha512``. The iterations, set by
+``NOTES_PASSWORD_ITERATIONS``, make each hash cost milliseconds of CPU
+on purpose.
+
+``hashlib`` releases the GIL while it hashes, so hashes run in parallel
+with each other and with the Python code of the other requests:
+
+- In the threaded workers, the request thread hashes. It serves nothing
+  else meanwhile, so logins hashing at once take up as many of the
+  ``NOTES_THREADS`` threads of the worker: a pool would not free them,
+  the thread would wait on it instead.
+- In the ASGI app, the work runs on a pool of ``NOTES_PASSWORD_WORKERS``
+  threads of the process, and the event loop goes on serving the other
+  requests.
+
+At most ``NOTES_PASSWORD_MAX_PENDING`` hashes run or wait at once: past
+that, logins are refused with ``503 Service Unavailable`` rather than
+queued for longer than a client would wait.
+
+Passwords stored before, base64 encoded, are still verified, and
+:meth:`PasswordHasher.needs_rehash` tells the login to store them hashed
+again, as it does for hashes of fewer iterations than configured.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.util import await_only
+from sqlalchemy.util.concurrency import in_greenlet
+
+import notes.errors as error
+
+# Digest of each SECURITY_PASSWORD_HASH supported
+SCHEMES = {
+    'pbkdf2_sha256': 'sha256',
+    'pbkdf2_sha512': 'sha512',
+}
+SALT_SIZE = 16
+
+
+def _ab64_encode(data) -> str:
+    """Encode in the base64 variant of passlib, without padding."""
+    return base64.b64encode(data).decode('ascii').rstrip('=').replace(
+        '+', '.')
+
+
+def _ab64_decode(data) -> bytes:
+    data = data.replace('.', '+')
+
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
+def pbkdf2(password, salt, digest, iterations) -> bytes:
+    return hashlib.pbkdf2_hmac(digest, password.encode('utf-8'), salt,
+                               iterations)
+
+
+def encode(digest, iterations, salt, checksum) -> str:
+    return (f'$pbkdf2-{digest}${iterations}${_ab64_encode(salt)}'
+            f'${_ab64_encode(checksum)}')
+
+
+def decode(stored):
+    """Split a stored hash into ``(digest, iterations, salt, checksum)``.
+
+    :return: The parts, or ``None`` if ``stored`` is not a PBKDF2 hash.
+    """
+    parts = stored.split('$')
+    if (len(parts) != 5 or parts[0] != ''
+            or not parts[1].startswith('pbkdf2-')):
+        return None
+
+    try:
+        return (parts[1][len('pbkdf2-'):], int(parts[2]),
+                _ab64_decode(parts[3]), _ab64_decode(parts[4]))
+    except (ValueError, binascii.Error):
+        return None
+
+
+def verify_legacy(password, stored) -> bool:
+    """Verify a password stored base64 encoded, before hashing."""
+    try:
+        expected = base64.b64decode(stored.encode('ascii'), validate=True)
+    except (ValueError, binascii.Error):
+        return False
+
+    return hmac.compare_digest(password.encode('utf-8'), expected)
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords, on a bounded pool of threads in the
+    ASGI app.
+
+    Initialized in the app factory from ``SECURITY_PASSWORD_HASH`` and the
+    ``NOTES_PASSWORD_*`` settings.
+    """
+
+    def __init__(self):
+        self.digest = 'sha512'
+        self.iterations = 210000
+        self.workers = os.cpu_count() or 1
+        self.max_pending = self.workers * 16
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.hashes = 0
+        self.verifications = 0
+        self.rejections = 0
+
+    def init_app(self, app):
+        scheme = app.config.get('SECURITY_PASSWORD_HASH', 'pbkdf2_sha512')
+        if scheme not in SCHEMES:
+            raise ValueError(f'Unsupported password hash {scheme}')
+
+        self.digest = SCHEMES[scheme]
+        self.iterations = app.config.get('NOTES_PASSWORD_ITERATIONS', 210000)
+        self.workers = (app.config.get('NOTES_PASSWORD_WORKERS')
+                        or os.cpu_count() or 1)
+        self.max_pending = (app.config.get('NOTES_PASSWORD_MAX_PENDING')
+                            or self.workers * 16)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self.shutdown()
+        self.hashes = 0
+        self.verifications = 0
+        self.rejections = 0
+
+    def shutdown(self):
+        """Stop the threads of the pool, started again on next use."""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._pid = None
+
+    def _pool(self):
+        # Threads do not survive a fork: a forked worker starts its own.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='notes-password')
+                    self._pid = os.getpid()
+
+        return self._executor
+
+    def _run(self, function, *args):
+        """Run ``function`` and return its result.
+
+        In a greenlet of the ASGI app, it runs on the pool while the event
+        loop serves the other requests. Elsewhere it runs on the calling
+        thread, which would only wait for the pool.
+
+        :raise ServiceUnavailable: If ``max_pending`` hashes are running
+            or waiting already.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejections += 1
+            raise error.ServiceUnavailable(
+                message='Too many logins at once, please retry.')
+
+        try:
+            if not in_greenlet():
+                return function(*args)
+
+            future = self._pool().submit(function, *args)
+
+            return await_only(asyncio.wrap_future(future))
+        finally:
+            self._slots.release()
+
+    def hash(self, password) -> str:
+        """Hash ``password`` with a new salt, to be stored."""
+        salt = os.urandom(SALT_SIZE)
+        checksum = self._run(pbkdf2, password, salt, self.digest,
+                             self.iterations)
+        self.hashes += 1
+
+        return encode(self.digest, self.iterations, salt, checksum)
+
+    def verify(self, password, stored) -> bool:
+        """Tell whether ``password`` is the one hashed in ``stored``."""
+        if not isinstance(password, str) or not stored:
+            return False
+
+        self.verifications += 1
+        parts = decode(stored)
+        if parts is None:
+            return verify_legacy(password, stored)
+
+        digest, iterations, salt, checksum = parts
+        if digest not in SCHEMES.values():
+            return False
+
+        return hmac.compare_digest(
+            self._run(pbkdf2, password, salt, digest, iterations), checksum)
+
+    def needs_rehash(self, stored) -> bool:
+        """Tell whether ``stored`` is not hashed as configured, and should
+        be replaced on the next successful login."""
+        parts = decode(stored)
+
+        return (parts is None or parts[0] != self.digest
+                or parts[1] != self.iterations)
+
+    def stats(self) -> dict:
+        return {
+            'scheme': f'pbkdf2_{self.digest}',
+            'iterations': self.iterations,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'hashes': self.hashes,
+            'verifications': self.verifications,
+            'rejections': self.rejections,
+        }
@@ -0,0 +1,265 @@
+"""Sizing and instrumentation of the database connection pools.
+
+Every worker process holds its own pool per database, so the size of a
+pool is derived from the number of connections the app may open to the
+database across all workers, ``NOTES_DB_CONNECTION_BUDGET``, divided by
+the number of workers. The default number of workers is bounded so that
+each gets a connection per thread.
+
+The pools are observed through the SQLAlchemy pool events. Their
+checkouts and age of connections are counted by :class:`PoolMetrics`,
+and :class:`InstrumentedQueuePool` times how long checkouts wait for a
+connection, the first sign of a saturated pool.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds, in seconds, of the buckets of the wait histograms.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def worker_count(budget, threads, cpus) -> int:
+    """Default number of worker processes: two per core and one, but no
+    more than the budget gives a connection per thread to.
+
+    :param int budget: Connections the app may open to the database.
+    :param int threads: Threads serving requests in each worker.
+    :param int cpus: Number of cores.
+    """
+    return max(1, min(cpus * 2 + 1, budget // max(1, threads)))
+
+
+def pool_size(budget, workers, threads=None) -> tuple:
+    """Split a connection budget between the pools of the workers.
+
+    A connection per thread of a worker is kept open in its pool, or half
+    its share when its requests are not bound to threads, e.g. on an
+    event loop. The rest of the share is overflow opened on bursts and
+    closed once returned.
+
+    :param int budget: Connections the app may open to the database.
+    :param int workers: Number of worker processes.
+    :param int threads: Threads serving requests in each worker.
+
+    :return: A ``(pool_size, max_overflow)`` tuple.
+
+    :raise ValueError: If there are more workers than connections.
+    """
+    workers = max(1, workers)
+    share = budget // workers
+    if share < 1:
+        raise ValueError(f'{workers} workers cannot share a budget of '
+                         f'{budget} database connections')
+
+    if threads is None:
+        size = (share + 1) // 2
+    else:
+        if share < threads:
+            logging.warning(
+                '%d connections per worker for %d threads: requests will '
+                'wait for connections', share, threads)
+        size = min(share, threads)
+
+    return size, share - size
+
+
+class Histogram(object):
+    """
+    Thread-safe histogram of durations.
+
+    :param buckets: Sorted upper bounds of the buckets, in seconds.
+    """
+
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def stats(self) -> dict:
+        """Return the cumulative count of observations per bucket."""
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets + ('+Inf', ),
+                                    self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+
+            return {
+                'buckets': buckets,
+                'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    ``QueuePool`` timing how long each checkout waits for a connection,
+    including the time to open one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait = Histogram()
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait.observe(time.perf_counter() - start)
+
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool,
+                                        AsyncAdaptedQueuePool):
+    """
+    :class:`InstrumentedQueuePool` of the asyncio drivers, whose
+    checkouts wait without blocking the event loop.
+    """
+
+
+class _EngineMetrics(object):
+    def __init__(self, engine, clock):
+        self.engine = engine
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+        event.listen(engine, 'invalidate', self.on_invalidate)
+        event.listen(engine, 'close', self.on_close)
+        event.listen(engine, 'detach', self.on_close)
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            # id of the connection record to the time its connection opened
+            self._opened_at = {}
+
+    def on_connect(self, dbapi_connection, record):
+        with self._lock:
+            self.connects += 1
+            self._opened_at[id(record)] = self.clock()
+
+    def on_checkout(self, dbapi_connection, record, proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, record):
+        with self._lock:
+            self.checkins += 1
+
+    def on_invalidate(self, dbapi_connection, record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def on_close(self, dbapi_connection, record):
+        with self._lock:
+            self._opened_at.pop(id(record), None)
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        now = self.clock()
+
+        with self._lock:
+            ages = [now - opened_at for opened_at in self._opened_at.values()]
+            stats = {
+                'pool': type(pool).__name__,
+                'checked_out': self.checkouts - self.checkins,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'invalidations': self.invalidations,
+                'connections': {
+                    'open': len(ages),
+                    'oldest_age': max(ages, default=0.0),
+                    'mean_age': sum(ages) / len(ages) if ages else 0.0,
+                },
+                'recycle': pool._recycle,
+            }
+
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': max(0, pool.overflow()),
+                'max_overflow': pool._max_overflow,
+                'timeout': pool.timeout(),
+            })
+        if isinstance(pool, InstrumentedQueuePool):
+            stats['wait'] = pool.wait.stats()
+            stats['timeouts'] = pool.timeouts
+
+        return stats
+
+
+class PoolMetrics(object):
+    """
+    Metrics of the connection pools of every database engine.
+
+    Initialized in the app factory, after the database extension has
+    created the engines.
+
+    :param clock: Callable returning the current time in seconds.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._engines = {}
+
+    def init_app(self, app):
+        with app.app_context():
+            engines = dict(app.extensions['sqlalchemy'].engines)
+
+        with self._lock:
+            self._engines = {}
+        for bind_key, engine in engines.items():
+            self.instrument(bind_key or 'primary', engine)
+
+    def instrument(self, name, engine):
+        """Start collecting the metrics of the pool of ``engine``."""
+        with self._lock:
+            self._engines[name] = _EngineMetrics(engine, self.clock)
+
+    def reset(self):
+        """Zero the metrics, e.g. in a worker forked with the metrics of
+        its parent."""
+        with self._lock:
+            engines = dict(self._engines)
+
+        for metrics in engines.values():
+            metrics.reset()
+
+    def stats(self) -> dict:
+        with self._lock:
+            engines = dict(self._engines)
+
+        return {name: metrics.stats() for name, metrics in engines.items()}
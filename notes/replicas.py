@@ -0,0 +1,322 @@
+"""Routing of reads to database replicas.
+
+Read replicas are declared with the ``NOTES_REPLICA_URIS`` setting and
+registered as Flask-SQLAlchemy binds. Views marked read-only run inside
+:meth:`ReplicaRouter.reading`, which picks a replica for the request;
+:class:`RoutingSession` then sends the ``SELECT`` statements of the
+request to it, while writes and flushes always go to the primary.
+
+Replicas lag behind the primary, so two safeguards keep users from
+reading stale data:
+
+- A user who wrote keeps reading from the primary for
+  ``NOTES_REPLICA_STICKY_SECONDS``. Writes are remembered by the worker
+  process that served them, and returned to the client in the
+  :data:`STICKY_HEADER` header and a cookie. Clients sending either back
+  stay on the primary whichever worker serves them; API clients that
+  keep no cookies echo the header.
+- The lag of each replica is measured at startup, then in the background
+  every ``NOTES_REPLICA_LAG_CHECK_INTERVAL`` seconds. Replicas further
+  behind than ``NOTES_REPLICA_MAX_LAG``, or that cannot be reached, are
+  skipped until a later check finds them healthy again. When no replica
+  is usable, reads fall back to the primary.
+
+A user missing from a replica, e.g. one who just signed up, is looked up
+again on the primary rather than refused.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import after_this_request
+from flask import current_app
+from flask import has_request_context
+from flask import request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+from notes.cache import LRUCache
+from notes.utils import run_in_background
+
+# Key of ``Session.info`` holding the bind key of the replica to read
+# from.
+REPLICA = 'replica'
+# Cookie and header holding the time until which the client reads from
+# the primary.
+STICKY_COOKIE = 'notes_primary_until'
+STICKY_HEADER = 'X-Notes-Primary-Until'
+PRIMARY = 'primary'
+
+# Seconds the replica is behind the primary. Zero when it has replayed
+# everything it received, as the last replay is old on an idle primary.
+POSTGRES_LAG_SQL = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+def _is_read(clause) -> bool:
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """
+    Session sending the reads of read-only requests to a replica.
+
+    The replica is the bind key stored under :data:`REPLICA` in
+    :attr:`info`. Everything else, including the queries run while
+    flushing, uses the bind Flask-SQLAlchemy would pick.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get(REPLICA)
+
+        if (replica is not None and bind is None and not self._flushing
+                and _is_read(clause)):
+            return self._db.engines[replica]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+class ReplicaRouter(object):
+    """
+    Chooses the replica the reads of a request go to.
+
+    Initialized in the app factory from the ``NOTES_REPLICA_*``
+    settings, before the database extension so the replicas are
+    registered as binds.
+
+    :param clock: Callable returning the current time in seconds.
+    """
+
+    def __init__(self, clock=time.time):
+        self._lock = threading.RLock()
+        self.clock = clock
+        self.bind_keys = []
+        self.sticky_seconds = 5.0
+        self.max_lag = 2.0
+        self.lag_check_interval = 5.0
+        self._writers = LRUCache(maxsize=100000, ttl=self.sticky_seconds,
+                                 clock=clock)
+        self.refreshing = False
+        self._task = None
+        self._reset()
+
+    def _reset(self):
+        self._next = itertools.count()
+        # Bind key to (lag in seconds or None if unreachable, checked at)
+        self._lags = {}
+        self.reads = Counter()
+
+    def init_app(self, app):
+        with self._lock:
+            uris = app.config.get('NOTES_REPLICA_URIS') or []
+            self.bind_keys = [f'replica_{i}' for i in range(len(uris))]
+            self.sticky_seconds = app.config.get(
+                'NOTES_REPLICA_STICKY_SECONDS', 5.0)
+            self.max_lag = app.config.get('NOTES_REPLICA_MAX_LAG', 2.0)
+            self.lag_check_interval = app.config.get(
+                'NOTES_REPLICA_LAG_CHECK_INTERVAL', 5.0)
+            self._writers.clear()
+            self._writers.ttl = self.sticky_seconds
+            self._reset()
+
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update(zip(self.bind_keys, uris))
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bind_keys)
+
+    def record_write(self, user_id):
+        """Keep the reads of ``user_id`` on the primary for a while.
+
+        Within a request, the header and the cookie telling the other
+        workers are set on the response.
+        """
+        if not self.enabled:
+            return
+
+        until = self.clock() + self.sticky_seconds
+        self._writers.set(user_id, until)
+
+        if has_request_context():
+            @after_this_request
+            def stick(response):
+                response.headers[STICKY_HEADER] = str(until)
+                response.set_cookie(STICKY_COOKIE, str(until),
+                                    max_age=int(self.sticky_seconds) + 1,
+                                    httponly=True)
+                return response
+
+    def is_sticky(self, user_id) -> bool:
+        """Whether ``user_id`` wrote too recently to read from a replica."""
+        if user_id is not None and self._writers.get(user_id) is not None:
+            return True
+
+        if not has_request_context():
+            return False
+
+        now = self.clock()
+        for value in (request.headers.get(STICKY_HEADER),
+                      request.cookies.get(STICKY_COOKIE)):
+            try:
+                until = float(value or 0)
+            except ValueError:
+                continue
+            # Later times were not set by a write: they would keep the
+            # client on the primary for good.
+            if now < until <= now + self.sticky_seconds:
+                return True
+
+        return False
+
+    def _measure_lag(self, bind_key):
+        """Return the lag of a replica in seconds, or ``None`` if it cannot
+        be reached."""
+        engine = current_app.extensions['sqlalchemy'].engines[bind_key]
+        if engine.dialect.name != 'postgresql':
+            return 0.0
+
+        try:
+            with engine.connect() as connection:
+                lag = connection.execute(POSTGRES_LAG_SQL).scalar()
+        except SQLAlchemyError:
+            logging.exception('Could not measure the lag of %s', bind_key)
+            return None
+
+        # NULL when the server is not replaying, i.e. not a replica.
+        return float(lag or 0)
+
+    def refresh_lags(self):
+        """Measure the lag of every replica."""
+        for bind_key in self.bind_keys:
+            lag = self._measure_lag(bind_key)
+            with self._lock:
+                self._lags[bind_key] = (lag, self.clock())
+
+    def _start_refresh(self):
+        """Run :meth:`refresh_lags` in the background, unless a refresh is
+        running."""
+        with self._lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.refresh_lags()
+            except Exception:
+                logging.exception('Could not measure the lag of the replicas')
+            finally:
+                with self._lock:
+                    self.refreshing = False
+
+        # Referenced until done, or the loop may collect it.
+        self._task = run_in_background(run, 'notes-replica-lag')
+
+    def lag(self, bind_key):
+        """Return the last lag measured for a replica, ``None`` if it was
+        unreachable or never measured.
+
+        A measure older than the check interval starts a refresh, without
+        waiting for it.
+        """
+        with self._lock:
+            checked_at = self._lags.get(bind_key, (None, None))[1]
+
+        if (checked_at is None or
+                self.clock() - checked_at >= self.lag_check_interval):
+            self._start_refresh()
+
+        with self._lock:
+            return self._lags.get(bind_key, (None, None))[0]
+
+    def healthy(self, bind_key) -> bool:
+        lag = self.lag(bind_key)
+
+        return lag is not None and lag <= self.max_lag
+
+    def choose(self, user_id=None):
+        """Pick the replica to read from, in turn.
+
+        :return: A bind key, or ``None`` to read from the primary.
+        """
+        if not self.enabled or self.is_sticky(user_id):
+            return None
+
+        start = next(self._next)
+        for i in range(len(self.bind_keys)):
+            bind_key = self.bind_keys[(start + i) % len(self.bind_keys)]
+            if self.healthy(bind_key):
+                return bind_key
+
+        return None
+
+    @contextmanager
+    def reading(self, user_id=None):
+        """Send the reads of the block to a replica, if one is usable.
+
+        :param user_id: Id of the user reading, to keep them on the
+            primary after their writes.
+        """
+        session = current_app.extensions['sqlalchemy'].session
+        bind_key = self.choose(user_id) if self.enabled else None
+        self.reads[bind_key or PRIMARY] += 1
+        previous = session.info.get(REPLICA)
+        session.info[REPLICA] = bind_key
+
+        try:
+            yield bind_key
+        finally:
+            session.info[REPLICA] = previous
+
+    def current(self):
+        """Return the bind key of the replica the reads of the session go
+        to, or ``None`` for the primary."""
+        return current_app.extensions['sqlalchemy'].session.info.get(REPLICA)
+
+    @contextmanager
+    def primary(self):
+        """Send the reads of the block to the primary, even within
+        :meth:`reading`, for reads that must not lag behind it."""
+        session = current_app.extensions['sqlalchemy'].session
+        previous = session.info.get(REPLICA)
+        session.info[REPLICA] = None
+
+        try:
+            yield
+        finally:
+            session.info[REPLICA] = previous
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'max_lag': self.max_lag,
+                'sticky_seconds': self.sticky_seconds,
+                'sticky_users': len(self._writers),
+                'refreshing': self.refreshing,
+                'replicas': {
+                    bind_key: {
+                        'lag': self._lags.get(bind_key, (None, None))[0],
+                        'checked_at': self._lags.get(bind_key,
+                                                     (None, None))[1],
+                        'reads': self.reads[bind_key],
+                    }
+                    for bind_key in self.bind_keys
+                },
+                'primary_reads': self.reads[PRIMARY],
+            }
@@ -1,5 +1,41 @@
 """Application configuration."""
 import os
+import tempfile
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+
+from notes.pool import InstrumentedAsyncAdaptedQueuePool
+from notes.pool import InstrumentedQueuePool
+from notes.pool import pool_size
+
+# asyncio driver replacing each synchronous driver in the async mode
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_uri(uri) -> str:
+    """Return ``uri`` with its driver replaced by the asyncio one."""
+    url = make_url(uri)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+
+    return url.set(drivername=drivername).render_as_string(
+        hide_password=False)
+
+
+def use_async_drivers(config):
+    """Switch the database URIs of an app configuration to the asyncio
+    drivers."""
+    config['SQLALCHEMY_DATABASE_URI'] = async_database_uri(
+        config['SQLALCHEMY_DATABASE_URI'])
+    config['NOTES_REPLICA_URIS'] = [
+        async_database_uri(uri) for uri in config.get('NOTES_REPLICA_URIS', [])
+    ]
+
 
 class Config(object):
     """Base configuration."""
@@ -18,6 +54,118 @@ class Config(object):
     SECURITY_TRACKABLE = True
     SECURITY_PASSWORD_SALT = 'something_super_secret_change_in_production'
     SECURITY_TOKEN_MAX_AGE = 3600
+    # PBKDF2 iterations of the password hashes. Stored hashes of other
+    # iterations are replaced on the next login.
+    NOTES_PASSWORD_ITERATIONS = int(
+        os.environ.get('NOTES_PASSWORD_ITERATIONS', 210000))
+    # Threads hashing passwords in the ASGI app, one per core by default.
+    # The threaded workers hash on the request threads.
+    NOTES_PASSWORD_WORKERS = None
+    # Hashes running or waiting at once, beyond which logins are refused
+    NOTES_PASSWORD_MAX_PENDING = None
+
+    # Errors of a fingerprint are logged once per window, in seconds, with
+    # their number of occurrences since
+    NOTES_ERROR_LOG_WINDOW = 60
+    # Fingerprints counted, the least recently seen forgotten beyond
+    NOTES_ERROR_LOG_MAX_FINGERPRINTS = 1000
+
+    # Page sizes of the note listings
+    NOTES_PAGE_LIMIT = 100
+    NOTES_MAX_PAGE_LIMIT = 500
+    # Rows fetched per round trip when streaming a listing
+    NOTES_STREAM_BATCH_SIZE = 500
+    # Maximum number of notes accepted by a single bulk request
+    NOTES_BULK_LIMIT = 10000
+
+    # Per-user cache of get_note and get_notes responses
+    NOTES_CACHE_ENABLED = True
+    NOTES_CACHE_MAX_USERS = 10000
+    NOTES_CACHE_MAX_KEYS_PER_USER = 32
+    NOTES_CACHE_TTL = 30
+
+    # Per-process cache of the users authenticated by tokens. Entries
+    # also expire with their token. Changes made through other workers
+    # are not seen before the TTL: a user deleted there stays
+    # authenticated here for this many seconds at most.
+    NOTES_TOKEN_CACHE_ENABLED = True
+    NOTES_TOKEN_CACHE_MAX_TOKENS = 100000
+    NOTES_TOKEN_CACHE_TTL = 5
+
+    # Per-process cache of the users resolved by /auth/users/lookup
+    NOTES_USER_LOOKUP_CACHE_ENABLED = True
+    NOTES_USER_LOOKUP_CACHE_MAX_USERS = 100000
+    NOTES_USER_LOOKUP_CACHE_TTL = 300
+    # Maximum number of emails resolved by a single lookup
+    NOTES_USER_LOOKUP_LIMIT = 500
+
+    # Proxies in front of the app whose X-Forwarded-For is trusted. Left
+    # at 0 when clients reach the app directly, who could send any.
+    NOTES_TRUSTED_PROXIES = int(os.environ.get('NOTES_TRUSTED_PROXIES', 0))
+
+    # Rate limiting of the endpoints, per user or IP address. The buckets
+    # are kept in the worker process, 'memory', or in an SQLite file shared
+    # by the workers of the host, 'sqlite:///path/to/file.db'.
+    NOTES_RATE_LIMIT_ENABLED = True
+    NOTES_RATE_LIMIT_STORE = os.environ.get('NOTES_RATE_LIMIT_STORE',
+                                            'memory')
+
+    # Seconds of changes repeated by consecutive delta syncs, to include
+    # transactions committed after the previous sync read the clock.
+    # Changes are stamped when their statement starts: one committed
+    # later than this is missed by delta sync and by the catch-up of the
+    # trigram index. Requests commit right after they write; keep longer
+    # write transactions, e.g. in scripts, below this.
+    NOTES_SYNC_OVERLAP = 1.0
+    # Seconds tombstones are kept for delta sync. Older cursors get a
+    # full sync, and scripts/prune_note_tombstones.py deletes older
+    # tombstones.
+    NOTES_SYNC_RETENTION = 30 * 24 * 3600
+
+    # In-process trigram index for fuzzy search, built at startup
+    NOTES_TRIGRAM_INDEX_ENABLED = False
+    # Rebuild the index once stale postings exceed this share of notes
+    NOTES_TRIGRAM_REBUILD_RATIO = 0.5
+    # Maximum number of typos accepted by fuzzy search
+    NOTES_FUZZY_MAX_DISTANCE = 2
+    # Note ids scanned per list by a page of fuzzy search
+    NOTES_FUZZY_SCAN_LIMIT = 5000
+
+    # Read replicas of the database, as comma-separated URIs. The reads of
+    # get_note, get_notes and search_notes are spread over them.
+    NOTES_REPLICA_URIS = [
+        uri for uri in os.environ.get('NOTES_REPLICA_URIS', '').split(',')
+        if uri
+    ]
+    # Seconds during which a user who wrote keeps reading from the primary.
+    # Other workers know it from the X-Notes-Primary-Until header or the
+    # cookie, which clients send back.
+    NOTES_REPLICA_STICKY_SECONDS = 5.0
+    # Replicas further behind the primary, in seconds, are not read from
+    NOTES_REPLICA_MAX_LAG = 2.0
+    # Seconds between two measures of the lag of a replica, taken in the
+    # background
+    NOTES_REPLICA_LAG_CHECK_INTERVAL = 5.0
+
+    # Run the database on the asyncio drivers, for the ASGI app of
+    # notes/autoasgi.py, which sets it
+    NOTES_ASYNC = False
+
+    # Secret sent in the X-Stats-Key header to read /stats. Without it,
+    # /stats is not served.
+    NOTES_STATS_KEY = os.environ.get('NOTES_STATS_KEY')
+
+    # Connections the app may open to each database, across all workers
+    NOTES_DB_CONNECTION_BUDGET = int(
+        os.environ.get('NOTES_DB_CONNECTION_BUDGET', 90))
+    # Worker processes sharing the budget, as set for gunicorn
+    NOTES_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+    # Threads serving requests in each worker, each using a connection
+    NOTES_THREADS = int(os.environ.get('NOTES_THREADS', 4))
+    # Seconds a request waits for a connection before failing
+    NOTES_DB_POOL_TIMEOUT = 10
+    # Connections older than this many seconds are replaced
+    NOTES_DB_POOL_RECYCLE = 1800
 
     @property
     def db_uri_fragments(self):
@@ -63,13 +211,46 @@ class Config(object):
             *[e[0] for e in self.db_uri_fragments])
     SQLALCHEMY_DATABASE_URI: str = set_sqlalchemy_database_uri
 
+    @property
+    def engine_options(self):
+        if self.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+            if self.NOTES_ASYNC and make_url(
+                    self.SQLALCHEMY_DATABASE_URI).database in (None, ''):
+                # Flask-SQLAlchemy only shares an in-memory database
+                # between the connections of the synchronous driver.
+                return {'poolclass': StaticPool}
+            # SQLite connections are not pooled.
+            return {}
+
+        size, overflow = pool_size(
+            self.NOTES_DB_CONNECTION_BUDGET, self.NOTES_WORKERS,
+            None if self.NOTES_ASYNC else self.NOTES_THREADS)
+
+        return {
+            'poolclass': (InstrumentedAsyncAdaptedQueuePool
+                          if self.NOTES_ASYNC else InstrumentedQueuePool),
+            'pool_size': size,
+            'max_overflow': overflow,
+            'pool_timeout': self.NOTES_DB_POOL_TIMEOUT,
+            'pool_recycle': self.NOTES_DB_POOL_RECYCLE,
+            'pool_pre_ping': True,
+        }
+    SQLALCHEMY_ENGINE_OPTIONS: dict = engine_options
+
 class ProdConfig(Config):
     """Production configuration."""
 
     ENV = 'prod'
     DEBUG = False
-    SQLALCHEMY_POOL_SIZE: int = 50
-    SQLALCHEMY_MAX_OVERFLOW: int = 70
+
+    # The load balancer
+    NOTES_TRUSTED_PROXIES = int(os.environ.get('NOTES_TRUSTED_PROXIES', 1))
+
+    # Shared by the gunicorn workers
+    NOTES_RATE_LIMIT_STORE = os.environ.get(
+        'NOTES_RATE_LIMIT_STORE',
+        'sqlite:///' + os.path.join(tempfile.gettempdir(),
+                                    'notes-rate-limit.db'))
 
 
 class DevConfig(Config):
@@ -77,8 +258,6 @@ class DevConfig(Config):
 
     ENV = 'dev'
     DEBUG = True
-    SQLALCHEMY_POOL_SIZE: int = 50
-    SQLALCHEMY_MAX_OVERFLOW: int = 70
 
 
 class TestConfig(Config):
@@ -91,9 +270,16 @@ class TestConfig(Config):
 
     # Bcrypt algorithm hashing rounds (reduced for testing purposes only!)
     BCRYPT_LOG_ROUNDS = 4
+    # Likewise for PBKDF2 iterations
+    NOTES_PASSWORD_ITERATIONS = 1000
     # Enable the TESTING flag to disable the error catching during request handling
     # so that you get better error reports when performing test requests against the application.
     TESTING = True
 
     # Disable CSRF tokens in the Forms (only valid for testing purposes!)
     WTF_CSRF_ENABLED = False
+
+    # Tests enable it where they exercise it
+    NOTES_RATE_LIMIT_ENABLED = False
+
+    NOTES_STATS_KEY = 'stats-key'
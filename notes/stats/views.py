@@ -0,0 +1,83 @@
+"""Counters of the extensions of the worker serving the request.
+
+They expose the topology of the databases, the saturation of the pools
+and the state of the rate limits: they are only served when
+``NOTES_STATS_KEY`` is set, to the requests that send it in the
+``X-Stats-Key`` header, and are not found otherwise.
+"""
+import hmac
+
+from flask import Blueprint
+from flask import current_app
+from flask import jsonify
+from flask import request
+
+import notes.errors as error
+from notes.extensions import error_log
+from notes.extensions import limiter
+from notes.extensions import note_cache
+from notes.extensions import note_index
+from notes.extensions import passwords
+from notes.extensions import pool_metrics
+from notes.extensions import replicas
+from notes.extensions import token_cache
+from notes.extensions import user_lookup_cache
+
+blueprint = Blueprint('stats', __name__, url_prefix='/stats')
+
+KEY_HEADER = 'X-Stats-Key'
+
+
+@blueprint.before_request
+def require_stats_key():
+    key = current_app.config.get('NOTES_STATS_KEY')
+    sent = request.headers.get(KEY_HEADER)
+
+    if not key or sent is None or not hmac.compare_digest(
+            sent.encode('utf-8'), key.encode('utf-8')):
+        raise error.NotFound()
+
+
+@blueprint.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(note_cache.stats())
+
+
+@blueprint.route('/trigram', methods=['GET'])
+def trigram_stats():
+    return jsonify(note_index.stats())
+
+
+@blueprint.route('/replicas', methods=['GET'])
+def replica_stats():
+    return jsonify(replicas.stats())
+
+
+@blueprint.route('/errors', methods=['GET'])
+def error_stats():
+    return jsonify(error_log.stats())
+
+
+@blueprint.route('/passwords', methods=['GET'])
+def password_stats():
+    return jsonify(passwords.stats())
+
+
+@blueprint.route('/pool', methods=['GET'])
+def pool_stats():
+    return jsonify(pool_metrics.stats())
+
+
+@blueprint.route('/rate_limits', methods=['GET'])
+def rate_limit_stats():
+    return jsonify(limiter.stats())
+
+
+@blueprint.route('/tokens', methods=['GET'])
+def token_stats():
+    return jsonify(token_cache.stats())
+
+
+@blueprint.route('/user_lookups', methods=['GET'])
+def user_lookup_stats():
+    return jsonify(user_lookup_cache.stats())
@@ -0,0 +1,285 @@
+"""In-process trigram index over note descriptions.
+
+Substring queries cannot use the B-tree indexes of the database, and the
+full-text index only matches whole words. This index maps every
+trigram (three consecutive characters, case-folded) to the sorted array
+of the ids of the notes containing it, so the notes that may contain a
+string, or something within a few typos of it, are found by merging a
+handful of posting lists.
+
+The index only narrows down candidates: it never holds descriptions,
+and results must be verified against the notes loaded from the
+database. Thanks to that, updates and deletions are lazy. Updated notes
+keep their old postings and deleted notes are only flagged, until the
+amount of stale data makes :meth:`TrigramIndex.needs_rebuild` true.
+
+Each worker process keeps its own index, and catches it up from the
+database before each search: the notes whose ``updated_at`` is past the
+watermark of the index, and the tombstones of deleted notes, cover the
+writes of every process. Notes deleted without a tombstone, along with
+their owner, are never searched again: the candidates are limited to the
+notes visible to the user.
+
+The index is built when the app starts. Later builds, when it could not
+be built then or when stale postings call for it, run in the background
+with :meth:`TrigramIndex.start_build`: requests never wait for one.
+"""
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from notes.utils import run_in_background
+
+# Each edit of a string changes at most this many of its trigrams.
+GRAMS_PER_EDIT = 3
+
+
+def trigrams(text) -> set:
+    """Return the distinct trigrams of ``text``, case-folded."""
+    text = (text or '').casefold()
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def substring_distance(pattern, text, limit):
+    """
+    Compute the smallest edit distance between ``pattern`` and any
+    substring of ``text``, comparing case-folded strings.
+
+    :param int limit: Largest distance of interest.
+
+    :return: The distance, or ``None`` if it is greater than ``limit``.
+    """
+    pattern = pattern.casefold()
+    text = text.casefold()
+
+    if pattern in text:
+        return 0
+
+    # Sellers' algorithm: the edit distance matrix of pattern and text,
+    # where the match may start anywhere in the text for free.
+    previous = list(range(len(pattern) + 1))
+    best = previous[-1]
+    for char in text:
+        current = [0]
+        for i, pattern_char in enumerate(pattern, 1):
+            current.append(min(previous[i - 1] + (pattern_char != char),
+                               previous[i] + 1,
+                               current[i - 1] + 1))
+        best = min(best, current[-1])
+        previous = current
+
+    return best if best <= limit else None
+
+
+def _contains(postings, note_id) -> bool:
+    i = bisect_left(postings, note_id)
+
+    return i < len(postings) and postings[i] == note_id
+
+
+class TrigramIndex(object):
+    """
+    Trigram inverted index with array-backed posting lists.
+
+    Postings are ``array('I')`` of note ids kept sorted: four bytes per
+    entry, instead of a pointer to a Python int object.
+
+    Initialized in the app factory from the ``NOTES_TRIGRAM_*``
+    settings, and built from the database at startup, or in the
+    background by :meth:`start_build`.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.enabled = False
+        self.rebuild_ratio = 0.5
+        self.built = False
+        self.building = False
+        self._task = None
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}
+        self._deleted = set()
+        self.size = 0
+        self.stale = 0
+        # Time of the database the index is current at
+        self.watermark = None
+        # Note id to the updated_at applied, for the writes that the next
+        # catch-up may read again
+        self._applied = {}
+
+    def init_app(self, app):
+        with self._lock:
+            self.enabled = app.config.get('NOTES_TRIGRAM_INDEX_ENABLED',
+                                          False)
+            self.rebuild_ratio = app.config.get('NOTES_TRIGRAM_REBUILD_RATIO',
+                                                0.5)
+            self.built = False
+            self._reset()
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self.built
+
+    def needs_rebuild(self) -> bool:
+        """Whether stale postings outweigh the ratio configured."""
+        return self.stale > self.rebuild_ratio * max(self.size, 1)
+
+    def build(self, rows, watermark):
+        """Replace the content of the index.
+
+        The rows are read without holding the lock: in the async mode,
+        the requests served meanwhile run on the same thread and would
+        enter it. Writes committed meanwhile are applied by the next
+        :meth:`catch_up`.
+
+        :param rows: Iterable of ``(note_id, note_description)``.
+        :param watermark: Time of the database read before the rows.
+        """
+        index = TrigramIndex()
+        for note_id, description in rows:
+            index._add(note_id, description)
+
+        with self._lock:
+            self._postings = index._postings
+            self._deleted = index._deleted
+            self.size = index.size
+            self.stale = index.stale
+            self.watermark = watermark
+            self._applied = {}
+            self.built = True
+
+    def start_build(self, build) -> bool:
+        """Run ``build`` in the background, unless a build is running.
+
+        :param build: Callable loading the notes with :meth:`build`.
+
+        :return: Whether a build was started.
+        """
+        with self._lock:
+            if self.building:
+                return False
+            self.building = True
+
+        def run():
+            try:
+                build()
+            except Exception:
+                logging.exception('Could not build the trigram index')
+            finally:
+                with self._lock:
+                    self.building = False
+
+        # Referenced until done, or the loop may collect it.
+        self._task = run_in_background(run, 'notes-trigram')
+
+        return True
+
+    def _add(self, note_id, description):
+        for gram in trigrams(description):
+            postings = self._postings.get(gram)
+            if postings is None:
+                self._postings[gram] = array('I', [note_id])
+            elif postings[-1] < note_id:
+                postings.append(note_id)
+            elif not _contains(postings, note_id):
+                postings.insert(bisect_left(postings, note_id), note_id)
+        self.size += 1
+
+    def catch_up(self, written, deleted, watermark, since):
+        """Apply the writes read from the database since ``since``.
+
+        ``since`` precedes the watermark of the index, so writes already
+        applied are read again: they are recognized by their
+        ``updated_at`` and skipped. Updated notes keep the postings of
+        their previous description.
+
+        :param written: Iterable of ``(note_id, note_description,
+            created_at, updated_at)`` of the notes written after
+            ``since``.
+        :param deleted: Ids of the notes deleted after ``since``.
+        :param watermark: Time of the database read before the rows.
+        """
+        with self._lock:
+            if not self.ready:
+                return
+
+            # Rows written before ``since`` are not read again.
+            self._applied = {note_id: updated_at for note_id, updated_at
+                             in self._applied.items() if updated_at > since}
+            for note_id, description, created_at, updated_at in written:
+                applied = self._applied.get(note_id)
+                if applied == updated_at:
+                    continue
+                self._applied[note_id] = updated_at
+                self._add(note_id, description)
+                if applied is not None or created_at <= since:
+                    self.size -= 1
+                    self.stale += 1
+
+            for note_id in deleted:
+                if note_id not in self._deleted:
+                    self._deleted.add(note_id)
+                    self.size -= 1
+                    self.stale += 1
+
+            self.watermark = max(self.watermark, watermark)
+
+    def candidates(self, pattern, note_ids, max_distance=0) -> set:
+        """Find the notes that may match ``pattern``.
+
+        A string within ``max_distance`` edits of ``pattern`` shares at
+        least ``len(trigrams(pattern)) - 3 * max_distance`` trigrams with
+        it. Patterns too short for that bound to filter anything match
+        every note.
+
+        :param note_ids: Set of the ids of the notes to search, those
+            visible to the user.
+        :param int max_distance: Number of typos allowed.
+
+        :return: A subset of ``note_ids``, to verify against the notes.
+        """
+        grams = trigrams(pattern)
+        threshold = len(grams) - GRAMS_PER_EDIT * max_distance
+
+        with self._lock:
+            note_ids = note_ids - self._deleted
+            if threshold <= 0:
+                return note_ids
+
+            counts = Counter()
+            for gram in grams:
+                postings = self._postings.get(gram, ())
+                # Walk whichever of the two lists is shorter.
+                if len(postings) <= len(note_ids):
+                    counts.update(note_id for note_id in postings
+                                  if note_id in note_ids)
+                else:
+                    counts.update(note_id for note_id in note_ids
+                                  if _contains(postings, note_id))
+
+        return {note_id for note_id, count in counts.items()
+                if count >= threshold}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'built': self.built,
+                'building': self.building,
+                'notes': self.size,
+                'trigrams': len(self._postings),
+                'postings': sum(len(postings)
+                                for postings in self._postings.values()),
+                'postings_bytes': sum(
+                    postings.itemsize * len(postings)
+                    for postings in self._postings.values()),
+                'deleted': len(self._deleted),
+                'stale': self.stale,
+                'watermark': (self.watermark.isoformat()
+                              if self.watermark else None),
+            }
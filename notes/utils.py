@@ -1,7 +1,13 @@
+import asyncio
 import datetime
+import hashlib
+import threading
 import flask
+import ujson
 
 from functools import wraps
+from sqlalchemy.util import greenlet_spawn
+from sqlalchemy.util.concurrency import in_greenlet
 import notes.errors as error
 
 HEADERS = {'Content-Type': 'application/json'}
@@ -61,6 +67,61 @@ class AbstractParam(object):
         return wrapper
 
 
+def stream_json_object(sections):
+    """
+    Serialize a JSON object whose values are arrays, one chunk at a time.
+
+    :param sections: Iterable of ``(key, batches)`` tuples, where
+        ``batches`` is an iterator over lists of JSON-serializable items.
+        Each batch is rendered as a single chunk, so at most one batch is
+        held in memory at once.
+
+    :return: A generator of ``str`` chunks suitable for a streamed
+        response.
+    """
+    yield '{'
+    for index, (key, batches) in enumerate(sections):
+        if index:
+            yield ','
+        yield ujson.dumps(key) + ':['
+        separator = ''
+        for batch in batches:
+            if batch:
+                yield separator + ','.join(ujson.dumps(item)
+                                           for item in batch)
+                separator = ','
+        yield ']'
+    yield '}'
+
+
+def run_in_background(function, name):
+    """Run ``function`` without waiting for it.
+
+    In a greenlet of the ASGI app, ``function`` runs in a greenlet of the
+    event loop, as the asyncio drivers require; elsewhere on a daemon
+    thread.
+
+    :return: The asyncio task, to keep referenced until it is done, or
+        ``None``.
+    """
+    if in_greenlet():
+        return asyncio.get_running_loop().create_task(
+            greenlet_spawn(function))
+
+    threading.Thread(target=function, name=name, daemon=True).start()
+
+    return None
+
+
+def make_etag(*parts) -> str:
+    """
+    Build a strong entity tag from JSON-serializable values.
+
+    :return: A hex digest, without the surrounding quotes.
+    """
+    return hashlib.sha1(ujson.dumps(parts).encode('utf-8')).hexdigest()
+
+
 def datetime_to_epoch_micros(date: datetime.datetime) -> int:
     epoch_micros = int(date.timestamp() * 1000000)
 
@@ -0,0 +1,101 @@
+"""Detect the language of the notes written before it was stored.
+
+Notes created in bulk are stored without a language as well: run it
+periodically, e.g. from cron, to detect theirs.
+
+Detection is CPU bound and runs on a pool of worker processes, one per
+core by default. While the workers process a batch, the main process
+stores the results of the previous batch and reads the next one, so the
+workers are never waiting on the database.
+
+usage: python3 scripts/backfill_note_language.py [--batch-size N]
+                                                 [--processes N]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import update
+
+from notes.domain.language import detect_language
+from notes.domain.models import Notes
+from notes.extensions import db
+
+
+def pending_notes(after, batch_size) -> list:
+    """Read the next batch of notes without a language."""
+    return db.session.execute(
+        select(Notes.note_id, Notes.note_description).where(
+            Notes.language.is_(None), Notes.note_id > after).order_by(
+                Notes.note_id).limit(batch_size)).all()
+
+
+def store_languages(note_ids, languages) -> int:
+    notes = Notes.__table__
+    # Not a change of the note: keep updated_at, so delta sync does not
+    # send every note again.
+    statement = update(notes).where(
+        notes.c.note_id == bindparam('b_note_id')).values(
+            language=bindparam('b_language'),
+            updated_at=notes.c.updated_at)
+    db.session.execute(statement, [
+        {'b_note_id': note_id, 'b_language': language}
+        for note_id, language in zip(note_ids, languages)
+    ])
+    db.session.commit()
+
+    return len(note_ids)
+
+
+def backfill(pool, batch_size, processes) -> int:
+    """Detect the language of every note without one.
+
+    :return: The number of notes updated.
+    """
+    chunksize = max(1, batch_size // (processes * 4))
+    total = 0
+    after = 0
+    previous = None
+
+    while True:
+        rows = pending_notes(after, batch_size)
+        current = None
+        if rows:
+            after = rows[-1].note_id
+            current = ([row.note_id for row in rows],
+                       pool.map_async(detect_language,
+                                      [row.note_description for row in rows],
+                                      chunksize))
+
+        if previous is not None:
+            note_ids, result = previous
+            total += store_languages(note_ids, result.get())
+            logging.info('Detected the language of %d notes', total)
+
+        if current is None:
+            return total
+        previous = current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    # Start the workers before the app opens database connections, so
+    # they do not inherit them.
+    with multiprocessing.Pool(args.processes) as pool:
+        from notes.autoapp import app
+
+        with app.app_context():
+            total = backfill(pool, args.batch_size, args.processes)
+
+    print(f'Detected the language of {total} notes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Measure the login throughput at the configured password hashing cost.
+
+Client threads log in through the app for a few seconds each, against a
+file-backed SQLite database. Like the request threads of a threaded
+worker, each verifies the passwords itself, with
+``NOTES_PASSWORD_ITERATIONS`` iterations, the production setting unless
+set otherwise.
+
+usage: python3 scripts/bench_login.py [--clients 1,2,4,8] [--seconds S]
+    [--iterations N]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from notes.app import create_app
+from notes.domain.models import User
+from notes.extensions import db
+from notes.extensions import passwords
+from notes.settings import Config
+from notes.settings import TestConfig
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'correct horse battery staple'
+
+
+def populate():
+    db.create_all()
+    db.session.add(User(id='1', email=EMAIL,
+                        password=passwords.hash(PASSWORD)))
+    db.session.commit()
+
+
+def run(app, clients, seconds):
+    """Log in from ``clients`` threads for ``seconds``.
+
+    :return: The logins per second, and the latencies in milliseconds.
+    """
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        test_client = app.test_client()
+        mine = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = test_client.post('/auth/login', json={
+                'email': EMAIL, 'password': PASSWORD})
+            assert response.status_code == 200, response.data
+            mine.append((time.perf_counter() - started) * 1000)
+        latencies.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', default='1,2,4,8')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--iterations', type=int,
+                        default=Config.NOTES_PASSWORD_ITERATIONS)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    class BenchConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+            directory, 'bench.db')
+        NOTES_PASSWORD_ITERATIONS = args.iterations
+
+    app = create_app(BenchConfig())
+    with app.app_context():
+        populate()
+
+    stats = passwords.stats()
+    print(f'{stats["scheme"]}, {stats["iterations"]} iterations')
+    print(f'{"clients":<9}{"logins/s":>10}{"p50 (ms)":>10}{"p99 (ms)":>10}')
+    for clients in (int(value) for value in args.clients.split(',')):
+        rate, latencies = run(app, clients, args.seconds)
+        percentiles = statistics.quantiles(latencies, n=100)
+        print(f'{clients:<9}{rate:>10.1f}{percentiles[49]:>10.1f}'
+              f'{percentiles[98]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
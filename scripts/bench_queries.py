@@ -0,0 +1,136 @@
+"""Measure the Python overhead of the queries run on every request.
+
+Each hot query is timed twice against an in-memory SQLite database: as
+it used to be written, with a statement built on every call, and as
+the cached statement the app now runs. The database work is the same
+in both cases, so the difference is the cost of building the statement
+and looking up its compiled form.
+
+usage: python3 scripts/bench_queries.py [--iterations N]
+"""
+import argparse
+import base64
+import timeit
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import true
+
+from notes.app import create_app
+from notes.auth import queries as auth_queries
+from notes.domain.models import Notes
+from notes.domain.models import NoteShare
+from notes.domain.models import User
+from notes.extensions import db
+from notes.note import queries
+from notes.settings import TestConfig
+
+USER_ID = '1'
+NOTE_ID = 1
+
+
+def built_user_by_id():
+    return db.session.execute(
+        select(User.id, User.email, User.first_name,
+               User.last_name).where(User.id == USER_ID)).one_or_none()
+
+
+def built_owned_note():
+    return Notes.query.filter(Notes.owner_id == USER_ID,
+                              Notes.note_id == NOTE_ID).first()
+
+
+def built_note_version():
+    return db.session.execute(
+        select(Notes.version).where(Notes.owner_id == USER_ID,
+                                    Notes.note_id == NOTE_ID)).scalar()
+
+
+def built_listing_version():
+    owned = select(
+        func.count(Notes.note_id),
+        func.coalesce(func.sum(Notes.version), 0),
+        func.coalesce(func.sum(Notes.note_id), 0),
+        func.coalesce(func.max(Notes.note_id), 0),
+    ).where(Notes.owner_id == USER_ID).subquery()
+    shared = select(
+        func.count(Notes.note_id),
+        func.coalesce(func.sum(Notes.version), 0),
+        func.coalesce(func.sum(Notes.note_id), 0),
+        func.coalesce(func.max(NoteShare.id), 0),
+    ).join(NoteShare, NoteShare.note_id == Notes.note_id).where(
+        NoteShare.user_id == USER_ID).subquery()
+
+    return tuple(db.session.execute(
+        select(owned, shared).select_from(owned.join(shared, true()))).one())
+
+
+def built_owned_notes():
+    return Notes.query.filter(Notes.owner_id == USER_ID).order_by(
+        Notes.note_id).limit(100).all()
+
+
+BENCHMARKS = [
+    ('user_by_id', built_user_by_id,
+     lambda: auth_queries.user_by_id(USER_ID)),
+    ('owned_note', built_owned_note,
+     lambda: queries.owned_note(USER_ID, NOTE_ID)),
+    ('note_version', built_note_version,
+     lambda: queries.note_version(USER_ID, NOTE_ID)),
+    ('listing_version', built_listing_version,
+     lambda: queries.listing_version(USER_ID)),
+    ('owned_notes', built_owned_notes,
+     lambda: queries.owned_notes(USER_ID, limit=100)),
+]
+
+
+def populate():
+    db.create_all()
+    db.session.add(User(id=USER_ID, email='bench@example.com',
+                        password=base64.b64encode(b'bench').decode('ascii')))
+    db.session.add(User(id='2', email='bench2@example.com'))
+    db.session.flush()
+    db.session.add_all([
+        Notes(note_id=note_id, owner_id=USER_ID if note_id % 2 else '2',
+              note_description=f'benchmark note {note_id}')
+        for note_id in range(1, 21)
+    ])
+    db.session.flush()
+    db.session.add_all([NoteShare(note_id=note_id, user_id=USER_ID)
+                        for note_id in range(2, 21, 2)])
+    db.session.commit()
+
+
+def measure(function, iterations) -> float:
+    """Return the mean duration of a call in microseconds."""
+    function()  # Warm up the caches.
+    seconds = min(timeit.repeat(function, number=iterations, repeat=3))
+
+    return seconds / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app(TestConfig())
+    with app.app_context():
+        populate()
+
+        print(f'{"query":<16}{"built (us)":>12}{"cached (us)":>13}'
+              f'{"saved":>8}')
+        total_built = total_cached = 0.0
+        for name, built, cached in BENCHMARKS:
+            built_us = measure(built, args.iterations)
+            cached_us = measure(cached, args.iterations)
+            total_built += built_us
+            total_cached += cached_us
+            print(f'{name:<16}{built_us:>12.1f}{cached_us:>13.1f}'
+                  f'{1 - cached_us / built_us:>8.0%}')
+        print(f'{"total":<16}{total_built:>12.1f}{total_cached:>13.1f}'
+              f'{1 - total_cached / total_built:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
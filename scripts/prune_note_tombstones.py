@@ -0,0 +1,31 @@
+"""Delete the tombstones older than the retention of delta sync.
+
+Tombstones tell syncing clients which notes they lost. Past
+``NOTES_SYNC_RETENTION`` seconds, clients get a full sync instead and the
+tombstones are no longer read: run it periodically, e.g. from cron, to
+keep the table from growing with every deletion.
+
+usage: python3 scripts/prune_note_tombstones.py [--batch-size N]
+"""
+import argparse
+import datetime
+
+from notes.autoapp import app
+from notes.note import queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        before = queries.current_timestamp() - datetime.timedelta(
+            seconds=app.config['NOTES_SYNC_RETENTION'])
+        total = queries.prune_tombstones(before, args.batch_size)
+
+    print(f'Deleted {total} tombstones recorded before {before}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,15 @@
 
 import pytest
 import base64
+from sqlalchemy import event
 from notes.app import create_app
+from notes.domain.base import BaseModel
 from notes.domain.models import NoteShare
 from notes.domain.models import Notes
 from notes.domain.models import User
 from notes.extensions import db as _db
+from notes.extensions import token_cache
+from notes.extensions import user_lookup_cache
 from notes.settings import TestConfig
 
 @pytest.fixture(scope='session')
@@ -35,39 +39,27 @@ def init_database(app):
     _db.app = app
     _db.create_all()
 
-    # Insert user data
-    user = User(id=1,
-                email='admin@gmail.com',
-                password=base64.b64encode("test".encode('ascii')).decode('ascii'),
-                first_name="jean",
-                last_name="guy")
-    user_2 = User(id=2,
-                  email='admin2@gmail.com',
-                  password=base64.b64encode("test".encode('ascii')).decode('ascii'),
-                  first_name="john",
-                  last_name="smith")
-
-    _db.session.add(user)
-    _db.session.add(user_2)
-    _db.session.commit()
-
-    # Insert note data
-    note = Notes(note_id=1,
-                 owner_id=1,
-                 note_description="a very cool note")
-    note2 = Notes(note_id=2,
-                owner_id=2,
-                note_description="an awesome text for note")
-    _db.session.add(note)
-    _db.session.add(note2)
-    _db.session.commit()
-
-    share_note = NoteShare(id=1,
-                           note_id=2,
-                           user_id=1)
-    _db.session.add(share_note)
-    _db.session.commit()
-
+    # Insert user and note data in one flush
+    with BaseModel.unit_of_work():
+        User(id=1,
+             email='admin@gmail.com',
+             password=base64.b64encode("test".encode('ascii')).decode('ascii'),
+             first_name="jean",
+             last_name="guy").add()
+        User(id=2,
+             email='admin2@gmail.com',
+             password=base64.b64encode("test".encode('ascii')).decode('ascii'),
+             first_name="john",
+             last_name="smith").add()
+        Notes(note_id=1,
+              owner_id=1,
+              note_description="a very cool note").add()
+        Notes(note_id=2,
+              owner_id=2,
+              note_description="an awesome text for note").add()
+        NoteShare(id=1,
+                  note_id=2,
+                  user_id=1).add()
 
     yield _db  # this is where the testing happens!
     
@@ -78,3 +70,21 @@ def init_database(app):
 def session(init_database):
     connection = init_database.engine.connect()
     connection.close()
+    # Every test authenticates its first request from the database.
+    token_cache.clear()
+    user_lookup_cache.clear()
+
+
+@pytest.fixture(scope='function')
+def query_counter(init_database):
+    """Collect the SQL statements sent to the database during a test."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append(statement)
+
+    engine = init_database.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+
+from notes.app import create_app
+from notes.asgi import AsyncApp
+from notes.extensions import db
+from notes.extensions import note_cache
+from notes.extensions import note_index
+from notes.extensions import pool_metrics
+from notes.extensions import replicas
+from notes.settings import TestConfig
+
+pytest.importorskip('greenlet')
+pytest.importorskip('aiosqlite')
+
+from sqlalchemy.util import greenlet_spawn  # noqa: E402
+
+
+async def call(asgi_app, method, path, body=None, headers=None):
+    """Send a request to ``asgi_app`` and return its status and body."""
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'',
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in (headers or {}).items()],
+    }
+    messages = [{
+        'type': 'http.request',
+        'body': json.dumps(body).encode('utf-8') if body is not None else b'',
+    }]
+    if body is not None:
+        scope['headers'].append((b'content-type', b'application/json'))
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+
+    return sent[0]['status'], b''.join(
+        message.get('body', b'') for message in sent[1:])
+
+
+def create_tables(flask_app):
+    with flask_app.app_context():
+        db.create_all()
+
+
+async def serve(asgi_app):
+    await greenlet_spawn(create_tables, asgi_app.app)
+
+    events = asyncio.Queue()
+    lifespan_messages = []
+
+    async def send(message):
+        lifespan_messages.append(message['type'])
+
+    lifespan = asyncio.ensure_future(
+        asgi_app({'type': 'lifespan'}, events.get, send))
+    await events.put({'type': 'lifespan.startup'})
+    while not lifespan_messages:
+        await asyncio.sleep(0)
+
+    status, body = await call(asgi_app, 'POST', '/auth/sign_up',
+                              {'email': 'async@test.com',
+                               'password': 'asyncasync'})
+    assert status == 200
+    token = json.loads(body)['auth_token']
+    headers = {'Authorization': token}
+
+    status, body = await call(asgi_app, 'POST', '/note/create_note',
+                              {'note_description': 'an async note'}, headers)
+    assert status == 200
+    note_id = json.loads(body)['note_id']
+
+    # The requests wait on the database together, on one thread.
+    responses = await asyncio.gather(*[
+        call(asgi_app, 'GET', f'/note/get_note/{note_id}', headers=headers)
+        for _ in range(3)
+    ])
+    for status, body in responses:
+        assert status == 200
+        assert json.loads(body)['note_description'] == 'an async note'
+
+    status, _ = await call(asgi_app, 'GET', '/note/get_note/1000',
+                           headers=headers)
+    assert status == 404
+
+    # Foreign keys are enforced on the aiosqlite connections too.
+    status, _ = await call(asgi_app, 'POST',
+                           f'/note/share_note/{note_id}/share/nobody',
+                           headers=headers)
+    assert status == 400
+
+    await events.put({'type': 'lifespan.shutdown'})
+    await lifespan
+    assert lifespan_messages == ['lifespan.startup.complete',
+                                 'lifespan.shutdown.complete']
+
+
+def test_async_app(app):
+    config = TestConfig()
+    config.NOTES_ASYNC = True
+    engine_metrics = dict(pool_metrics._engines)
+
+    try:
+        asgi_app = AsyncApp(create_app(config))
+        assert asgi_app.app.config['SQLALCHEMY_DATABASE_URI'] == \
+            'sqlite+aiosqlite:///'
+        asyncio.run(serve(asgi_app))
+    finally:
+        # The extensions are shared with the app of the other tests.
+        for extension in (replicas, note_cache, note_index):
+            extension.init_app(app)
+        pool_metrics._engines = engine_metrics
@@ -0,0 +1,33 @@
+from notes.domain.base import BaseModel
+from notes.domain.models import User
+from notes.extensions import db
+
+
+def test_unit_of_work(query_counter):
+    users = [User(id=f'uow-{i}', email=f'uow-{i}@gmail.com')
+             for i in range(3)]
+
+    del query_counter[:]
+    with BaseModel.unit_of_work(commit=False):
+        for user in users:
+            user.add()
+        assert query_counter == []
+    # The three rows are sent as one executemany INSERT.
+    assert len(query_counter) == 1
+
+    del query_counter[:]
+    with BaseModel.unit_of_work(commit=False):
+        for user in users:
+            user.update(first_name='unit')
+    assert len(query_counter) == 1
+    assert query_counter[0].startswith('UPDATE note_user')
+
+    del query_counter[:]
+    with BaseModel.unit_of_work(commit=False):
+        for user in users:
+            user.delete()
+    assert len(query_counter) == 1
+    assert query_counter[0].startswith('DELETE FROM note_user')
+
+    db.session.rollback()
+    assert db.session.get(User, 'uow-0') is None
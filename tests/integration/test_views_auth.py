@@ -1,17 +1,38 @@
 import json
 import logging
 
-def test_login(test_client):
+from sqlalchemy import update
+
+from notes.app import register_proxies
+from notes.domain.models import User
+from notes.extensions import db
+from notes.extensions import limiter
+from notes.extensions import passwords
+from notes.limiter import MemoryStore
+
+STATS_HEADERS = {'X-Stats-Key': 'stats-key'}
+
+
+def test_login(test_client, query_counter):
     # Create user for login purposes
     test_user = {'email': 'admin@gmail.com', 'password': 'test'}
 
-    # Login
+    # Login, hashing the password stored base64 encoded
+    del query_counter[:]
     response = test_client.post('/auth/login', json=test_user)
     logging.info(response)
     assert response.status_code == 200
+    assert len(query_counter) == 2
     json_data = json.loads(response.data)
     assert 'auth_token' in json_data
     assert 'user' in json_data
+    assert db.session.get(User, '1').password.startswith('$pbkdf2-sha512$')
+
+    # Login again, against the hash
+    del query_counter[:]
+    response = test_client.post('/auth/login', json=test_user)
+    assert response.status_code == 200
+    assert len(query_counter) == 1
 
     # Login with account that does not exist
     test_invalid_credentials = {
@@ -30,22 +51,182 @@ def test_login(test_client):
     assert response.status_code == 401
 
 
-def test_sign_up(test_client):
+def test_sign_up(test_client, query_counter):
     # Create test model.
     test_credentials = {
         'email': 'daniel-test@test.com',
         'password': 'testtest'
     }
 
+    del query_counter[:]
     response = test_client.post('/auth/sign_up',
                                 json=test_credentials)
     assert response.status_code == 200
+    assert len(query_counter) == 1
     json_data = json.loads(response.data)
     logging.info(json_data)
     assert 'email' in json_data['user']
+    stored = db.session.get(User, json_data['user']['id']).password
+    assert passwords.verify('testtest', stored)
+    assert not passwords.needs_rehash(stored)
 
     # Create another account with same email
+    del query_counter[:]
     response = test_client.post('/auth/sign_up',
                                 json=test_credentials)
     assert response.status_code == 409
+    # The unique email rejects the INSERT, no lookup is needed.
+    assert len(query_counter) == 1
+
+
+
+def test_token_cache(test_client, query_counter):
+    user = db.session.get(User, '1')
+    token = user.encode_auth_token(user.id)
+
+    def get_changes():
+        del query_counter[:]
+        response = test_client.get('/note/changes',
+                                   headers={'Authorization': token})
+        assert response.status_code == 200
+
+        return [statement for statement in query_counter
+                if 'note_user' in statement]
+
+    assert len(get_changes()) == 1
+    # Authenticated from the cache, without any query.
+    assert get_changes() == []
+
+    # Changing the user drops their tokens.
+    user.first_name = 'jeanne'
+    db.session.commit()
+    assert len(get_changes()) == 1
+
+    # Bulk changes do not tell the users changed: every token is dropped.
+    db.session.execute(update(User).where(User.id == '1').values(
+        first_name='jean'))
+    db.session.commit()
+    assert len(get_changes()) == 1
+
+    stats = test_client.get('/stats/tokens', headers=STATS_HEADERS).json
+    assert stats['hits'] >= 1
+    assert stats['invalidations'] >= 1
+
+
+def test_lookup_users(test_client, app, query_counter):
+    user = db.session.get(User, '1')
+    headers = {'Authorization': user.encode_auth_token(user.id)}
+    emails = ['admin2@gmail.com', 'nobody@gmail.com', 'admin@gmail.com',
+              'admin2@gmail.com']
+
+    def lookup(emails):
+        del query_counter[:]
+        response = test_client.post('/auth/users/lookup', headers=headers,
+                                    json={'emails': emails})
+        assert response.status_code == 200
+
+        return response.json
+
+    # Token, then every email in one query
+    assert lookup(emails) == {
+        'users': [
+            {'id': '2', 'email': 'admin2@gmail.com', 'first_name': 'john',
+             'last_name': 'smith'},
+            {'id': '1', 'email': 'admin@gmail.com', 'first_name': 'jean',
+             'last_name': 'guy'},
+        ],
+        'missing': ['nobody@gmail.com']
+    }
+    assert len(query_counter) == 2
+    assert ' IN ' in query_counter[1]
+
+    # Users found are cached, emails of no user are not.
+    assert lookup(emails)['missing'] == ['nobody@gmail.com']
+    assert len(query_counter) == 1
+    assert lookup(['admin@gmail.com', 'admin2@gmail.com'])['users'][0][
+        'first_name'] == 'jean'
+    assert len(query_counter) == 0
+
+    # Changing a user drops it.
+    user.first_name = 'jeanne'
+    db.session.commit()
+    assert lookup(['admin@gmail.com'])['users'][0]['first_name'] == 'jeanne'
+    user.first_name = 'jean'
+    db.session.commit()
+
+    response = test_client.post('/auth/users/lookup', headers=headers,
+                                json={'emails': 'admin@gmail.com'})
+    assert response.status_code == 400
+    response = test_client.post(
+        '/auth/users/lookup', headers=headers, json={
+            'emails': [f'{number}@gmail.com' for number in range(
+                app.config['NOTES_USER_LOOKUP_LIMIT'] + 1)]})
+    assert response.status_code == 413
+    response = test_client.post('/auth/users/lookup',
+                                json={'emails': emails})
+    assert response.status_code == 401
+
+    stats = test_client.get('/stats/user_lookups', headers=STATS_HEADERS).json
+    assert stats['hits'] >= 3
+    assert stats['invalidations'] >= 1
+
+
+def test_rate_limit(app, test_client):
+    users = User.query.order_by(User.id).all()
+    token, other_token = (user.encode_auth_token(user.id) for user in users[:2])
+    limiter.enabled = True
+    limiter.store = MemoryStore()
+
+    try:
+        for _ in range(120):
+            response = test_client.get('/note/changes',
+                                       headers={'Authorization': token})
+            assert response.status_code == 200
+
+        response = test_client.get('/note/changes',
+                                   headers={'Authorization': token})
+        assert response.status_code == 429
+        assert response.json['key'] == 'too_many_requests'
+        # A token comes back every 60 / 120 seconds.
+        assert int(response.headers['Retry-After']) == 1
+
+        # The budget is per user and per endpoint.
+        response = test_client.get('/note/changes',
+                                   headers={'Authorization': other_token})
+        assert response.status_code == 200
+
+        # Requests without a token are limited by IP address.
+        for _ in range(10):
+            test_client.post('/auth/login', json={})
+        response = test_client.post('/auth/login', json={})
+        assert response.status_code == 429
+        response = test_client.post('/auth/login', json={},
+                                    environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        assert response.status_code != 429
+
+        # Behind a proxy, by the address the proxy forwards.
+        wsgi_app = app.wsgi_app
+        app.config['NOTES_TRUSTED_PROXIES'] = 1
+        register_proxies(app)
+        try:
+            proxy = {'REMOTE_ADDR': '10.0.0.3'}
+            for _ in range(10):
+                test_client.post('/auth/login', json={}, environ_base=proxy,
+                                 headers={'X-Forwarded-For': '192.0.2.1'})
+            response = test_client.post(
+                '/auth/login', json={}, environ_base=proxy,
+                headers={'X-Forwarded-For': '192.0.2.1'})
+            assert response.status_code == 429
+            response = test_client.post(
+                '/auth/login', json={}, environ_base=proxy,
+                headers={'X-Forwarded-For': '192.0.2.2'})
+            assert response.status_code != 429
+        finally:
+            app.wsgi_app = wsgi_app
+            app.config['NOTES_TRUSTED_PROXIES'] = 0
 
+        stats = test_client.get('/stats/rate_limits',
+                                headers=STATS_HEADERS).json
+        assert stats['denials'] == {'note.get_changes': 1, 'auth.login': 2}
+    finally:
+        limiter.enabled = False
@@ -1,14 +1,44 @@
+import datetime
+import time
+
+from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import update
+from sqlalchemy.pool import StaticPool
+
+from notes import replicas as replica_routing
+from notes.domain.base import BaseModel
+from notes.domain.models import NoteShare
+from notes.domain.models import NoteTombstone
+from notes.domain.models import Notes
 from notes.domain.models import User
+from notes.extensions import db
+from notes.extensions import note_cache
+from notes.extensions import note_index
+from notes.extensions import replicas
+from notes.extensions import token_cache
+from notes.note import controller
+from notes.note import queries
+from notes.note.utils import encode_sync_cursor
+
+STATS_HEADERS = {'X-Stats-Key': 'stats-key'}
+
 
-def test_create_note(test_client):
+def test_create_note(test_client, query_counter):
     users = User.query.all()
     token = users[0].encode_auth_token(users[0].id)
     body = {'note_description': 'my third incredible note'}
+    del query_counter[:]
     response = test_client.post('/note/create_note',
                                 json=body,
                                 headers={'Authorization': token})
     assert response.status_code == 200
+    # The user of the token, then the INSERT.
+    assert len(query_counter) == 2
     assert response.json['note_description'] == body['note_description']
+    note = db.session.get(Notes, response.json['note_id'])
+    assert note.language == 'en'
 
 def test_update_note(test_client):
     users = User.query.all()
@@ -30,14 +60,18 @@ def test_update_note(test_client):
     assert response.status_code == 404
 
 
-def test_get_note(test_client):
+def test_get_note(test_client, query_counter):
     users = User.query.all()
     token = users[0].encode_auth_token(users[0].id)
     note_id = 1
     body = {'note_description': 'my cool updated note'}
+    note_cache.clear()
+    del query_counter[:]
     response = test_client.get(f'/note/get_note/{note_id}',
                                headers={'Authorization': token})
     assert response.status_code == 200
+    # The user of the token, the version of the note and the note.
+    assert len(query_counter) == 3
     assert response.json['note_description'] == body['note_description']
 
     note_id = 20
@@ -56,12 +90,258 @@ def test_get_notes(test_client):
     assert len(response.json['my_notes']) == 2
 
 
-def test_delete_note(test_client):
+def test_get_notes_query_count(test_client, query_counter):
+    users = User.query.all()
+    user_id, owner_id = users[0].id, users[1].id
+    token = users[0].encode_auth_token(user_id)
+
+    note_cache.clear()
+    test_client.get('/note/get_notes', headers={'Authorization': token})
+    # The token is resolved from the token cache from now on.
+    note_cache.clear()
+    del query_counter[:]
+    test_client.get('/note/get_notes', headers={'Authorization': token})
+    baseline = len(query_counter)
+
+    # Share more notes with the user, the query count must not change.
+    with BaseModel.unit_of_work():
+        for note_id in range(100, 105):
+            Notes(note_id=note_id,
+                  owner_id=owner_id,
+                  note_description=f'shared note {note_id}').add()
+            NoteShare(note_id=note_id, user_id=user_id).add()
+
+    # The notes were added behind the controller's back.
+    note_cache.clear()
+    del query_counter[:]
+    response = test_client.get('/note/get_notes',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    assert len(response.json['shared_with_me']) == 6
+    assert len(query_counter) == baseline
+
+
+def test_get_notes_paginated(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+
+    shared = []
+    cursor = ''
+    while cursor is not None:
+        response = test_client.get(f'/note/get_notes?limit=4&cursor={cursor}',
+                                   headers={'Authorization': token})
+        assert response.status_code == 200
+        assert len(response.json['shared_with_me']) <= 4
+        shared.extend(note['note_id']
+                      for note in response.json['shared_with_me'])
+        cursor = response.json['next_cursor']
+
+    assert shared == [2, 100, 101, 102, 103, 104]
+
+
+def test_get_notes_stream(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+
+    response = test_client.get('/note/get_notes?stream=true',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert [note['note_id'] for note in response.json['my_notes']] == [1, 3]
+    assert [note['note_id'] for note in response.json['shared_with_me']] == \
+        [2, 100, 101, 102, 103, 104]
+
+
+def test_get_notes_cache(test_client, query_counter):
+    users = User.query.all()
+    reader, owner = users[0], users[1]
+    token = reader.encode_auth_token(reader.id)
+
+    note_cache.clear()
+    del query_counter[:]
+    test_client.get('/note/get_notes', headers={'Authorization': token})
+    # Minus the user of the token, cached from now on.
+    uncached = len(query_counter) - 1
+
+    del query_counter[:]
+    response = test_client.get('/note/get_notes',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    assert len(query_counter) < uncached
+
+    # Updating a shared note invalidates the listing of its readers.
+    response = test_client.patch(
+        '/note/update_note/100',
+        json={'note_description': 'shared note 100'},
+        headers={'Authorization': owner.encode_auth_token(owner.id)})
+    assert response.status_code == 200
+
+    del query_counter[:]
+    test_client.get('/note/get_notes', headers={'Authorization': token})
+    assert len(query_counter) == uncached
+
+    response = test_client.get('/stats/cache', headers=STATS_HEADERS)
+    assert response.status_code == 200
+    assert response.json['hits'] >= 1
+    assert response.json['invalidations'] >= 1
+
+
+def test_get_notes_etag(test_client):
     users = User.query.all()
     token = users[0].encode_auth_token(users[0].id)
-    note_id = 3
-    test_client.get(f'/note/delete_note/{note_id}',
+
+    response = test_client.get('/note/get_notes',
                                headers={'Authorization': token})
+    etag = response.headers['ETag']
+
+    response = test_client.get('/note/get_notes',
+                               headers={'Authorization': token,
+                                        'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = test_client.get('/note/get_note/1',
+                               headers={'Authorization': token})
+    note_etag = response.headers['ETag']
+    response = test_client.get('/note/get_note/1',
+                               headers={'Authorization': token,
+                                        'If-None-Match': note_etag})
+    assert response.status_code == 304
+
+    # Any change to a listed note changes both tags.
+    for description in ('my cool edited note', 'my cool updated note'):
+        response = test_client.patch('/note/update_note/1',
+                                     json={'note_description': description},
+                                     headers={'Authorization': token})
+        assert response.status_code == 200
+
+    response = test_client.get('/note/get_notes',
+                               headers={'Authorization': token,
+                                        'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    response = test_client.get('/note/get_note/1',
+                               headers={'Authorization': token,
+                                        'If-None-Match': note_etag})
+    assert response.status_code == 200
+
+
+def test_get_notes_etag_reused_id(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    headers = {'Authorization': token}
+    response = test_client.post('/note/create_note', headers=headers,
+                                json={'note_description': 'first'})
+    note_id = response.json['note_id']
+    etag = test_client.get('/note/get_notes',
+                           headers=headers).headers['ETag']
+
+    # A database without AUTOINCREMENT gives the id of the newest note to
+    # the next one: count, versions and ids are the same as before.
+    response = test_client.delete(f'/note/delete_note/{note_id}',
+                                  headers=headers)
+    assert response.status_code == 204
+    db.session.add(Notes(note_id=note_id, owner_id=users[0].id,
+                         note_description='second'))
+    db.session.commit()
+
+    response = test_client.get('/note/get_notes',
+                               headers={'If-None-Match': etag, **headers})
+    assert response.status_code == 200
+    assert 'second' in [note['note_description']
+                        for note in response.json['my_notes']]
+    test_client.delete(f'/note/delete_note/{note_id}', headers=headers)
+
+def test_get_note_changed_elsewhere(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    headers = {'Authorization': token}
+
+    for _ in range(2):
+        response = test_client.get('/note/get_note/1', headers=headers)
+        listing = test_client.get('/note/get_notes', headers=headers)
+    etag = response.headers['ETag']
+    description = response.json['note_description']
+
+    # E.g. by another worker: the cache of this one is not invalidated.
+    db.session.execute(update(Notes).where(Notes.note_id == 1).values(
+        note_description='changed elsewhere', version=Notes.version + 1),
+        execution_options={'synchronize_session': False})
+    db.session.commit()
+
+    try:
+        response = test_client.get('/note/get_note/1', headers=headers)
+        assert response.headers['ETag'] != etag
+        assert response.json['note_description'] == 'changed elsewhere'
+        response = test_client.get('/note/get_notes', headers=headers)
+        assert response.headers['ETag'] != listing.headers['ETag']
+        assert 'changed elsewhere' in [
+            note['note_description'] for note in response.json['my_notes']]
+    finally:
+        db.session.execute(update(Notes).where(Notes.note_id == 1).values(
+            note_description=description, version=Notes.version + 1),
+            execution_options={'synchronize_session': False})
+        db.session.commit()
+
+
+def test_update_note_if_match(test_client, query_counter):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+
+    response = test_client.get('/note/get_note/1',
+                               headers={'Authorization': token})
+    etag = response.headers['ETag'].strip('"')
+
+    del query_counter[:]
+    response = test_client.patch('/note/update_note/1',
+                                 json={'note_description': 'my cool occ note'},
+                                 headers={'Authorization': token,
+                                          'If-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    new_etag = response.headers['ETag'].strip('"')
+    assert new_etag != etag
+    # The token's user is cached: a single UPDATE ... RETURNING.
+    assert len(query_counter) == 1
+    assert query_counter[0].startswith('UPDATE notes')
+
+    # A concurrent editor still holding the old version is refused.
+    response = test_client.patch('/note/update_note/1',
+                                 json={'note_description': 'lost update'},
+                                 headers={'Authorization': token,
+                                          'If-Match': f'"{etag}"'})
+    assert response.status_code == 412
+
+    response = test_client.patch('/note/update_note/1',
+                                 json={'note_description':
+                                       'my cool updated note'},
+                                 headers={'Authorization': token,
+                                          'If-Match': f'"{new_etag}"'})
+    assert response.status_code == 200
+    assert response.json['note_description'] == 'my cool updated note'
+
+
+def test_delete_note(test_client, query_counter):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    note = Notes(owner_id=users[0].id, note_description='a note to delete')
+    db.session.add(note)
+    db.session.commit()
+    note_id = note.note_id
+
+    del query_counter[:]
+    response = test_client.delete(f'/note/delete_note/{note_id}',
+                                  headers={'Authorization': token})
+    assert response.status_code == 204
+    # The user of the token, the tombstones, then the DELETE.
+    assert len(query_counter) == 3
+    assert query_counter[-1].startswith('DELETE FROM notes')
+
+    # The note is gone, and notes of other users are not found either.
+    for note_id in (note_id, 2):
+        response = test_client.delete(f'/note/delete_note/{note_id}',
+                                      headers={'Authorization': token})
+        assert response.status_code == 404
+    assert db.session.get(Notes, 2) is not None
 
 
 def test_search_notes(test_client):
@@ -72,17 +352,192 @@ def test_search_notes(test_client):
                                headers={'Authorization': token})
     assert response.status_code == 200
     assert len(response.json['my_notes']) == 1
+    assert response.json['my_notes'][0]['snippet'] == \
+        'my <mark>cool</mark> updated note'
 
+    # Phrase and prefix matching
+    query = '"cool upd*"'
+    response = test_client.get(f'note/search_notes?query={query}',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    assert [note['note_id'] for note in response.json['my_notes']] == [1]
 
-def test_share_note(test_client):
+    query = 'shared'
+    response = test_client.get(f'note/search_notes?query={query}',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    assert len(response.json['my_notes']) == 0
+    assert len(response.json['shared_with_me']) == 5
+
+    # Paginated search
+    found = []
+    cursor = ''
+    while cursor is not None:
+        response = test_client.get(
+            f'note/search_notes?query={query}&limit=2&cursor={cursor}',
+            headers={'Authorization': token})
+        assert response.status_code == 200
+        found.extend(note['note_id']
+                     for note in response.json['shared_with_me'])
+        cursor = response.json['next_cursor']
+
+    assert sorted(found) == [100, 101, 102, 103, 104]
+
+    # Streamed search
+    response = test_client.get(f'note/search_notes?query={query}&stream=1',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    assert len(response.json['shared_with_me']) == 5
+    assert response.json['shared_with_me'][0]['snippet'].startswith(
+        '<mark>shared</mark>')
+
+
+def test_search_notes_substring(test_client, query_counter):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+
+    def search(query, status_code=200, **params):
+        params.setdefault('mode', 'substring')
+        params['query'] = query
+        response = test_client.get('/note/search_notes', query_string=params,
+                                   headers={'Authorization': token})
+        assert response.status_code == status_code
+        return response.json
+
+    # Filtered in the database: the token user, then each list.
+    del query_counter[:]
+    result = search('ool UPD')
+    assert [note['note_id'] for note in result['my_notes']] == [1]
+    assert len(query_counter) == 3
+    assert search('100%')['my_notes'] == []
+
+    result = search('hared note 10', limit=3)
+    assert [note['note_id'] for note in result['shared_with_me']] \
+        == [100, 101, 102]
+    result = search('hared note 10', cursor=result['next_cursor'])
+    assert result['shared_with_me'][0]['note_id'] == 103
+
+    # Fuzzy search needs the trigram index, never built by a request.
+    search('cool updatde', 400, mode='fuzzy', distance=2)
+    try:
+        note_index.enabled = True
+        note_index.building = True
+        search('cool updatde', 503, mode='fuzzy', distance=2)
+        note_index.building = False
+
+        controller.build_note_index()
+        result = search('cool updatde', mode='fuzzy', distance=2)
+        assert result['my_notes'][0]['note_id'] == 1
+        assert result['my_notes'][0]['distance'] == 1
+
+        assert test_client.get('/stats/trigram',
+                               headers=STATS_HEADERS).json['built']
+        search('cool', 400, mode='fuzzy', distance=9)
+    finally:
+        note_index.init_app(current_app)
+
+
+def test_search_notes_fuzzy_scan(app, test_client):
+    """Fuzzy search pages through the notes NOTES_FUZZY_SCAN_LIMIT ids at a
+    time, whatever the number of results."""
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    scan_limit = app.config['NOTES_FUZZY_SCAN_LIMIT']
+
+    try:
+        app.config['NOTES_FUZZY_SCAN_LIMIT'] = 2
+        note_index.enabled = True
+        controller.build_note_index()
+
+        found = []
+        cursor = None
+        for _ in range(100):
+            response = test_client.get(
+                '/note/search_notes',
+                query_string={'mode': 'fuzzy', 'query': 'shared note 10',
+                              'cursor': cursor or ''},
+                headers={'Authorization': token})
+            assert response.status_code == 200
+            assert len(response.json['shared_with_me']) <= 2
+            found += [note['note_id']
+                      for note in response.json['shared_with_me']]
+            cursor = response.json['next_cursor']
+            if cursor is None:
+                break
+
+        assert found == sorted(set(found))
+        assert {100, 101, 102, 103, 104} <= set(found)
+    finally:
+        app.config['NOTES_FUZZY_SCAN_LIMIT'] = scan_limit
+        note_index.init_app(app)
+
+
+def test_search_notes_fuzzy_written_elsewhere(app, test_client,
+                                              query_counter):
+    """The trigram index finds the notes written by other processes,
+    reading them from the primary even when searches use a replica."""
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    replica = create_engine(
+        'sqlite://', poolclass=StaticPool,
+        creator=lambda: db.engine.raw_connection().driver_connection)
+    replica_statements = []
+    event.listen(replica, 'before_cursor_execute',
+                 lambda *args: replica_statements.append(args[2]))
+
+    def search(query):
+        response = test_client.get('/note/search_notes',
+                                   query_string={'mode': 'fuzzy',
+                                                 'distance': 0,
+                                                 'query': query},
+                                   headers={'Authorization': token})
+        assert response.status_code == 200
+        return [note['note_id'] for note in response.json['my_notes']]
+
+    try:
+        note_index.enabled = True
+        controller.build_note_index()
+        assert search('zebra crossing') == []
+
+        # Written by another worker: nothing reports it to this index.
+        note = Notes(owner_id=users[0].id,
+                     note_description='a zebra crossing')
+        db.session.add(note)
+        db.session.commit()
+
+        db.engines['replica_0'] = replica
+        replicas.bind_keys = ['replica_0']
+        del query_counter[:]
+        assert search('zebra crossing') == [note.note_id]
+        # The clock, the notes written and deleted on the primary.
+        assert len(query_counter) == 3
+        assert replica_statements
+
+        replicas.init_app(app)
+        deleted = note_index.stats()['deleted']
+        response = test_client.delete(f'/note/delete_note/{note.note_id}',
+                                      headers={'Authorization': token})
+        assert response.status_code == 204
+        assert search('zebra crossing') == []
+        assert note_index.stats()['deleted'] == deleted + 1
+    finally:
+        replicas.init_app(app)
+        db.engines.pop('replica_0', None)
+        note_index.init_app(app)
+
+
+def test_share_note(test_client, query_counter):
     users = User.query.all()
     token = users[0].encode_auth_token(users[0].id)
     note_id = 1
     share_id = 2
     body = {'note_description': 'my cool updated note'}
+    del query_counter[:]
     response = test_client.post(f'note/share_note/{note_id}/share/{share_id}',
                                headers={'Authorization': token})
     assert response.status_code == 200
+    # The user of the token, the note, then the INSERT.
+    assert len(query_counter) == 3
     assert response.json['note_description'] == body['note_description']
 
     # Share non existen note
@@ -100,3 +555,347 @@ def test_share_note(test_client):
     response = test_client.post(f'note/share_note/{note_id}/share/{share_id}',
                                headers={'Authorization': token})
     assert response.status_code == 400
+
+
+def test_bulk_create_notes(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    body = {
+        'notes': [
+            {'note_description': 'bulk note one'},
+            {'note_description': ''},
+            {'note_description': 'bulk note two'},
+            'not a note',
+        ]
+    }
+    response = test_client.post('/note/bulk_create',
+                                json=body,
+                                headers={'Authorization': token})
+    assert response.status_code == 200
+    assert [item['index'] for item in response.json['errors']] == [1, 3]
+
+    created = response.json['created']
+    assert len(created) == 2
+    assert created == sorted(created)
+    notes = [Notes.query.filter(Notes.note_id == note_id).first()
+             for note_id in created]
+    assert [note.note_description for note in notes] == \
+        ['bulk note one', 'bulk note two']
+    # Detected later, by the backfill
+    assert [note.language for note in notes] == [None, None]
+
+    response = test_client.post('/note/bulk_create',
+                                json={'notes': {}},
+                                headers={'Authorization': token})
+    assert response.status_code == 400
+
+
+def test_bulk_update_notes(test_client, query_counter):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    note_ids = [note.note_id for note in Notes.query.filter(
+        Notes.note_description.startswith('bulk note')).all()]
+
+    del query_counter[:]
+    body = {
+        'note_ids': note_ids + [2, 999],
+        'note_description': 'bulk note updated'
+    }
+    response = test_client.patch('/note/bulk_update',
+                                 json=body,
+                                 headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.json['updated'] == note_ids
+    assert response.json['not_found'] == [2, 999]
+    assert len([statement for statement in query_counter
+                if statement.startswith('UPDATE notes')]) == 1
+
+    response = test_client.patch('/note/bulk_update',
+                                 json={'note_ids': note_ids},
+                                 headers={'Authorization': token})
+    assert response.status_code == 400
+
+
+def test_bulk_delete_notes(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    note_ids = [note.note_id for note in Notes.query.filter(
+        Notes.note_description == 'bulk note updated').all()]
+
+    # Notes shared with the user are not theirs to delete.
+    body = {'filter': {'query': 'shared'}}
+    response = test_client.delete('/note/bulk_delete',
+                                  json=body,
+                                  headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.json == {'deleted': []}
+
+    body = {'filter': {'query': 'bulk'}}
+    response = test_client.delete('/note/bulk_delete',
+                                  json=body,
+                                  headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.json == {'deleted': note_ids}
+    assert Notes.query.filter(Notes.note_id.in_(note_ids)).count() == 0
+
+    response = test_client.delete('/note/bulk_delete',
+                                  json={},
+                                  headers={'Authorization': token})
+    assert response.status_code == 400
+
+
+def test_share_notes(test_client):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    new_user = User(id=3, email='admin3@gmail.com')
+    db.session.add(new_user)
+    db.session.commit()
+
+    body = {'note_ids': [1, 3, 2], 'user_ids': ['2', '3', '1', '42']}
+    response = test_client.post('/note/share_notes',
+                                json=body,
+                                headers={'Authorization': token})
+    assert response.status_code == 200
+    # Note 1 was already shared with user 2 by test_share_note.
+    assert response.json['already_shared'] == [
+        {'note_id': 1, 'user_id': '2'}
+    ]
+    assert response.json['shared'] == [
+        {'note_id': 1, 'user_id': '3'},
+        {'note_id': 3, 'user_id': '2'},
+        {'note_id': 3, 'user_id': '3'},
+    ]
+    assert response.json['invalid_users'] == ['1', '42']
+    assert response.json['missing_notes'] == [2]
+
+    # Sharing again does not create duplicates.
+    response = test_client.post('/note/share_notes',
+                                json=body,
+                                headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.json['shared'] == []
+    assert NoteShare.query.filter(NoteShare.note_id.in_([1, 3])).count() == 4
+
+
+def test_get_changes(app, test_client):
+    users = User.query.all()
+    user, owner = users[0], users[1]
+    token = user.encode_auth_token(user.id)
+    owner_token = owner.encode_auth_token(owner.id)
+    overlap = app.config['NOTES_SYNC_OVERLAP']
+    app.config['NOTES_SYNC_OVERLAP'] = 0
+
+    try:
+        response = test_client.get('/note/changes',
+                                   headers={'Authorization': token})
+        assert response.status_code == 200
+        assert {note['note_id'] for note in
+                response.json['shared_with_me']['shared']} >= {2, 100, 101}
+        assert response.json['full_sync']
+        cursor = response.json['next_cursor']
+        # SQLite timestamps have a millisecond resolution.
+        time.sleep(0.01)
+
+        created = test_client.post('/note/create_note',
+                                   json={'note_description': 'synced'},
+                                   headers={'Authorization': token})
+        removed = test_client.post('/note/create_note',
+                                   json={'note_description': 'short lived'},
+                                   headers={'Authorization': token})
+        test_client.delete(f"/note/delete_note/{removed.json['note_id']}",
+                           headers={'Authorization': token})
+        test_client.patch('/note/update_note/1',
+                          json={'note_description': 'my synced note'},
+                          headers={'Authorization': token})
+        response = test_client.delete('/note/share_note/100/share/1',
+                                      headers={'Authorization': owner_token})
+        assert response.status_code == 204
+        response = test_client.delete('/note/share_note/100/share/1',
+                                      headers={'Authorization': owner_token})
+        assert response.status_code == 404
+        test_client.delete('/note/delete_note/101',
+                           headers={'Authorization': owner_token})
+
+        response = test_client.get(f'/note/changes?since={cursor}',
+                                   headers={'Authorization': token})
+        assert response.status_code == 200
+        changes = response.json
+        assert not changes['full_sync']
+        assert [note['note_id'] for note in
+                changes['my_notes']['created']] == [created.json['note_id']]
+        assert [note['note_id'] for note in
+                changes['my_notes']['updated']] == [1]
+        assert changes['my_notes']['deleted'] == [removed.json['note_id']]
+        assert changes['shared_with_me']['shared'] == []
+        assert changes['shared_with_me']['updated'] == []
+        assert sorted(changes['shared_with_me']['unshared']) == [100, 101]
+
+        response = test_client.get('/note/changes?since=nope',
+                                   headers={'Authorization': token})
+        assert response.status_code == 400
+    finally:
+        app.config['NOTES_SYNC_OVERLAP'] = overlap
+
+
+def test_get_changes_past_retention(app, test_client):
+    user = db.session.get(User, '1')
+    token = user.encode_auth_token(user.id)
+    removed = test_client.post('/note/create_note',
+                               json={'note_description': 'short lived'},
+                               headers={'Authorization': token})
+    test_client.delete(f"/note/delete_note/{removed.json['note_id']}",
+                       headers={'Authorization': token})
+
+    # Its tombstones may be pruned: the client has to start over.
+    cursor = encode_sync_cursor(datetime.datetime(2000, 1, 1))
+    response = test_client.get(f'/note/changes?since={cursor}',
+                               headers={'Authorization': token})
+    assert response.status_code == 200
+    changes = response.json
+    assert changes['full_sync']
+    assert 1 in [note['note_id'] for note in changes['my_notes']['created']]
+    assert changes['my_notes']['deleted'] == []
+    assert changes['shared_with_me']['unshared'] == []
+
+    for note_id in (900, 901, 902):
+        db.session.add(NoteTombstone(
+            note_id=note_id, user_id=user.id,
+            reason=NoteTombstone.DELETED,
+            removed_at=datetime.datetime(2000, 1, 1)))
+    db.session.commit()
+    recent = NoteTombstone.query.count() - 3
+
+    before = queries.current_timestamp() - datetime.timedelta(
+        seconds=app.config['NOTES_SYNC_RETENTION'])
+    assert queries.prune_tombstones(before, batch_size=2) == 3
+    assert NoteTombstone.query.count() == recent
+
+
+def test_get_note_replica(app, test_client, query_counter):
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    # A second engine over the connection of the in-memory database
+    # stands in for a replica.
+    replica = create_engine(
+        'sqlite://', poolclass=StaticPool,
+        creator=lambda: db.engine.raw_connection().driver_connection)
+    replica_statements = []
+    event.listen(replica, 'before_cursor_execute',
+                 lambda *args: replica_statements.append(args[2]))
+    db.engines['replica_0'] = replica
+    replicas.bind_keys = ['replica_0']
+    # As on startup.
+    replicas.refresh_lags()
+
+    try:
+        note_cache.clear()
+        del query_counter[:]
+        response = test_client.get('/note/get_note/1',
+                                   headers={'Authorization': token})
+        assert response.status_code == 200
+        # The token user, the version and the note, all on the replica.
+        assert query_counter == []
+        assert len(replica_statements) == 3
+
+        # After a write, the user reads their own writes on the primary.
+        response = test_client.patch('/note/update_note/1',
+                                     json={'note_description': 'replicated'},
+                                     headers={'Authorization': token})
+        assert response.status_code == 200
+        assert replica_routing.STICKY_COOKIE in response.headers['Set-Cookie']
+        until = response.headers[replica_routing.STICKY_HEADER]
+
+        del query_counter[:]
+        del replica_statements[:]
+        response = test_client.get('/note/get_note/1',
+                                   headers={'Authorization': token})
+        assert response.json['note_description'] == 'replicated'
+        # The version and the note: the token user is cached.
+        assert len(query_counter) == 2
+        assert replica_statements == []
+
+        # A worker that did not serve the write, for a client without
+        # cookies sending the header back.
+        replicas._writers.clear()
+        note_cache.clear()
+        del replica_statements[:]
+        response = app.test_client().get(
+            '/note/get_note/1',
+            headers={'Authorization': token,
+                     replica_routing.STICKY_HEADER: until})
+        assert response.json['note_description'] == 'replicated'
+        assert replica_statements == []
+
+        stats = test_client.get('/stats/replicas', headers=STATS_HEADERS).json
+        assert stats['replicas']['replica_0']['reads'] == 1
+        assert stats['replicas']['replica_0']['lag'] == 0
+    finally:
+        replicas.init_app(app)
+        del db.engines['replica_0']
+
+
+def test_token_user_missing_on_replica(app, test_client):
+    """A user the replica has not received yet is read from the
+    primary."""
+    users = User.query.all()
+    token = users[0].encode_auth_token(users[0].id)
+    # An empty database stands in for a replica lagging behind.
+    replica = create_engine('sqlite://', poolclass=StaticPool)
+    db.metadata.create_all(replica)
+    db.engines['replica_0'] = replica
+    replicas.bind_keys = ['replica_0']
+    replicas.refresh_lags()
+
+    try:
+        token_cache.clear()
+        note_cache.clear()
+        # Without the cookie of the writes of the other tests.
+        response = app.test_client().get('/note/get_notes',
+                                         headers={'Authorization': token})
+        assert response.status_code == 200
+        # The notes are read from the replica.
+        assert response.json['my_notes'] == []
+    finally:
+        replicas.init_app(app)
+        del db.engines['replica_0']
+
+
+def test_pool_stats(test_client):
+    response = test_client.get('/stats/pool', headers=STATS_HEADERS)
+    assert response.status_code == 200
+    assert response.json['primary']['checkouts'] >= 1
+    assert response.json['primary']['connections']['open'] == 1
+
+
+def test_stats_key(app, test_client):
+    assert test_client.get('/stats/pool').status_code == 404
+    response = test_client.get('/stats/pool',
+                               headers={'X-Stats-Key': 'guess'})
+    assert response.status_code == 404
+
+    key = app.config['NOTES_STATS_KEY']
+    app.config['NOTES_STATS_KEY'] = None
+    try:
+        response = test_client.get('/stats/pool', headers=STATS_HEADERS)
+        assert response.status_code == 404
+    finally:
+        app.config['NOTES_STATS_KEY'] = key
+
+
+def test_error_stats(test_client):
+    user = db.session.get(User, '1')
+    token = user.encode_auth_token(user.id)
+
+    # Routing errors are client errors too.
+    response = test_client.get('/note/no_such_route')
+    assert response.status_code == 404
+    for _ in range(2):
+        response = test_client.get('/note/get_note/999999',
+                                   headers={'Authorization': token})
+        assert response.status_code == 404
+
+    counts = {entry['title']: entry['count'] for entry in
+              test_client.get('/stats/errors',
+                              headers=STATS_HEADERS).json['fingerprints']}
+    assert counts['404 not_found on note.get_note'] >= 2
+    assert counts['404 Not Found on None'] >= 1
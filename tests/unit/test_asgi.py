@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from notes.asgi import wsgi_environ
+from notes.pool import InstrumentedAsyncAdaptedQueuePool
+from notes.settings import ProdConfig
+from notes.settings import TestConfig
+from notes.settings import async_database_uri
+from notes.settings import use_async_drivers
+
+
+class AsyncConfig(ProdConfig):
+    SQLALCHEMY_DATABASE_URI = 'postgresql://u:p@host/notes'
+    NOTES_ASYNC = True
+
+
+class TestAsgi(TestCase):
+    def test_wsgi_environ(self):
+        environ = wsgi_environ({
+            'type': 'http',
+            'method': 'POST',
+            'root_path': '/api',
+            'path': '/api/note/create_note',
+            'query_string': b'stream=1',
+            'server': ('notes', 5000),
+            'client': ('10.0.0.1', 4242),
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'authorization', b'token'),
+                (b'cookie', b'a=1'),
+                (b'cookie', b'b=2'),
+            ],
+        }, b'{}')
+
+        assert environ['SCRIPT_NAME'] == '/api'
+        assert environ['PATH_INFO'] == '/note/create_note'
+        assert environ['QUERY_STRING'] == 'stream=1'
+        assert environ['SERVER_PORT'] == '5000'
+        assert environ['REMOTE_ADDR'] == '10.0.0.1'
+        assert environ['CONTENT_TYPE'] == 'application/json'
+        assert environ['HTTP_AUTHORIZATION'] == 'token'
+        assert environ['HTTP_COOKIE'] == 'a=1; b=2'
+        assert environ['wsgi.input'].read() == b'{}'
+
+    def test_async_database_uri(self):
+        assert async_database_uri('postgresql+psycopg2://u:p@host/notes') == \
+            'postgresql+asyncpg://u:p@host/notes'
+        assert async_database_uri('sqlite:///') == 'sqlite+aiosqlite:///'
+
+    def test_use_async_drivers(self):
+        config = {
+            'SQLALCHEMY_DATABASE_URI': 'postgresql://u:p@primary/notes',
+            'NOTES_REPLICA_URIS': ['postgresql://u:p@replica/notes'],
+        }
+        use_async_drivers(config)
+
+        assert config['SQLALCHEMY_DATABASE_URI'].startswith(
+            'postgresql+asyncpg://')
+        assert config['NOTES_REPLICA_URIS'][0].startswith(
+            'postgresql+asyncpg://')
+
+    def test_engine_options(self):
+        assert AsyncConfig().engine_options['poolclass'] is \
+            InstrumentedAsyncAdaptedQueuePool
+
+        config = TestConfig()
+        config.NOTES_ASYNC = True
+        # The in-memory database is shared by the connections.
+        assert 'poolclass' in config.engine_options
@@ -1,14 +1,14 @@
 import copy
 import os
-import base64
 from unittest import TestCase
 
 from flexmock import flexmock
-from sqlalchemy.orm.query import Query
 
 from notes.app import create_app
 from notes.auth import controller
 from notes.auth import utils as auth_utils
+from notes.extensions import db
+from notes.extensions import passwords
 from tests.fixtures import unit_test_fixtures
 
 os.environ["POSTGRES_USER"] = 'postgres'
@@ -36,11 +36,12 @@ class TestController(TestCase):
                 'password': user.password
             }
             token = 'token'
-            user.password = base64.b64encode(user.password.encode('ascii')).decode('ascii')
+            user.password = passwords.hash(user.password)
             # User
-            flexmock(Query). \
-                should_receive('first'). \
-                and_return(user)
+            flexmock(db.session). \
+                should_receive('execute'). \
+                and_return(flexmock(one_or_none=lambda: user)). \
+                once()
 
             flexmock(auth_utils). \
                 should_receive('encode_auth_token'). \
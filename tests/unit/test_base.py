@@ -0,0 +1,70 @@
+import os
+from unittest import TestCase
+
+from flexmock import flexmock
+
+from notes.app import create_app
+from notes.domain.base import BaseModel
+from notes.domain.models import NoteTombstone
+from notes.extensions import db
+
+os.environ["POSTGRES_USER"] = 'postgres'
+os.environ["POSTGRES_PASSWORD"] = 'postgres'
+os.environ["POSTGRES_HOSTNAME"] = 'postgres'
+os.environ["POSTGRES_DB"] = 'notes'
+
+app = create_app()
+app.app_context().push()
+
+
+class TestBaseModel(TestCase):
+    def tombstone(self):
+        return NoteTombstone(note_id=1, user_id='1',
+                             reason=NoteTombstone.DELETED)
+
+    def test_add(self):
+        with app.app_context():
+            flexmock(db.session).should_receive('add').twice()
+            flexmock(db.session).should_receive('flush').once()
+
+            self.tombstone().add()
+            self.tombstone().add(autoflush=False)
+
+    def test_unit_of_work(self):
+        with app.app_context():
+            flexmock(db.session).should_receive('add').times(3)
+            flexmock(db.session).should_receive('flush').once()
+            flexmock(db.session).should_receive('commit').never()
+
+            with BaseModel.unit_of_work(commit=False):
+                self.tombstone().add()
+                # Nested blocks leave the flush to the outermost one.
+                with BaseModel.unit_of_work():
+                    self.tombstone().add()
+                    assert BaseModel.in_unit_of_work()
+                self.tombstone().update(reason=NoteTombstone.UNSHARED)
+
+            assert not BaseModel.in_unit_of_work()
+
+    def test_unit_of_work_autoflush(self):
+        with app.app_context():
+            flexmock(db.session).should_receive('add').once()
+            flexmock(db.session).should_receive('flush').once()
+            flexmock(db.session).should_receive('commit').once()
+
+            # Generated keys needed within the block are still flushed.
+            with BaseModel.unit_of_work():
+                self.tombstone().add(autoflush=True)
+
+    def test_unit_of_work_error(self):
+        with app.app_context():
+            flexmock(db.session).should_receive('add').once()
+            flexmock(db.session).should_receive('commit').never()
+            flexmock(db.session).should_receive('rollback').once()
+
+            with self.assertRaises(ValueError):
+                with BaseModel.unit_of_work():
+                    self.tombstone().add()
+                    raise ValueError()
+
+            assert not BaseModel.in_unit_of_work()
@@ -0,0 +1,177 @@
+from unittest import TestCase
+
+from notes.cache import LRUCache
+from notes.cache import NoteListingCache
+from notes.cache import TokenCache
+from notes.cache import UserLookupCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        evicted = []
+        cache = LRUCache(maxsize=2, on_evict=lambda key, value:
+                         evicted.append(key))
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+
+        assert evicted == ['b']
+        assert 'b' not in cache
+        assert len(cache) == 2
+        assert cache.stats()['evictions'] == 1
+
+    def test_expires_entries(self):
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set('a', 1)
+        clock.now = 9
+        assert cache.get('a') == 1
+        clock.now = 10
+        assert cache.get('a') is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['expirations'] == 1
+        assert stats['size'] == 0
+
+
+class TestNoteListingCache(TestCase):
+    def setUp(self):
+        self.cache = NoteListingCache()
+        self.cache.enabled = True
+
+    def test_invalidate_notes(self):
+        self.cache.set('1', 'notes', {'shared_with_me': [7]}, depends_on=[7])
+        self.cache.set('2', 'notes', {'shared_with_me': []})
+
+        self.cache.invalidate_notes([7])
+
+        assert self.cache.get('1', 'notes') is None
+        assert self.cache.get('2', 'notes') == {'shared_with_me': []}
+
+    def test_skips_outdated_responses(self):
+        generation = self.cache.generation
+        self.cache.invalidate_users(['1'])
+        self.cache.set('1', 'notes', {}, generation=generation)
+
+        assert self.cache.get('1', 'notes') is None
+
+    def test_bounds_users_and_keys(self):
+        self.cache._users.maxsize = 2
+        self.cache.max_keys_per_user = 2
+        for user_id in ('1', '2', '3'):
+            self.cache.set(user_id, 'notes', {}, depends_on=[int(user_id)])
+        for key in ('a', 'b', 'c'):
+            self.cache.set('3', key, {})
+
+        assert self.cache.get('1', 'notes') is None
+        assert self.cache.get('3', 'a') is None
+        assert self.cache.get('3', 'c') == {}
+        assert 1 not in self.cache._dependents
+        assert self.cache.stats()['evictions'] == 1
+
+
+class User(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class TestTokenCache(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(clock=self.clock)
+        self.cache.enabled = True
+        self.cache._tokens.ttl = 60
+
+    def test_keyed_by_digest(self):
+        user = User('1')
+        self.cache.set('token', {'sub': '1', 'exp': 3600}, user)
+
+        assert self.cache.get('token') == ({'sub': '1', 'exp': 3600}, user)
+        assert self.cache.get('other') is None
+        assert 'token' not in self.cache._tokens
+        assert self.cache.stats()['hit_rate'] == 0.5
+
+    def test_expires_with_token(self):
+        self.cache.set('token', {'sub': '1', 'exp': 10}, User('1'))
+        self.clock.now = 10
+        assert self.cache.get('token') is None
+
+        # Expired tokens are not cached.
+        self.cache.set('token', {'sub': '1', 'exp': 5}, User('1'))
+        assert len(self.cache._tokens) == 0
+
+    def test_expires_after_ttl(self):
+        # Bounds how long changes made elsewhere are not seen.
+        self.cache._tokens.ttl = 5
+        self.cache.set('token', {'sub': '1', 'exp': 3600}, User('1'))
+        self.clock.now = 4
+        assert self.cache.get('token') is not None
+        self.clock.now = 5
+        assert self.cache.get('token') is None
+
+    def test_invalidate_users(self):
+        self.cache.set('a', {'sub': '1'}, User('1'))
+        self.cache.set('b', {'sub': '1'}, User('1'))
+        self.cache.set('c', {'sub': '2'}, User('2'))
+
+        self.cache.invalidate_users(['1'])
+
+        assert self.cache.get('a') is None
+        assert self.cache.get('b') is None
+        assert self.cache.get('c') is not None
+        assert '1' not in self.cache._digests
+        assert self.cache.stats()['invalidations'] == 2
+
+    def test_disabled(self):
+        self.cache.enabled = False
+        self.cache.set('token', {'sub': '1'}, User('1'))
+        assert self.cache.get('token') is None
+
+
+class TestUserLookupCache(TestCase):
+    def setUp(self):
+        self.cache = UserLookupCache()
+        self.cache.enabled = True
+
+    def test_get_many(self):
+        self.cache.set_many([{'id': '1', 'email': 'a@example.com'},
+                             {'id': '2', 'email': 'b@example.com'}])
+
+        assert self.cache.get_many(['a@example.com', 'c@example.com']) == {
+            'a@example.com': {'id': '1', 'email': 'a@example.com'}}
+
+    def test_invalidate_users(self):
+        self.cache.set_many([{'id': '1', 'email': 'a@example.com'},
+                             {'id': '2', 'email': 'b@example.com'}])
+
+        self.cache.invalidate_users(['1', '3'])
+
+        assert list(self.cache.get_many(['a@example.com',
+                                         'b@example.com'])) == [
+            'b@example.com']
+        assert '1' not in self.cache._emails
+        assert self.cache.stats()['invalidations'] == 1
+
+    def test_email_changed(self):
+        self.cache.set_many([{'id': '1', 'email': 'a@example.com'}])
+        self.cache.set_many([{'id': '1', 'email': 'b@example.com'}])
+
+        self.cache.invalidate_users(['1'])
+        assert self.cache.get_many(['a@example.com', 'b@example.com']) == {}
+        assert '1' not in self.cache._emails
+
+    def test_disabled(self):
+        self.cache.enabled = False
+        self.cache.set_many([{'id': '1', 'email': 'a@example.com'}])
+        assert self.cache.get_many(['a@example.com']) == {}
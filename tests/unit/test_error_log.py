@@ -0,0 +1,99 @@
+import logging
+from unittest import TestCase
+
+import pytest
+
+from notes.error_log import ErrorLog
+from notes.error_log import fingerprint
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail(value):
+    return 1 / value
+
+
+def raised(function, *args):
+    try:
+        function(*args)
+    except Exception as exc:
+        return exc
+
+
+class TestErrorLog(TestCase):
+    @pytest.fixture(autouse=True)
+    def capture(self, caplog):
+        self.caplog = caplog
+        caplog.set_level(logging.INFO)
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.log = ErrorLog(clock=self.clock)
+        self.log.window = 60
+
+    def test_fingerprint(self):
+        first = raised(fail, 0)
+        again = raised(fail, 0)
+        other = raised(int, 'one')
+
+        assert fingerprint(first) == fingerprint(again)
+        assert fingerprint(first) != fingerprint(other)
+
+    def test_server_errors_logged_once_per_window(self):
+        for _ in range(3):
+            self.log.server_error(raised(fail, 0))
+        self.clock.now = 60
+        self.log.server_error(raised(fail, 0))
+
+        records = self.caplog.records
+        assert len(records) == 2
+        assert records[0].levelno == logging.ERROR
+        assert 'ZeroDivisionError' in records[0].getMessage()
+        assert '(1 since last logged)' in records[0].getMessage()
+        assert '(3 since last logged)' in records[1].getMessage()
+
+        fingerprints = self.log.stats()['fingerprints']
+        assert len(fingerprints) == 1
+        assert fingerprints[0]['count'] == 4
+        assert fingerprints[0]['level'] == 'error'
+        assert fingerprints[0]['title'] == (
+            'builtins.ZeroDivisionError at tests/unit/test_error_log.py:'
+            f'{fail.__code__.co_firstlineno + 1} in fail')
+
+    def test_stats_without_messages(self):
+        def leak():
+            raise ValueError("INSERT INTO note_user VALUES ('a@b.c')")
+
+        self.log.server_error(raised(leak))
+
+        # Logged, but not served
+        assert 'a@b.c' in self.caplog.records[0].getMessage()
+        assert 'a@b.c' not in str(self.log.stats())
+
+    def test_client_errors_without_stack(self):
+        self.log.client_error(404, 'not_found', 'note.get_note')
+        self.log.client_error(404, 'not_found', 'note.get_note')
+        self.log.client_error(401, 'unauthorized', 'note.get_note')
+
+        records = self.caplog.records
+        assert [record.levelno for record in records] == [logging.INFO] * 2
+        assert records[0].getMessage() == (
+            '404 not_found on note.get_note (1 since last logged)')
+        assert all(record.exc_info is None for record in records)
+        assert [entry['count'] for entry in
+                self.log.stats()['fingerprints']] == [2, 1]
+
+    def test_bounds_fingerprints(self):
+        self.log.max_fingerprints = 2
+        for code in (400, 401, 403, 401):
+            self.log.client_error(code, 'key', 'endpoint')
+
+        assert [entry['title'] for entry in
+                self.log.stats()['fingerprints']] == [
+            '401 key on endpoint', '403 key on endpoint']
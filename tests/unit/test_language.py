@@ -0,0 +1,17 @@
+from unittest import TestCase
+
+from notes.domain import language
+
+
+class TestLanguage(TestCase):
+    def test_detect_language(self):
+        assert language.detect_language(
+            'an awesome text for my note') == 'en'
+        assert language.detect_language(
+            'Une note en français sur la cuisine et le vin') == 'fr'
+        assert language.detect_language('12345') == language.UNDETERMINED
+        assert language.detect_language(None) == language.UNDETERMINED
+
+    def test_search_config(self):
+        assert language.search_config('en') == 'english'
+        assert language.search_config(language.UNDETERMINED) == 'simple'
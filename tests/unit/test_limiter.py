@@ -0,0 +1,67 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from notes.limiter import MemoryStore
+from notes.limiter import SQLiteStore
+from notes.limiter import store_from_uri
+
+
+class TestMemoryStore(TestCase):
+    def store(self):
+        return MemoryStore()
+
+    def test_token_bucket(self):
+        store = self.store()
+        # 2 calls per 10 seconds: a token every 5 seconds.
+        assert store.hit('a', 2, 0.2, now=0) == 0
+        assert store.hit('a', 2, 0.2, now=0) == 0
+        assert store.hit('a', 2, 0.2, now=1) == 4
+        # Keys have their own bucket.
+        assert store.hit('b', 2, 0.2, now=1) == 0
+
+        assert store.hit('a', 2, 0.2, now=5) == 0
+        assert store.hit('a', 2, 0.2, now=5) > 0
+        # The bucket never holds more than its capacity.
+        assert store.hit('a', 2, 0.2, now=1000) == 0
+        assert store.hit('a', 2, 0.2, now=1000) == 0
+        assert store.hit('a', 2, 0.2, now=1000) > 0
+
+
+class TestMemoryStoreBounds(TestCase):
+    def test_drops_least_recently_used(self):
+        store = MemoryStore(maxsize=2)
+        store.hit('a', 1, 1, now=0)
+        store.hit('b', 1, 1, now=0)
+        store.hit('a', 1, 1, now=0)
+        store.hit('c', 1, 1, now=0)
+
+        assert list(store._buckets) == ['a', 'c']
+
+
+class TestSQLiteStore(TestMemoryStore):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'buckets.db')
+
+    def store(self):
+        return SQLiteStore(self.path)
+
+    def test_shared_between_stores(self):
+        first, second = self.store(), self.store()
+        assert first.hit('a', 1, 0.1, now=0) == 0
+        assert second.hit('a', 1, 0.1, now=0) == 10
+
+    def test_prunes_idle_buckets(self):
+        store = SQLiteStore(self.path, expire_after=60)
+        store.PRUNE_EVERY = 2
+        store.hit('a', 1, 0.1, now=0)
+        store.hit('b', 1, 0.1, now=100)
+
+        rows = store._connection().execute(
+            'SELECT key FROM rate_limit_bucket').fetchall()
+        assert rows == [('b', )]
+
+    def test_store_from_uri(self):
+        assert isinstance(store_from_uri('memory'), MemoryStore)
+        assert store_from_uri(f'sqlite:///{self.path}').path == self.path
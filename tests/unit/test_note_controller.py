@@ -3,12 +3,14 @@ import os
 import logging
 from flexmock import flexmock
 from unittest import TestCase
-from sqlalchemy.orm.query import Query
+from sqlalchemy.exc import IntegrityError
 from notes.app import create_app
+import notes.errors as error
 from notes.note import controller
+from notes.note import queries
 from notes.domain.models import Notes
-from notes.domain.models import NoteShare
 from notes.extensions import db
+from notes.extensions import note_cache
 from tests.fixtures import unit_test_fixtures
 
 os.environ["POSTGRES_USER"] = 'postgres'
@@ -24,6 +26,9 @@ class TestController(TestCase):
     def setup_class(self):
         self.controller = controller
 
+    def setUp(self):
+        note_cache.clear()
+
     def test_create_note(self):
         with app.app_context():
             user = copy.deepcopy(unit_test_fixtures.user)
@@ -48,8 +53,9 @@ class TestController(TestCase):
                 'note_description': note.note_description
             }
 
-            flexmock(Query). \
-                should_receive('first').\
+            flexmock(queries). \
+                should_receive('owned_note').\
+                with_args(user.id, note.note_id).\
                 and_return(note)
 
             returned_value = self.controller.get_note(user, note.note_id)
@@ -61,33 +67,97 @@ class TestController(TestCase):
             note = copy.deepcopy(unit_test_fixtures.note)
             note_list = [{}]
             note_list[0] = note
-            flexmock(Notes). \
-                should_receive('query.filter.all').\
+            flexmock(queries). \
+                should_receive('owned_notes').\
                 and_return(note_list)
-            
-            flexmock(NoteShare). \
-                should_receive('query.filter.all').\
+
+            flexmock(queries). \
+                should_receive('shared_notes').\
                 and_return([])
 
             returned_value = self.controller.get_all_notes(user)
             logging.info(returned_value)
             assert returned_value['my_notes'][0]['note_id'] == note.note_id
+            assert returned_value['next_cursor'] is None
+
+    def test_get_all_notes_paginated(self):
+        with app.app_context():
+            user = copy.deepcopy(unit_test_fixtures.user)
+            note = copy.deepcopy(unit_test_fixtures.note)
+            note2 = copy.deepcopy(unit_test_fixtures.note2)
+            flexmock(queries). \
+                should_receive('owned_notes').\
+                with_args(user.id, None, 2).\
+                and_return([note, note2]).\
+                once()
+
+            flexmock(queries). \
+                should_receive('shared_notes').\
+                with_args(user.id, None, 2).\
+                and_return([note2]).\
+                once()
+
+            returned_value = self.controller.get_all_notes(user, limit='1')
+            assert len(returned_value['my_notes']) == 1
+            assert len(returned_value['shared_with_me']) == 1
+
+            # Only the owned notes continue on the next page.
+            flexmock(queries). \
+                should_receive('owned_notes').\
+                with_args(user.id, note.note_id, 2).\
+                and_return([note2]).\
+                once()
+
+            flexmock(queries). \
+                should_receive('shared_notes').\
+                never()
+
+            returned_value = self.controller.get_all_notes(
+                user, limit='1', cursor=returned_value['next_cursor'])
+            assert returned_value['my_notes'][0]['note_id'] == note2.note_id
+            assert returned_value['shared_with_me'] == []
+            assert returned_value['next_cursor'] is None
+
+    def test_get_all_notes_invalid_cursor(self):
+        with app.app_context():
+            user = copy.deepcopy(unit_test_fixtures.user)
+
+            with self.assertRaises(error.BadRequest):
+                self.controller.get_all_notes(user, cursor='not a cursor')
+
+            with self.assertRaises(error.BadRequest):
+                self.controller.get_all_notes(user, limit='0')
 
     def test_delete_note(self):
         with app.app_context():
             user = copy.deepcopy(unit_test_fixtures.user)
             note = copy.deepcopy(unit_test_fixtures.note)
-            flexmock(Query). \
-                should_receive('first').\
-                and_return(note)
-            
-            flexmock(Notes).should_receive('delete')
+            flexmock(queries).should_receive('record_deletions').once()
+            flexmock(db.session). \
+                should_receive('execute').\
+                and_return(flexmock(scalar=lambda: note.note_id)).once()
             flexmock(db.session). \
                 should_receive('commit')
 
 
             self.controller.delete_note(user, note.note_id)
 
+    def test_delete_note_not_found(self):
+        with app.app_context():
+            user = copy.deepcopy(unit_test_fixtures.user)
+
+            flexmock(queries).should_receive('record_deletions').once()
+            flexmock(db.session). \
+                should_receive('execute').\
+                and_return(flexmock(scalar=lambda: None)).once()
+            flexmock(db.session). \
+                should_receive('rollback').once()
+            flexmock(db.session). \
+                should_receive('commit').never()
+
+            with self.assertRaises(error.NotFound):
+                self.controller.delete_note(user, 20)
+
     def test_update_note(self):
         with app.app_context():
             user = copy.deepcopy(unit_test_fixtures.user)
@@ -96,35 +166,68 @@ class TestController(TestCase):
                 'note_description': 'some new cool text'
             }
 
-            flexmock(Query). \
-                should_receive('first').\
-                and_return(note)
-            
+            note.note_description = body['note_description']
+            note.version = 2
+
+            flexmock(db.session). \
+                should_receive('execute').\
+                and_return(flexmock(one_or_none=lambda: note)).once()
             flexmock(db.session). \
                 should_receive('commit')
 
             returned_value = self.controller.update_note(user, note.note_id, body)
             assert returned_value['note_description'] == body['note_description']
+            assert returned_value['version'] == 2
+
+    def test_update_note_modified(self):
+        with app.app_context():
+            user = copy.deepcopy(unit_test_fixtures.user)
+            body = {
+                'note_description': 'some new cool text'
+            }
+
+            flexmock(db.session). \
+                should_receive('execute').\
+                and_return(flexmock(one_or_none=lambda: None))
+            flexmock(db.session).should_receive('rollback')
+            flexmock(queries). \
+                should_receive('note_version').\
+                with_args(user.id, 1).\
+                and_return(3)
+
+            with self.assertRaises(error.PreconditionFailed):
+                self.controller.update_note(user, 1, body, expected_version=2)
 
     def test_search_notes(self):
         with app.app_context():
             user = copy.deepcopy(unit_test_fixtures.user)
             note = copy.deepcopy(unit_test_fixtures.note)
-            note_list = [{}]
-            note_list[0] = note
+            note.rank = -1.5
+            note.snippet = 'some <mark>cool</mark> note'
             body = {
                 'query': 'cool'
             }
-            flexmock(Notes). \
-                should_receive('query.filter.all').\
-                and_return(note_list)
-            
-            flexmock(NoteShare). \
-                should_receive('query.filter.all').\
+            flexmock(queries). \
+                should_receive('search_notes').\
+                with_args(user.id, object, after=None, limit=101).\
+                and_return([note])
+
+            flexmock(queries). \
+                should_receive('search_notes').\
+                with_args(user.id, object, shared=True, after=None,
+                          limit=101).\
                 and_return([])
 
             returned_value = self.controller.search_note(user, body)
             assert returned_value['my_notes'][0]['note_id'] == note.note_id
+            assert returned_value['my_notes'][0]['snippet'] == note.snippet
+
+    def test_search_notes_empty_query(self):
+        with app.app_context():
+            user = copy.deepcopy(unit_test_fixtures.user)
+
+            with self.assertRaises(error.BadRequest):
+                self.controller.search_note(user, {'query': ' "" '})
 
 
     def test_share_note(self):
@@ -136,18 +239,38 @@ class TestController(TestCase):
                 'note_description': note.note_description
             }
 
-            flexmock(Query). \
-                should_receive('first').\
-                and_return(user2)
-            
-            flexmock(Query). \
-                should_receive('first').\
-                and_return(note)
-            
-            flexmock(NoteShare).should_receive('add').and_return(note)
+            flexmock(db.session). \
+                should_receive('execute').\
+                and_return(flexmock(one_or_none=lambda: note)).once()
+
+            flexmock(controller). \
+                should_receive('_insert_shares').\
+                with_args([{'note_id': note.note_id, 'user_id': user2.id}]).\
+                and_return([(note.note_id, user2.id)]).\
+                once()
 
             flexmock(db.session). \
                 should_receive('commit')
 
             returned_value = self.controller.share_note(user, note.note_id, user2.id)
-            assert returned_value['note_description'] == body['note_description']
\ No newline at end of file
+            assert returned_value['note_description'] == body['note_description']
+            assert returned_value['share_id'] == user2.id
+
+    def test_share_note_invalid_user(self):
+        with app.app_context():
+            user = copy.deepcopy(unit_test_fixtures.user)
+            note = copy.deepcopy(unit_test_fixtures.note)
+
+            flexmock(db.session). \
+                should_receive('execute').\
+                and_return(flexmock(one_or_none=lambda: note)).once()
+
+            flexmock(controller). \
+                should_receive('_insert_shares').\
+                and_raise(IntegrityError('INSERT', {}, Exception()))
+
+            flexmock(db.session). \
+                should_receive('rollback').once()
+
+            with self.assertRaises(error.BadRequest):
+                self.controller.share_note(user, note.note_id, 'unknown')
@@ -27,4 +27,12 @@ class TestUtils(TestCase):
             }
  
             returned_value = self.utils.note_to_dict(note)
-            assert returned_value == body
\ No newline at end of file
+            assert returned_value == body
+
+    def test_validate_note_body(self):
+        assert self.utils.validate_note_body(
+            {'note_description': 'a note'}) is None
+        assert self.utils.validate_note_body({}) is not None
+        assert self.utils.validate_note_body(['a note']) is not None
+        assert self.utils.validate_note_body(
+            {'note_description': 'x' * 513}) is not None
@@ -0,0 +1,89 @@
+import base64
+import threading
+from unittest import TestCase
+
+import pytest
+
+import notes.errors as error
+from notes.passwords import PasswordHasher
+from notes.passwords import decode
+
+
+class TestPasswordHasher(TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher()
+        self.hasher.iterations = 1000
+        self.hasher.workers = 2
+
+    def tearDown(self):
+        self.hasher.shutdown()
+
+    def test_hash(self):
+        stored = self.hasher.hash('secret')
+
+        assert stored.startswith('$pbkdf2-sha512$1000$')
+        digest, iterations, salt, checksum = decode(stored)
+        assert (digest, iterations) == ('sha512', 1000)
+        assert len(salt) == 16
+        assert len(checksum) == 64
+        # Salted
+        assert self.hasher.hash('secret') != stored
+
+    def test_verify(self):
+        stored = self.hasher.hash('sécret')
+
+        assert self.hasher.verify('sécret', stored)
+        assert not self.hasher.verify('secret', stored)
+        assert not self.hasher.verify(None, stored)
+        assert not self.hasher.verify('sécret', None)
+        assert not self.hasher.needs_rehash(stored)
+
+    def test_decode(self):
+        # Salts and checksums are in the base64 of passlib: "." for "+"
+        # and no padding.
+        digest, iterations, salt, checksum = decode(
+            '$pbkdf2-sha256$29000$N2ZMqZVyjrE2Bg$.5nQ8RCcC8s')
+
+        assert (digest, iterations) == ('sha256', 29000)
+        assert salt == base64.b64decode('N2ZMqZVyjrE2Bg==')
+        assert checksum == base64.b64decode('+5nQ8RCcC8s=')
+        assert decode('not a hash') is None
+        assert decode('$pbkdf2-sha512$many$salt$hash') is None
+
+    def test_legacy(self):
+        stored = base64.b64encode(b'test').decode('ascii')
+
+        assert self.hasher.verify('test', stored)
+        assert not self.hasher.verify('tests', stored)
+        assert not self.hasher.verify('test', '$not base64$')
+        assert self.hasher.needs_rehash(stored)
+
+    def test_needs_rehash(self):
+        stored = self.hasher.hash('secret')
+        self.hasher.iterations = 2000
+
+        # Verified with the iterations it was hashed with
+        assert self.hasher.verify('secret', stored)
+        assert self.hasher.needs_rehash(stored)
+
+    def test_max_pending(self):
+        self.hasher.max_pending = 1
+        self.hasher._slots = threading.BoundedSemaphore(1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        waiting = threading.Thread(target=self.hasher._run, args=(block, ))
+        waiting.start()
+        started.wait()
+
+        with pytest.raises(error.ServiceUnavailable):
+            self.hasher.hash('secret')
+        assert self.hasher.stats()['rejections'] == 1
+
+        release.set()
+        waiting.join()
+        assert self.hasher.verify('secret', self.hasher.hash('secret'))
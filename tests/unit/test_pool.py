@@ -0,0 +1,111 @@
+import contextlib
+import os
+import sqlite3
+from unittest import TestCase
+
+import pytest
+from flexmock import flexmock
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+
+import notes.app
+from notes.extensions import db
+from notes.pool import Histogram
+from notes.pool import InstrumentedQueuePool
+from notes.pool import PoolMetrics
+from notes.pool import pool_size
+from notes.pool import worker_count
+from notes.settings import ProdConfig
+
+os.environ["POSTGRES_USER"] = 'postgres'
+os.environ["POSTGRES_PASSWORD"] = 'postgres'
+os.environ["POSTGRES_HOSTNAME"] = 'postgres'
+os.environ["POSTGRES_DB"] = 'notes'
+
+
+class TestPool(TestCase):
+    def test_pool_size(self):
+        assert pool_size(90, 1) == (45, 45)
+        assert pool_size(90, 4) == (11, 11)
+        assert pool_size(90, 5) == (9, 9)
+        # A connection per thread is kept open.
+        assert pool_size(90, 4, threads=4) == (4, 18)
+        assert pool_size(6, 2, threads=4) == (3, 0)
+        # Every worker needs a connection.
+        with self.assertRaises(ValueError):
+            pool_size(2, 4)
+
+    def test_worker_count(self):
+        assert worker_count(90, threads=4, cpus=2) == 5
+        # Bounded by a connection per thread
+        assert worker_count(90, threads=4, cpus=64) == 22
+        assert worker_count(2, threads=4, cpus=8) == 1
+
+    def test_engine_options(self):
+        config = ProdConfig()
+        config.NOTES_WORKERS = 3
+
+        options = config.engine_options
+        assert options['poolclass'] is InstrumentedQueuePool
+        assert options['pool_size'] + options['max_overflow'] == 30
+        assert options['pool_pre_ping']
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+
+        stats = histogram.stats()
+        assert stats['buckets'] == {'0.1': 2, '1.0': 3, '+Inf': 4}
+        assert stats['count'] == 4
+        assert stats['max'] == 3.0
+
+    def test_metrics(self):
+        engine = create_engine(
+            'sqlite://', poolclass=InstrumentedQueuePool, pool_size=1,
+            max_overflow=0, pool_timeout=0.01,
+            creator=lambda: sqlite3.connect(':memory:'))
+        metrics = PoolMetrics()
+        metrics.instrument('primary', engine)
+
+        connection = engine.connect()
+        stats = metrics.stats()['primary']
+        assert stats['checked_out'] == 1
+        assert stats['connects'] == 1
+        assert stats['connections']['open'] == 1
+
+        # The pool is exhausted: the next checkout times out.
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        stats = metrics.stats()['primary']
+        assert stats['timeouts'] == 1
+        assert stats['wait']['count'] == 2
+        assert stats['wait']['max'] >= 0.01
+
+        connection.close()
+        assert metrics.stats()['primary']['checked_out'] == 0
+
+        engine.dispose()
+        assert metrics.stats()['primary']['connections']['open'] == 0
+
+    def test_reset_after_fork(self):
+        engine = create_engine(
+            'sqlite://', poolclass=InstrumentedQueuePool, pool_size=1,
+            creator=lambda: sqlite3.connect(':memory:'))
+        metrics = PoolMetrics()
+        metrics.instrument('primary', engine)
+        engine.connect().close()
+        inherited = engine.pool
+
+        flexmock(notes.app, pool_metrics=metrics)
+        app = flexmock(app_context=lambda: contextlib.nullcontext())
+        flexmock(db).should_receive('engines').and_return({None: engine})
+        notes.app.reset_after_fork(app)
+
+        # The connection of the parent is left open, for the parent.
+        assert engine.pool is not inherited
+        assert inherited.checkedin() == 1
+        assert engine.pool.checkedin() == 0
+        stats = metrics.stats()['primary']
+        assert stats['connects'] == 0
+        assert stats['connections']['open'] == 0
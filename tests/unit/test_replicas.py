@@ -0,0 +1,103 @@
+from unittest import TestCase
+
+from flask import Flask
+from flexmock import flexmock
+from sqlalchemy import select
+from sqlalchemy import update
+
+from notes.domain.models import Notes
+from notes.replicas import STICKY_HEADER
+from notes.replicas import ReplicaRouter
+from notes.replicas import _is_read
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.router = ReplicaRouter(clock=self.clock)
+        self.router.bind_keys = ['replica_0', 'replica_1']
+        self.lags = {'replica_0': 0.0, 'replica_1': 0.5}
+        flexmock(self.router).should_receive('_measure_lag').replace_with(
+            lambda bind_key: self.lags[bind_key])
+        # Measured in the background in the app: refreshed at once here.
+        flexmock(self.router).should_receive('_start_refresh').replace_with(
+            self.router.refresh_lags)
+
+    def test_choose(self):
+        assert [self.router.choose() for _ in range(3)] == \
+            ['replica_0', 'replica_1', 'replica_0']
+
+    def test_choose_disabled(self):
+        self.router.bind_keys = []
+        assert self.router.choose() is None
+
+    def test_sticky(self):
+        self.router.record_write('1')
+        assert self.router.choose('1') is None
+        assert self.router.choose('2') is not None
+
+        self.clock.now += self.router.sticky_seconds
+        assert self.router.choose('1') is not None
+
+    def test_sticky_header(self):
+        """The time returned on a write keeps another worker on the
+        primary, when the client sends it back."""
+        app = Flask(__name__)
+        until = self.clock.now + self.router.sticky_seconds
+
+        for value, sticky in ((until, True), (self.clock.now, False),
+                              (until + 3600, False), ('soon', False)):
+            with app.test_request_context(
+                    headers={STICKY_HEADER: str(value)}):
+                assert self.router.is_sticky('1') is sticky
+
+    def test_lag_in_background(self):
+        """Requests never wait for the lag to be measured."""
+        refreshes = []
+        flexmock(self.router).should_receive('_start_refresh').replace_with(
+            lambda: refreshes.append(self.clock.now))
+
+        # Not measured yet: read from the primary meanwhile.
+        assert self.router.choose() is None
+        assert len(refreshes) == 2
+
+        self.router.refresh_lags()
+        del refreshes[:]
+        assert self.router.choose() is not None
+        assert refreshes == []
+
+        # The last measure serves until the refresh completes.
+        self.lags['replica_0'] = 10.0
+        self.clock.now += self.router.lag_check_interval
+        assert self.router.healthy('replica_0')
+        assert refreshes
+
+    def test_lag(self):
+        self.lags['replica_0'] = 10.0
+        assert [self.router.choose() for _ in range(2)] == \
+            ['replica_1', 'replica_1']
+
+        # Until the next check, the lag measured last is used.
+        self.lags['replica_1'] = None
+        assert self.router.choose() == 'replica_1'
+
+        self.clock.now += self.router.lag_check_interval
+        assert self.router.choose() is None
+
+        self.lags['replica_0'] = 1.0
+        self.clock.now += self.router.lag_check_interval
+        assert self.router.choose() == 'replica_0'
+
+    def test_is_read(self):
+        assert _is_read(select(Notes))
+        assert not _is_read(select(Notes).with_for_update())
+        assert not _is_read(update(Notes).values(note_description='a'))
+        assert not _is_read(None)
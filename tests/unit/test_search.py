@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from sqlalchemy.dialects import postgresql
+
+from notes.domain import search
+
+
+class TestParseQuery(TestCase):
+    def test_words(self):
+        terms = search.parse_query('Cool Note')
+        assert terms == [
+            search.Term(('cool', ), False),
+            search.Term(('note', ), False)
+        ]
+
+    def test_phrase_and_prefix(self):
+        terms = search.parse_query('"very cool" not*')
+        assert terms == [
+            search.Term(('very', 'cool'), False),
+            search.Term(('not', ), True)
+        ]
+
+    def test_prefix_inside_phrase(self):
+        terms = search.parse_query('"very co*"')
+        assert terms == [search.Term(('very', 'co'), True)]
+
+    def test_punctuation_is_dropped(self):
+        terms = search.parse_query('\'); DROP TABLE notes; -- ""')
+        assert terms == [
+            search.Term(('drop', ), False),
+            search.Term(('table', ), False),
+            search.Term(('notes', ), False)
+        ]
+
+
+class TestRenderQuery(TestCase):
+    def setup_class(self):
+        self.terms = search.parse_query('"very cool" not*')
+
+    def test_to_tsquery_text(self):
+        assert search.to_tsquery_text(self.terms) == \
+            '(very <-> cool) & (not:*)'
+
+    def test_to_fts5_query(self):
+        assert search.to_fts5_query(self.terms) == '"very cool" AND "not"*'
+
+    def test_postgres_language_configs(self):
+        backend = search.PostgresSearch(self.terms)
+        statement = str(backend.match().compile(dialect=postgresql.dialect()))
+
+        assert statement.count('to_tsquery') == len(backend.configs)
+        assert "WHEN 'en' THEN 'english'::regconfig" in \
+            search.POSTGRES_DDL[0]
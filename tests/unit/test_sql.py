@@ -1,5 +1,8 @@
 from unittest import TestCase
 
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+
 from notes.domain.sql import CurrentTimestampMicros
 from notes.domain.sql import DateTimeMicros
 
@@ -12,3 +15,10 @@ class TestDateTimeMicros(TestCase):
 class TestCurrentTimestampMicros(TestCase):
     def setup_class(self):
         self.ctmicros = CurrentTimestampMicros
+
+    def test_compile(self):
+        assert str(CurrentTimestampMicros().compile(
+            dialect=postgresql.dialect())) == \
+            "(statement_timestamp() AT TIME ZONE 'UTC')"
+        assert 'strftime' in str(CurrentTimestampMicros().compile(
+            dialect=sqlite.dialect()))
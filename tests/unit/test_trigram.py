@@ -0,0 +1,84 @@
+import datetime
+from unittest import TestCase
+
+from notes import trigram
+from notes.trigram import TrigramIndex
+
+
+def at(second):
+    return datetime.datetime(2026, 1, 1) + datetime.timedelta(seconds=second)
+
+
+class TestTrigram(TestCase):
+    def test_trigrams(self):
+        assert trigram.trigrams('HeLLo') == {'hel', 'ell', 'llo'}
+        assert trigram.trigrams('hi') == set()
+
+    def test_substring_distance(self):
+        assert trigram.substring_distance('Cool', 'a very cool note', 0) == 0
+        assert trigram.substring_distance('colo', 'a very cool note', 1) == 1
+        assert trigram.substring_distance('cuul', 'a very cool note', 1) is None
+        assert trigram.substring_distance('cuul', 'a very cool note', 2) == 2
+
+
+class TestTrigramIndex(TestCase):
+    def setUp(self):
+        self.index = TrigramIndex()
+        self.index.enabled = True
+        self.index.build([(1, 'a very cool note'),
+                          (2, 'an awesome text for note'),
+                          (3, 'groceries: milk, eggs')], at(10))
+
+    def test_candidates(self):
+        assert self.index.candidates('cool', {1, 2, 3}) == {1}
+        assert self.index.candidates('note', {1, 2, 3}) == {1, 2}
+        # Visibility is applied against the index.
+        assert self.index.candidates('note', {2, 3}) == {2}
+        # Too short to use the index.
+        assert self.index.candidates('no', {1, 2}) == {1, 2}
+
+    def test_fuzzy_candidates(self):
+        assert self.index.candidates('grocerise', {1, 2, 3}) == set()
+        assert self.index.candidates('grocerise', {1, 2, 3},
+                                     max_distance=1) == {3}
+
+    def test_catch_up(self):
+        self.index.catch_up([(4, 'cool beans', at(11), at(11)),
+                             (1, 'a warm note', at(0), at(12))],
+                            [2], at(13), at(9))
+
+        assert self.index.candidates('cool', {1, 2, 3, 4}) == {1, 4}
+        assert self.index.candidates('warm', {1, 2, 3, 4}) == {1}
+        assert self.index.candidates('awesome', {1, 2, 3, 4}) == set()
+        stats = self.index.stats()
+        assert stats['notes'] == 3
+        assert stats['stale'] == 2
+        assert stats['watermark'] == at(13).isoformat()
+
+    def test_catch_up_overlap(self):
+        self.index.catch_up([(4, 'cool beans', at(11), at(12.8))], [2],
+                            at(13), at(9))
+        # Read again from before the watermark, along with a write that
+        # committed late and a newer one.
+        self.index.catch_up([(4, 'cool beans', at(11), at(12.8)),
+                             (5, 'late cool', at(12.5), at(12.5)),
+                             (1, 'a warm note', at(0), at(14))],
+                            [2], at(15), at(12))
+
+        assert self.index.candidates('cool', {1, 4, 5}) == {1, 4, 5}
+        assert self.index.candidates('warm', {1, 4, 5}) == {1}
+        stats = self.index.stats()
+        assert stats['notes'] == 4
+        assert stats['stale'] == 2
+
+    def test_needs_rebuild(self):
+        self.index.rebuild_ratio = 0.5
+        self.index.catch_up([], [1], at(11), at(9))
+        assert not self.index.needs_rebuild()
+        self.index.catch_up([], [2], at(12), at(10))
+        assert self.index.needs_rebuild()
+
+    def test_disabled(self):
+        index = TrigramIndex()
+        index.catch_up([(1, 'cool', at(0), at(0))], [], at(1), at(0))
+        assert index.stats()['notes'] == 0
@@ -0,0 +1,21 @@
+import json
+from unittest import TestCase
+
+from notes import utils
+
+
+class TestUtils(TestCase):
+    def test_stream_json_object(self):
+        chunks = utils.stream_json_object([
+            ('first', iter([[{'a': 1}, {'a': 2}], [], [{'a': 3}]])),
+            ('second', iter([])),
+        ])
+
+        assert json.loads(''.join(chunks)) == {
+            'first': [{'a': 1}, {'a': 2}, {'a': 3}],
+            'second': []
+        }
+
+    def test_make_etag(self):
+        assert utils.make_etag('note', 1, 2) == utils.make_etag('note', 1, 2)
+        assert utils.make_etag('note', 1, 2) != utils.make_etag('note', 1, 3)